@@ -1,19 +1,40 @@
 # app.py
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, session, jsonify, stream_with_context
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 import os
-import cv2
-import hashlib
-import threading
-import whisper
-from pydub import AudioSegment
-from config import SECRET_KEY, SQLALCHEMY_DATABASE_URI, SQLALCHEMY_TRACK_MODIFICATIONS, UPLOAD_FOLDER, THUMBNAIL_FOLDER, LOG_FILE, LOG_LEVEL, DB_PROVIDER, DB_NAME
+import uuid
+import mimetypes
+import time
+import click
+from urllib.parse import quote
+from sqlalchemy import func
+from config import SECRET_KEY, SQLALCHEMY_DATABASE_URI, SQLALCHEMY_TRACK_MODIFICATIONS, UPLOAD_FOLDER, THUMBNAIL_FOLDER, HLS_FOLDER, LOG_FILE, LOG_LEVEL, DB_PROVIDER, DB_NAME, WHISPER_MODEL, WHISPER_MODELS, UPLOAD_CHUNK_SIZE, QUERY_COUNT_HEADER, DERIVATIVE_VERSIONS, TAG_FACET_TTL, METRICS_ENABLED, METRICS_ALLOWED_IPS
+from models import db, User, Video, UploadSession, UploadChunk, Fingerprint, ensure_schema
+from jobs import enqueue_job
+from auth import get_current_user, login_user, logout_user, refresh_session, expire_sessions
+from instrumentation import install_query_counter
+from metrics import install_request_metrics, observe_upload, request_elapsed, render_metrics
+from thumbnails import load_thumbnail_set, load_storyboard, thumbnail_files
+from webvtt import vtt_document
+from hls import MASTER_PLAYLIST, remove_video_files as remove_hls_files
+from delivery import media_response
+from derivatives import derivative_cache, transcript_params
+from transcripts import (EXPORT_FORMATS, replace_segments, copy_segments, delete_segments, has_segments,
+                         transcript_sections, text_sections, export_chunks, migrate_transcripts)
+from blobs import (acquire_blob, release_blob, video_storage_path, sibling_videos, copy_derived, pending_job_kinds,
+                   hand_over_jobs, migrate_to_blobs, restore_blob)
+from progress import ProgressHub, record_stage, delete_progress, load_progress, fallback_stream
+from duplicates import delete_fingerprint, near_duplicates_for
+from tags import parse_tag_names, tags_for_names, delete_orphan_tags, tag_facets
+from metadata import apply_media_info, copy_media_info, is_probed, backfill_media_info
+from probe import probe_media
+from listing import list_videos, listing_query, PAGE_SIZE, MAX_PAGE_SIZE
+from search import ensure_search_index, index_video, remove_video as remove_video_from_index, reindex_all, search_videos
+from storage import (IngestRequest, stage_upload, discard_staged, cleanup_request_temp_files,
+                     create_chunked_file, write_chunk, stage_chunked_file)
 import logging
 from logging.handlers import RotatingFileHandler
-import torch
-import json
 
 # Set up logging
 log_level = LOG_LEVEL.upper()
@@ -29,219 +50,191 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+app.request_class = IngestRequest  # Hash uploads while they are written to disk
 app.secret_key = SECRET_KEY
 app.config['SQLALCHEMY_DATABASE_URI'] = SQLALCHEMY_DATABASE_URI
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = SQLALCHEMY_TRACK_MODIFICATIONS
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['THUMBNAIL_FOLDER'] = THUMBNAIL_FOLDER
+app.config['HLS_FOLDER'] = HLS_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 12 * 1024 * 1024 * 1024  # 12GB limit
 app.config['DB_PROVIDER'] = DB_PROVIDER
 app.config['DB_NAME'] = DB_NAME
 
-db = SQLAlchemy(app)
-
-# Set FFmpeg paths for pydub
-from pydub import AudioSegment
-AudioSegment.ffmpeg = "/usr/bin/ffmpeg"
-AudioSegment.ffprobe = "/usr/bin/ffprobe"
-
-# Association table for many-to-many relationship between Video and Tag
-video_tags = db.Table('video_tags',
-    db.Column('video_id', db.Integer, db.ForeignKey('video.id'), primary_key=True),
-    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True)
-)
-
-# Models
-class User(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80), unique=True, nullable=False)
-    password_hash = db.Column(db.String(255), nullable=False)
-    is_admin = db.Column(db.Boolean, default=False)
-    theme = db.Column(db.String(20), default='light')
-
-class Video(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    title = db.Column(db.String(200), nullable=False)
-    filename = db.Column(db.String(200), nullable=False)
-    thumbnail = db.Column(db.String(200))
-    upload_date = db.Column(db.DateTime, default=lambda: datetime.utcnow().replace(second=0, microsecond=0))
-    notes = db.Column(db.Text)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    checksum = db.Column(db.String(64), nullable=False)
-    transcription = db.Column(db.Text, nullable=True)
-    transcription_status = db.Column(db.String(20), default=None)  # running, completed, failed, or None
-    tags = db.relationship('Tag', secondary=video_tags, backref=db.backref('videos', lazy='dynamic'))
-
-class Tag(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(50), unique=True, nullable=False)
-
-# Function to generate thumbnail from video
-def generate_thumbnail(video_path, output_path):
-    logger.debug(f"Generating thumbnail for {video_path} to {output_path}")
-    vidcap = cv2.VideoCapture(video_path)
-    
-    # Get video properties
-    fps = vidcap.get(cv2.CAP_PROP_FPS)  # Frames per second
-    frame_count = int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT))  # Total frames
-    duration_minutes = (frame_count / fps) / 60  # Duration in minutes
-    
-    # Decide which frame to use
-    if duration_minutes > 40:
-        target_time = 5 * 60  # 5 minutes in seconds
-        target_frame = int(fps * target_time)  # Frame at 5 minutes
-        logger.debug(f"Video duration {duration_minutes:.2f} minutes (>40), using frame at 5 minutes: {target_frame}")
+db.init_app(app)
+install_query_counter(app, header=QUERY_COUNT_HEADER)
+if METRICS_ENABLED:
+    install_request_metrics(app)
+progress_hub = ProgressHub(app)  # One progress poller per web process, shared by every open event stream
+
+# Uploads and HLS renditions live under static/ but are only served through
+# the access-checked /media/ routes
+@app.before_request
+def block_private_static():
+    if request.endpoint == 'static':
+        filename = os.path.normpath((request.view_args or {}).get('filename', ''))
+        if filename.split(os.sep)[0] in ('uploads', 'hls'):
+            return Response('Not found', status=404, mimetype='text/plain')
+
+# Prometheus metrics of every web and worker process (see metrics.py). There
+# is no login; only METRICS_ALLOWED_IPS may scrape, and nginx refuses the path.
+@app.route('/metrics')
+def metrics():
+    if not METRICS_ENABLED or request.remote_addr not in METRICS_ALLOWED_IPS:
+        return Response('Not found', status=404, mimetype='text/plain')
+    data, content_type = render_metrics()
+    return Response(data, headers={'Content-Type': content_type})
+
+# Mark a video as waiting for transcription and queue the job. A transcript of
+# the same content and model in the derivative cache is applied straight away
+# instead, unless force is set; returns None then.
+def queue_transcription(video, model=WHISPER_MODEL, force=False, commit=True, threads=None):
+    cached = derivative_cache.load_json('transcript', video.checksum, transcript_params(model)) if not force else None
+    if cached:
+        video.transcription = cached['text']
+        video.transcription_status = 'completed'
+        replace_segments(video.id, cached['segments'])
+        index_video(video)
+        if commit:
+            db.session.commit()
+        logger.info(f"Transcript of video {video.id} with '{model}' taken from the derivative cache")
+        return None
+    video.transcription_status = 'queued'
+    payload = {'model': model}
+    if force:
+        payload['force'] = True
+    if threads:
+        payload['threads'] = threads  # CPU threads for this job instead of TRANSCRIBE_THREADS
+    job = enqueue_job(video.id, 'transcribe', payload=payload, commit=commit)
+    if commit:
+        db.session.commit()
+    return job
+
+# Turn a staged upload into a Video: duplicate check, store the content, tags,
+# and queue the media work. Returns (status message, Video or None).
+# info is an ffprobe result the caller already has. The bulk importer passes
+# commit=False to add a batch of uploads in one transaction, and
+# transcribe=False to leave transcription for later.
+def register_upload(staged, original_filename, user, tags_input, notes, info=None, commit=True, transcribe=True):
+    checksum = staged.checksum
+    # A user uploading the same file twice is refused; other users' copies
+    # share the stored content and its derived files (see blobs.py)
+    if db.session.query(Video).filter_by(checksum=checksum, user_id=user.id).first():
+        discard_staged(staged)
+        logger.debug(f"Duplicate video detected for user {user.username}: {original_filename}")
+        return 'Duplicate detected', None
+
+    safe_filename = original_filename.replace(' ', '_').replace('[', '').replace(']', '').replace('/', '_')
+    filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{safe_filename}"
+    source = db.session.query(Video).filter_by(checksum=checksum).order_by(Video.id).first()
+    blob, stored = acquire_blob(staged)
+    if stored:
+        logger.debug(f"Stored {staged.size} bytes for {original_filename} (sha256 {checksum})")
     else:
-        target_frame = 9  # Default to 10th frame (0-based index)
-        logger.debug(f"Video duration {duration_minutes:.2f} minutes (<=40), using 10th frame")
-    
-    # Ensure target_frame is within bounds
-    if target_frame >= frame_count:
-        target_frame = frame_count - 1  # Use last frame if out of bounds
-    
-    vidcap.set(cv2.CAP_PROP_POS_FRAMES, target_frame)
-    success, image = vidcap.read()
-    if success:
-        # Increase resolution to 500x500 for better quality
-        target_size = (500, 500)
-        
-        # Use INTER_LANCZOS4 for high-quality resizing
-        image = cv2.resize(image, target_size, interpolation=cv2.INTER_LANCZOS4)
-        
-        # Apply slight sharpening (unsharp mask)
-        gaussian = cv2.GaussianBlur(image, (5, 5), 1.0)
-        image = cv2.addWeighted(image, 1.5, gaussian, -0.5, 0)
-        
-        # Save with high JPEG quality (95 out of 100)
-        cv2.imwrite(output_path, image, [int(cv2.IMWRITE_JPEG_QUALITY), 95])
-        os.chmod(output_path, 0o775)
-        logger.debug(f"Thumbnail generated successfully for {video_path} at {target_size}")
+        logger.debug(f"Content of {original_filename} already stored (sha256 {checksum})")
+
+    # The thumbnail is filled in by the media worker
+    new_video = Video(
+        title=original_filename,
+        filename=filename,
+        notes=notes,
+        user_id=user.id,
+        checksum=checksum
+    )
+
+    new_video.tags = tags_for_names(parse_tag_names(tags_input))
+
+    # One ffprobe pass per distinct content; the worker stages use the stored result
+    if source and is_probed(source):
+        copy_media_info(source, new_video)
+    elif info:
+        apply_media_info(new_video, info)
+    else:
+        try:
+            apply_media_info(new_video, probe_media(os.path.join(app.config['UPLOAD_FOLDER'], blob.path)))
+        except (OSError, RuntimeError, ValueError) as e:
+            logger.warning(f"Could not probe {original_filename}: {str(e)}")  # The worker retries
+
+    db.session.add(new_video)
+    db.session.flush()
+    record_stage(new_video.id, 'stored')
+
+    # Reuse what was already derived from the same content, and skip work that
+    # is already queued for another copy (the worker fills in every copy)
+    kinds = ['thumbnail', 'storyboard', 'hls_plan']
+    pending = set()
+    if source:
+        copy_derived(source, new_video)
+        pending = pending_job_kinds(checksum)
+        done = {'thumbnail': source.thumbnail_set, 'storyboard': source.storyboard, 'hls_plan': source.renditions}
+        kinds = [kind for kind in kinds if not done[kind] and kind not in pending]
+        if source.transcription_status == 'completed':
+            new_video.transcription = source.transcription
+            new_video.transcription_status = 'completed'
+            copy_segments(source.id, new_video.id)
+        elif 'transcribe' in pending or (transcribe and 'fingerprint' in pending):
+            new_video.transcription_status = 'queued'
     else:
-        logger.error(f"Failed to generate thumbnail for {video_path} at frame {target_frame}")
-    vidcap.release()
-
-# Helper to compute SHA-256 checksum of a file
-def compute_checksum(file):
-    logger.debug(f"Computing checksum for file")
-    sha256 = hashlib.sha256()
-    for chunk in iter(lambda: file.read(4096), b""):
-        sha256.update(chunk)
-    file.seek(0)
-    return sha256.hexdigest()
-
-# Helper to transcribe video audio using Whisper
-def transcribe_video(video_path, video_id):
-    with app.app_context():
-        video = db.session.get(Video, video_id)
-        if not video:
-            logger.error(f"Video {video_id} not found in database")
-            return
-        video.transcription_status = 'running'
+        # New content is compared with the archive first (see fingerprints.py)
+        kinds.insert(0, 'fingerprint')
+    index_video(new_video)
+    for kind in kinds:
+        enqueue_job(new_video.id, kind, commit=False)
+    if transcribe and not new_video.transcription_status:
+        if source:
+            queue_transcription(new_video, commit=False)
+        else:
+            new_video.transcription_status = 'queued'  # The fingerprint job queues it unless the upload looks like a duplicate
+    if commit:
         db.session.commit()
-        logger.info(f"Transcription started for video {video_id}")
+    logger.debug(f"Video {new_video.id} uploaded: {filename}")
+    return 'Uploaded', new_video
 
-    try:
-        logger.debug(f"Checking video file existence: {video_path}")
-        if not os.path.exists(video_path):
-            raise FileNotFoundError(f"Video file not found at {video_path}")
+# Drop temp files of uploads that were rejected or failed mid-request
+@app.teardown_request
+def remove_ingest_temp_files(exc):
+    cleanup_request_temp_files(request)
 
-        audio_path = video_path + ".wav"
-        logger.debug(f"Attempting audio extraction to {audio_path}")
-        try:
-            video_audio = AudioSegment.from_file(video_path)
-            audio = video_audio.set_channels(1).set_frame_rate(16000)
-            audio.export(audio_path, format="wav")
-            logger.info(f"Audio extracted for video {video_id}: duration={len(audio) / 1000.0}s, sample_rate={audio.frame_rate}, channels={audio.channels}")
-        except Exception as e:
-            logger.debug(f"Audio extraction failed: {str(e)}", exc_info=True)
-            with app.app_context():
-                video = db.session.get(Video, video_id)
-                if video:
-                    video.transcription_status = 'completed'
-                    video.transcription = "No audio available in this video."
-                    db.session.commit()
-                    logger.info(f"Video {video_id} has no detectable audio; marked as completed")
-            return
-
-        model = whisper.load_model("tiny")
-        device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        logger.info(f"Transcribing video {video_id} using Whisper 'tiny' on {device}")
-        result = model.transcribe(audio_path, language="en", word_timestamps=False)
-        logger.debug(f"Transcription result: {len(result['segments'])} segments")
-        segments = result["segments"]
-
-        transcription_text = ""
-        current_interval = 0
-        current_paragraph = []
-        interval_seconds = 60
-
-        for segment in segments:
-            start_time = segment["start"]
-            interval = int(start_time // interval_seconds)
-            if interval > current_interval:
-                if current_paragraph:
-                    transcription_text += " ".join(current_paragraph) + "\n\n"
-                current_paragraph = []
-                current_interval = interval
-            current_paragraph.append(segment["text"].strip())
-
-        if current_paragraph:
-            transcription_text += " ".join(current_paragraph)
-
-        with app.app_context():
-            video = db.session.get(Video, video_id)
-            if video:
-                video.transcription = transcription_text
-                video.transcription_status = 'completed'
-                db.session.commit()
-                logger.info(f"Transcription completed for video {video_id}: {transcription_text[:50]}...")
+# Make get_current_user available in templates (resolved once per request, see auth.py)
+app.jinja_env.globals['get_current_user'] = get_current_user
 
-        if os.path.exists(audio_path):
-            os.remove(audio_path)
-            logger.debug(f"Temporary audio file removed: {audio_path}")
+# srcset strings per format for a video's thumbnails, or None until the worker
+# has generated them (videos from before thumbnail sets only have `thumbnail`)
+def thumbnail_srcsets(video):
+    thumbnail_set = load_thumbnail_set(video)
+    if not thumbnail_set:
+        return None
+    return {
+        fmt: ', '.join(
+            f"{url_for('static', filename='thumbnails/' + name)} {size}w"
+            for size, name in sorted(files.items(), key=lambda item: int(item[0]))
+        )
+        for fmt, files in thumbnail_set.items()
+    }
 
-    except Exception as e:
-        with app.app_context():
-            video = db.session.get(Video, video_id)
-            if video:
-                video.transcription_status = 'failed'
-                video.transcription = f"Failed: {str(e)}"
-                db.session.commit()
-        logger.error(f"Transcription failed for video {video_id}: {str(e)}", exc_info=True)
-
-# Helper to get current user
-def get_current_user():
-    if 'user_id' in session:
-        user = db.session.get(User, session['user_id'])
-        if user:
-            logger.debug(f"Current user retrieved: {user.username} (ID: {user.id})")
-            return user
-        else:
-            logger.debug(f"User not found for user_id: {session['user_id']}")
-            session.pop('user_id', None)
-    return None
-
-# Helper to clean up unused tags
-def cleanup_unused_tags():
-    tags = Tag.query.all()
-    for tag in tags:
-        if not tag.videos:
-            logger.debug(f"Removing unused tag: {tag.name}")
-            db.session.delete(tag)
-    db.session.commit()
+app.jinja_env.globals['thumbnail_srcsets'] = thumbnail_srcsets
 
-# Make get_current_user available in templates
-app.jinja_env.globals['get_current_user'] = get_current_user
+# h:mm:ss or m:ss for a duration in seconds
+@app.template_filter('duration')
+def format_duration(seconds):
+    if seconds is None:
+        return ''
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
 
 # Initialize database and create tables
 with app.app_context():
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     os.makedirs(app.config['THUMBNAIL_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['HLS_FOLDER'], exist_ok=True)
     if app.config['DB_PROVIDER'].lower() == 'sqlite':
         db_path = os.path.join(app.instance_path, f"{app.config['DB_NAME']}.db")
         os.makedirs(app.instance_path, exist_ok=True)
         os.chmod(app.instance_path, 0o775)
     db.create_all()
+    ensure_schema()
+    ensure_search_index()
     if not db.session.query(User).filter_by(username='admin').first():
         admin = User(
             username='admin',
@@ -252,6 +245,98 @@ with app.app_context():
         db.session.add(admin)
         db.session.commit()
 
+# Rebuild the full-text search index: flask --app app reindex-search
+@app.cli.command('reindex-search')
+def reindex_search_command():
+    count = reindex_all()
+    print(f"Indexed {count} videos.")
+
+# Queue thumbnail jobs for videos without a thumbnail set (e.g. after
+# upgrading): flask --app app regenerate-thumbnails [--all]
+@app.cli.command('regenerate-thumbnails')
+@click.option('--all', 'regenerate_all', is_flag=True, help='Also regenerate videos that already have a thumbnail set')
+@click.option('--force', is_flag=True, help='Ignore thumbnails in the derivative cache')
+def regenerate_thumbnails_command(regenerate_all, force):
+    query = db.session.query(Video.id)
+    if not regenerate_all:
+        query = query.filter(Video.thumbnail_set.is_(None))
+    video_ids = [video_id for video_id, in query.order_by(Video.id)]
+    for video_id in video_ids:
+        enqueue_job(video_id, 'thumbnail', payload={'force': True} if force else None)
+    print(f"Queued thumbnail jobs for {len(video_ids)} videos.")
+
+# Queue storyboard/chapter jobs for videos without a storyboard:
+# flask --app app generate-storyboards [--all]
+@app.cli.command('generate-storyboards')
+@click.option('--all', 'regenerate_all', is_flag=True, help='Also regenerate videos that already have a storyboard')
+@click.option('--force', is_flag=True, help='Ignore storyboards in the derivative cache')
+def generate_storyboards_command(regenerate_all, force):
+    query = db.session.query(Video.id)
+    if not regenerate_all:
+        query = query.filter(Video.storyboard.is_(None))
+    video_ids = [video_id for video_id, in query.order_by(Video.id)]
+    for video_id in video_ids:
+        enqueue_job(video_id, 'storyboard', payload={'force': True} if force else None)
+    print(f"Queued storyboard jobs for {len(video_ids)} videos.")
+
+# Queue HLS transcoding for videos without renditions:
+# flask --app app transcode-hls [--all]
+@app.cli.command('transcode-hls')
+@click.option('--all', 'regenerate_all', is_flag=True, help='Also re-encode videos that already have renditions')
+def transcode_hls_command(regenerate_all):
+    query = db.session.query(Video.id)
+    if not regenerate_all:
+        query = query.filter(~Video.renditions.any())
+    video_ids = [video_id for video_id, in query.order_by(Video.id)]
+    for video_id in video_ids:
+        enqueue_job(video_id, 'hls_plan')
+    print(f"Queued HLS jobs for {len(video_ids)} videos.")
+
+# Fingerprint stored content for near-duplicate detection (e.g. after
+# upgrading): flask --app app fingerprint-videos [--all]
+@app.cli.command('fingerprint-videos')
+@click.option('--all', 'refingerprint', is_flag=True, help='Also fingerprint content that already has a fingerprint')
+def fingerprint_videos_command(refingerprint):
+    query = db.session.query(func.min(Video.id)).group_by(Video.checksum)
+    if not refingerprint:
+        query = query.filter(~Video.checksum.in_(db.session.query(Fingerprint.checksum)))
+    video_ids = sorted(video_id for video_id, in query)
+    for video_id in video_ids:
+        enqueue_job(video_id, 'fingerprint', payload={'force': True} if refingerprint else None)
+    print(f"Queued fingerprint jobs for {len(video_ids)} stored files.")
+
+# Empty the derivative cache, or one stage of it:
+# flask --app app clear-derivative-cache [--stage transcript]
+@app.cli.command('clear-derivative-cache')
+@click.option('--stage', type=click.Choice(sorted(DERIVATIVE_VERSIONS)), help='Only clear this stage')
+def clear_derivative_cache_command(stage):
+    derivative_cache.clear(stage)
+    print(f"Cleared {stage or 'all stages'} of the derivative cache.")
+
+# Fill in duration, codecs, resolution etc. for videos uploaded before they
+# were stored: flask --app app probe-media [--all]
+@app.cli.command('probe-media')
+@click.option('--all', 'reprobe', is_flag=True, help='Also probe videos that already have media information')
+def probe_media_command(reprobe):
+    probed, failed = backfill_media_info(reprobe=reprobe)
+    print(f"Probed {probed} uploads, {failed} failed.")
+
+# Move uploads stored before content-addressed storage into the blob store:
+# flask --app app migrate-blobs [--verify]
+@app.cli.command('migrate-blobs')
+@click.option('--verify', is_flag=True, help='Re-hash each file before moving it')
+def migrate_blobs_command(verify):
+    counts = migrate_to_blobs(app.config['HLS_FOLDER'], verify=verify)
+    print(', '.join(f"{outcome}: {count}" for outcome, count in counts.items()))
+
+# Create timed segments for transcripts stored as plain text by older versions:
+# flask --app app migrate-transcripts [--approximate]
+@app.cli.command('migrate-transcripts')
+@click.option('--approximate', is_flag=True, help='Time transcripts without cached timings by paragraph, one per minute')
+def migrate_transcripts_command(approximate):
+    counts = migrate_transcripts(approximate=approximate)
+    print(', '.join(f"{outcome}: {count}" for outcome, count in counts.items()))
+
 # Routes
 @app.route('/preferences', methods=['GET', 'POST'])
 def preferences():
@@ -268,8 +353,10 @@ def preferences():
         if theme not in ['light', 'dark']:
             flash('Invalid theme')
         else:
-            current_user.theme = theme
+            user = current_user.record()
+            user.theme = theme
             db.session.commit()
+            refresh_session(user)
             flash(f'Theme set to {theme} mode')
         logger.info(f"User {current_user.username} updated preferences: theme={theme}")
         return redirect(url_for('preferences'))
@@ -288,31 +375,95 @@ def index():
         return redirect(url_for('login'))
 
     search_query = request.args.get('search', None)
+    tag = request.args.get('tag') or None
 
-    # Filter videos based on user role
-    query = Video.query.order_by(Video.upload_date.desc())
-    if not current_user.is_admin:
-        query = query.filter_by(user_id=current_user.id)  # Only user's videos
-    
-    videos = query.all()
-
-    videos_json = [
-        {
-            'id': video.id,
-            'title': video.title,
-            'thumbnail': video.thumbnail,
-            'upload_date': video.upload_date.strftime('%Y-%m-%d %H:%M'),
-            'tags': [tag.name for tag in video.tags],
-            'notes': video.notes or '',
-            'transcription': video.transcription or '',
-            'user_id': video.user_id,
-            'uploader': db.session.get(User, video.user_id).username if db.session.get(User, video.user_id) else 'Unknown'
-        } for video in videos
-    ]
+    # First page only; the grid pulls further pages from /api/videos
+    videos, next_cursor = list_videos(current_user, tag=tag)
 
     logger.info(f"Rendering index page for user {current_user.username}")
-    return render_template('index.html', videos=[(video, db.session.get(User, video.user_id)) for video in videos], 
-                         search_query=search_query, videos_json=json.dumps(videos_json))
+    return render_template('index.html', videos=videos, next_cursor=next_cursor,
+                         search_query=search_query, tag=tag, tag_facets=tag_facets(current_user))
+
+# Card data for the index grid, shared by the page and the JSON APIs.
+# Expects video.uploader and video.tags to be eager-loaded (see listing.py).
+def video_card(video):
+    uploader = video.uploader
+    return {
+        'id': video.id,
+        'title': video.title,
+        'thumbnail': video.thumbnail,
+        'thumbnail_srcsets': thumbnail_srcsets(video),
+        'upload_date': video.upload_date.strftime('%Y-%m-%d %H:%M'),
+        'tags': [tag.name for tag in video.tags],
+        'duration': video.duration,
+        'width': video.width,
+        'height': video.height,
+        'user_id': video.user_id,
+        'uploader': uploader.username if uploader else 'Unknown'
+    }
+
+@app.route('/api/videos')
+def api_videos():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    current_user = get_current_user()
+    if not current_user:
+        return jsonify({'error': 'Session expired'}), 401
+
+    cursor = request.args.get('cursor') or None
+    limit = min(max(request.args.get('limit', PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    tag = request.args.get('tag') or None
+    try:
+        videos, next_cursor = list_videos(current_user, cursor, limit, tag=tag,
+                                          min_duration=request.args.get('min_duration', type=float),
+                                          max_duration=request.args.get('max_duration', type=float),
+                                          min_height=request.args.get('min_height', type=int))
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+
+    return jsonify({'videos': [video_card(video) for video in videos], 'next_cursor': next_cursor})
+
+@app.route('/api/search')
+def api_search():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    current_user = get_current_user()
+    if not current_user:
+        return jsonify({'error': 'Session expired'}), 401
+
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    tag = request.args.get('tag') or None
+
+    total, hits = search_videos(query, current_user, page, per_page, tag=tag)
+    videos = {video.id: video for video in listing_query(current_user).filter(Video.id.in_([video_id for video_id, _ in hits]))}
+    results = []
+    for video_id, snippet in hits:
+        video = videos.get(video_id)
+        if video:
+            card = video_card(video)
+            card['snippet'] = snippet
+            results.append(card)
+
+    logger.debug(f"Search '{query}' by {current_user.username}: {total} hits")
+    return jsonify({'query': query, 'page': page, 'per_page': per_page, 'total': total, 'results': results})
+
+# Tags with the number of the user's videos carrying each, for the index filter
+@app.route('/api/tags')
+def api_tags():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    current_user = get_current_user()
+    if not current_user:
+        return jsonify({'error': 'Session expired'}), 401
+
+    response = jsonify({'tags': tag_facets(current_user)})
+    response.headers['Cache-Control'] = f"private, max-age={TAG_FACET_TTL}"
+    return response
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -322,7 +473,7 @@ def login():
         user = db.session.query(User).filter_by(username=username).first()
 
         if user and check_password_hash(user.password_hash, password):
-            session['user_id'] = user.id
+            login_user(user)
             logger.info(f"User logged in: {user.username} (ID: {user.id})")
             return redirect(url_for('index'))
         flash('Invalid credentials')
@@ -333,7 +484,7 @@ def login():
 @app.route('/logout')
 def logout():
     logger.info(f"Logging out user_id: {session.get('user_id')}")
-    session.pop('user_id', None)
+    logout_user()
     return redirect(url_for('login'))
 
 @app.route('/upload', methods=['GET', 'POST'])
@@ -354,64 +505,188 @@ def upload():
         videos = request.files.getlist('videos')
         tags_input = request.form.get('tags', '')
         notes = request.form.get('notes', '')
+        if METRICS_ENABLED:
+            observe_upload('form', request.content_length or 0, request_elapsed())  # The body is parsed by now
         status = {}
         logger.info(f"Upload attempt by user {current_user.username}: {len(videos)} files")
 
+        # Each file is committed on its own, so a failed one is rolled back
+        # without taking the others with it (on PostgreSQL an error aborts the
+        # whole transaction)
         for video in videos:
             if video and video.filename:
                 try:
-                    checksum = compute_checksum(video)
-                    # Check for duplicate only within the current user's uploads
-                    if db.session.query(Video).filter_by(checksum=checksum, user_id=current_user.id).first():
-                        status[video.filename] = 'Duplicate detected'
-                        logger.debug(f"Duplicate video detected for user {current_user.username}: {video.filename}")
-                        continue
-
-                    safe_filename = video.filename.replace(' ', '_').replace('[', '').replace(']', '')
-                    filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{safe_filename}"
-                    title = video.filename
-                    video_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    video.save(video_path)
-                    os.chmod(video_path, 0o775)
-
-                    thumbnail_filename = f"thumb_{filename}.jpg"
-                    thumbnail_path = os.path.join(app.config['THUMBNAIL_FOLDER'], thumbnail_filename)
-                    generate_thumbnail(video_path, thumbnail_path)
-
-                    new_video = Video(
-                        title=title,
-                        filename=filename,
-                        thumbnail=thumbnail_filename,
-                        notes=notes,
-                        user_id=current_user.id,
-                        checksum=checksum
-                    )
-
-                    if tags_input:
-                        tag_names = [tag.strip() for tag in tags_input.split(',') if tag.strip()]
-                        for tag_name in tag_names:
-                            tag = db.session.query(Tag).filter_by(name=tag_name).first()
-                            if not tag:
-                                tag = Tag(name=tag_name)
-                                db.session.add(tag)
-                            new_video.tags.append(tag)
-
-                    db.session.add(new_video)
-                    db.session.commit()
-                    threading.Thread(target=transcribe_video, args=(video_path, new_video.id)).start()
-                    status[video.filename] = 'Uploaded'
-                    logger.debug(f"Video {new_video.id} uploaded: {filename}")
-
+                    staged = stage_upload(video)
+                    status[video.filename], _ = register_upload(staged, video.filename, current_user, tags_input, notes)
                 except Exception as e:
+                    db.session.rollback()
                     status[video.filename] = f'Failed: {str(e)}'
                     logger.error(f"Upload failed for {video.filename}: {str(e)}", exc_info=True)
 
-        db.session.commit()
         return jsonify(status), 200
 
     logger.debug("Rendering upload page")
     return render_template('upload.html')
 
+# Resumable chunked uploads. The browser creates a session, PUTs chunks at
+# their byte offsets (in parallel, in any order, retrying as needed), can ask
+# which chunks the server already has, and finally completes the session.
+def upload_session_state(upload):
+    received = sorted(index for index, in upload.chunks.with_entities(UploadChunk.index))
+    offset = 0
+    for expected, index in enumerate(received):
+        if index != expected:
+            break
+        offset = min((index + 1) * upload.chunk_size, upload.size)
+    return {
+        'id': upload.id,
+        'filename': upload.filename,
+        'size': upload.size,
+        'chunk_size': upload.chunk_size,
+        'received': received,
+        'offset': offset
+    }
+
+def get_upload_session(upload_id, user):
+    upload = db.session.get(UploadSession, upload_id)
+    if not upload or upload.user_id != user.id:
+        return None
+    return upload
+
+@app.route('/api/uploads', methods=['POST'])
+def create_upload_session():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    current_user = get_current_user()
+    if not current_user:
+        return jsonify({'error': 'Session expired'}), 401
+
+    data = request.get_json(silent=True) or {}
+    filename = (data.get('filename') or '').strip()
+    size = data.get('size')
+    if not filename or type(size) is not int or size <= 0:
+        return jsonify({'error': 'filename and a positive size are required'}), 400
+    if size > app.config['MAX_CONTENT_LENGTH']:
+        return jsonify({'error': 'File is too large'}), 413
+
+    upload = UploadSession(
+        id=uuid.uuid4().hex,
+        user_id=current_user.id,
+        filename=filename,
+        size=size,
+        chunk_size=UPLOAD_CHUNK_SIZE,
+        temp_path=create_chunked_file(size),
+        tags=data.get('tags', ''),
+        notes=data.get('notes', '')
+    )
+    db.session.add(upload)
+    db.session.commit()
+    logger.info(f"Resumable upload {upload.id} started by {current_user.username}: {filename} ({size} bytes)")
+    return jsonify(upload_session_state(upload)), 201
+
+@app.route('/api/uploads/<upload_id>', methods=['GET', 'DELETE'])
+def upload_session_status(upload_id):
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    current_user = get_current_user()
+    if not current_user:
+        return jsonify({'error': 'Session expired'}), 401
+
+    upload = get_upload_session(upload_id, current_user)
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+
+    if request.method == 'DELETE':
+        if os.path.exists(upload.temp_path):
+            os.unlink(upload.temp_path)
+        db.session.delete(upload)
+        db.session.commit()
+        logger.info(f"Resumable upload {upload_id} cancelled by {current_user.username}")
+        return '', 204
+
+    return jsonify(upload_session_state(upload))
+
+@app.route('/api/uploads/<upload_id>/chunk', methods=['PUT'])
+def upload_chunk(upload_id):
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    current_user = get_current_user()
+    if not current_user:
+        return jsonify({'error': 'Session expired'}), 401
+
+    upload = get_upload_session(upload_id, current_user)
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+
+    offset = request.args.get('offset', type=int)
+    if offset is None or offset < 0 or offset >= upload.size or offset % upload.chunk_size:
+        return jsonify({'error': 'offset must be a multiple of chunk_size inside the file'}), 400
+    index = offset // upload.chunk_size
+    length = min(upload.chunk_size, upload.size - offset)
+    if request.content_length != length:
+        return jsonify({'error': f'Chunk {index} must be exactly {length} bytes'}), 400
+
+    started = time.perf_counter()
+    written, checksum = write_chunk(upload.temp_path, offset, length, request.stream)
+    if METRICS_ENABLED:
+        observe_upload('chunked', written, time.perf_counter() - started)
+    chunk = db.session.get(UploadChunk, (upload.id, index))
+    expected = request.headers.get('X-Chunk-Checksum')
+    error = None
+    if written != length:
+        error = f'Chunk {index} was truncated ({written} of {length} bytes)'
+    elif expected and expected.lower() != checksum:
+        error = f'Checksum mismatch on chunk {index}'
+    if error:
+        # The bytes on disk are no longer trustworthy; the chunk must be resent
+        if chunk:
+            db.session.delete(chunk)
+            db.session.commit()
+        logger.debug(f"Rejected chunk for upload {upload_id}: {error}")
+        return jsonify({'error': error}), 400
+
+    if not chunk:
+        chunk = UploadChunk(session_id=upload.id, index=index)
+        db.session.add(chunk)
+    chunk.size = written
+    chunk.checksum = checksum
+    upload.updated_at = datetime.utcnow()
+    db.session.commit()
+    return jsonify({'index': index, 'size': written, 'checksum': checksum})
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    current_user = get_current_user()
+    if not current_user:
+        return jsonify({'error': 'Session expired'}), 401
+
+    upload = get_upload_session(upload_id, current_user)
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+
+    state = upload_session_state(upload)
+    if state['offset'] != upload.size:
+        return jsonify({'error': 'Upload is missing chunks', **state}), 409
+
+    try:
+        staged = stage_chunked_file(upload.temp_path, upload.size)
+        status, video = register_upload(staged, upload.filename, current_user, upload.tags, upload.notes)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Completing upload {upload_id} failed: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Failed: {str(e)}'}), 500
+
+    db.session.delete(upload)
+    db.session.commit()
+    logger.info(f"Resumable upload {upload_id} completed by {current_user.username}: {status}")
+    return jsonify({'status': status, 'video_id': video.id if video else None})
+
 @app.route('/video/<int:id>', methods=['GET', 'POST'])
 def view_video(id):
     if 'user_id' not in session:
@@ -439,19 +714,11 @@ def view_video(id):
             notes = request.form['notes']
             tags_input = request.form['tags']
             video.notes = notes
-            video.tags.clear()
-
-            if tags_input:
-                tag_names = [tag.strip() for tag in tags_input.split(',') if tag.strip()]
-                for tag_name in tag_names:
-                    tag = db.session.query(Tag).filter_by(name=tag_name).first()
-                    if not tag:
-                        tag = Tag(name=tag_name)
-                        db.session.add(tag)
-                    video.tags.append(tag)
+            video.tags = tags_for_names(parse_tag_names(tags_input))
 
+            index_video(video)
+            delete_orphan_tags()
             db.session.commit()
-            cleanup_unused_tags()
             flash('Video metadata updated successfully')
             logger.info(f"Video {id} metadata updated by user {current_user.username}")
 
@@ -460,6 +727,8 @@ def view_video(id):
             if manual_transcription:
                 video.transcription = manual_transcription
                 video.transcription_status = 'completed'
+                delete_segments(video.id)  # Whisper's timings no longer match the text
+                index_video(video)
                 db.session.commit()
                 flash('Manual transcription saved successfully.')
                 logger.info(f"Manual transcription saved for video {id} by user {current_user.username}")
@@ -468,19 +737,99 @@ def view_video(id):
                 logger.debug(f"Empty manual transcription attempt for video {id}")
 
         elif 'start_transcription' in request.form:
-            if video.transcription_status == 'running':
-                flash('Transcription is already running for this video.')
+            if video.transcription_status in ('queued', 'running'):
+                flash('Transcription is already queued or running for this video.')
             else:
-                video_path = os.path.join(app.config['UPLOAD_FOLDER'], video.filename)
-                threading.Thread(target=transcribe_video, args=(video_path, video.id)).start()
-                flash('Transcription started in the background.')
+                model = request.form.get('model', WHISPER_MODEL)
+                if model not in WHISPER_MODELS:
+                    model = WHISPER_MODEL
+                threads = None
+                if current_user.is_admin and request.form.get('threads', '').isdigit():
+                    threads = min(int(request.form['threads']), os.cpu_count() or 1) or None
+                if queue_transcription(video, model=model, force='force' in request.form, threads=threads):
+                    flash(f'Transcription queued in the background using the {model} model.')
+                else:
+                    flash(f'Transcription with the {model} model loaded from an earlier run.')
                 logger.info(f"Transcription restarted for video {id} by user {current_user.username}")
 
         return redirect(url_for('view_video', id=id))
 
     tags = ', '.join(tag.name for tag in video.tags)
+    storyboard = load_storyboard(video)
+    storyboard_url = url_for('static', filename='thumbnails/' + storyboard['vtt']) if storyboard else None
+    # Prefer the HLS ladder once any rendition is ready; the original stays as fallback
+    hls_url = None
+    if any(rendition.status == 'completed' for rendition in video.renditions):
+        hls_url = url_for('video_hls', id=video.id, name=MASTER_PLAYLIST)
+    source_type = mimetypes.guess_type(video.filename)[0] or 'video/mp4'
     logger.debug(f"Rendering video page for video {id} by user {current_user.username}")
-    return render_template('video.html', video=video, tags=tags)
+    return render_template('video.html', video=video, tags=tags, whisper_models=WHISPER_MODELS, default_model=WHISPER_MODEL,
+                           chapters=video.chapters, storyboard_url=storyboard_url, hls_url=hls_url, source_type=source_type,
+                           renditions=video.renditions, has_transcript_track=has_segments(video.id),
+                           progress=load_progress([video.id])[video.id],
+                           near_duplicates=near_duplicates_for(video, current_user))
+
+# WebVTT chapter track for the player
+@app.route('/video/<int:id>/chapters.vtt')
+def video_chapters(id):
+    if 'user_id' not in session:
+        return Response('Not logged in', status=401, mimetype='text/plain')
+
+    current_user = get_current_user()
+    if not current_user:
+        return Response('Session expired', status=401, mimetype='text/plain')
+
+    video = db.session.get(Video, id)
+    if not video or (not current_user.is_admin and video.user_id != current_user.id):
+        return Response('Video not found', status=404, mimetype='text/plain')
+
+    cues = [(chapter.start, chapter.end, chapter.title) for chapter in video.chapters]
+    return Response(vtt_document(cues), mimetype='text/vtt')
+
+# Original upload, after the uploader/admin check. Browsers revalidate on
+# every load so revoked access takes effect; seeks are Range requests.
+@app.route('/media/<int:id>/original')
+def video_media(id):
+    if 'user_id' not in session:
+        return Response('Not logged in', status=401, mimetype='text/plain')
+
+    current_user = get_current_user()
+    if not current_user:
+        return Response('Session expired', status=401, mimetype='text/plain')
+
+    video = db.session.get(Video, id)
+    if not video or (not current_user.is_admin and video.user_id != current_user.id):
+        return Response('Video not found', status=404, mimetype='text/plain')
+
+    mimetype = mimetypes.guess_type(video.filename)[0] or 'video/mp4'
+    storage_path = video_storage_path(video)
+    response = media_response(app.config['UPLOAD_FOLDER'], storage_path, 'uploads', 'private, no-cache', mimetype=mimetype)
+    if not response:
+        logger.error(f"Media file missing for video {id}: {storage_path}")
+        return Response('Video not found', status=404, mimetype='text/plain')
+    return response
+
+# HLS playlists and segments. Relative URIs in the playlists resolve under
+# this route, so every segment request passes the same access check.
+@app.route('/media/<int:id>/hls/<path:name>')
+def video_hls(id, name):
+    if 'user_id' not in session:
+        return Response('Not logged in', status=401, mimetype='text/plain')
+
+    current_user = get_current_user()
+    if not current_user:
+        return Response('Session expired', status=401, mimetype='text/plain')
+
+    video = db.session.get(Video, id)
+    if not video or (not current_user.is_admin and video.user_id != current_user.id):
+        return Response('Video not found', status=404, mimetype='text/plain')
+
+    # Playlists change as renditions complete; segment directories are never rewritten
+    cache_control = 'private, no-cache' if name.endswith('.m3u8') else 'private, max-age=31536000, immutable'
+    response = media_response(app.config['HLS_FOLDER'], f"{video.checksum}/{name}", 'hls', cache_control)
+    if not response:
+        return Response('Not found', status=404, mimetype='text/plain')
+    return response
 
 @app.route('/video/<int:id>/transcription', methods=['GET'])
 def view_transcription(id):
@@ -513,19 +862,68 @@ def view_transcription(id):
     if interval not in range(1, 6):
         interval = 1
 
-    one_minute_sections = video.transcription.split('\n\n')
-    paragraphs = []
-    current_paragraph = []
-    sections_per_interval = interval
-
-    for i, section in enumerate(one_minute_sections):
-        current_paragraph.append(section)
-        if (i + 1) % sections_per_interval == 0 or i == len(one_minute_sections) - 1:
-            paragraphs.append(" ".join(current_paragraph))
-            current_paragraph = []
+    timed = has_segments(video.id)
+    if timed:
+        sections = transcript_sections(video.id, interval)
+    else:
+        sections = text_sections(video.transcription, interval)  # Manual transcription without timings
 
     logger.debug(f"Rendering transcription page for video {id} with interval {interval}")
-    return render_template('transcription.html', video=video, paragraphs=paragraphs, interval=interval)
+    return render_template('transcription.html', video=video, sections=sections, interval=interval, timed=timed,
+                           export_formats=sorted(EXPORT_FORMATS))
+
+# Timed transcript as WebVTT (also the player's subtitle track) or SRT,
+# streamed from the segment rows
+@app.route('/video/<int:id>/transcript.<fmt>')
+def export_transcript(id, fmt):
+    if 'user_id' not in session:
+        return Response('Not logged in', status=401, mimetype='text/plain')
+
+    current_user = get_current_user()
+    if not current_user:
+        return Response('Session expired', status=401, mimetype='text/plain')
+
+    video = db.session.get(Video, id)
+    if not video or (not current_user.is_admin and video.user_id != current_user.id):
+        return Response('Video not found', status=404, mimetype='text/plain')
+    if fmt not in EXPORT_FORMATS or not has_segments(video.id):
+        return Response('Transcript not found', status=404, mimetype='text/plain')
+
+    response = Response(stream_with_context(export_chunks(video.id, fmt)), mimetype=EXPORT_FORMATS[fmt][0])
+    if 'download' in request.args:
+        name = os.path.splitext(video.title)[0] or f"video-{video.id}"
+        response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(name)}.{fmt}"
+    return response
+
+# Server-Sent Events with the video's processing stages. Every stream in this
+# process is fed by progress_hub, which reads the database once per interval
+# for all of them, so held-open tabs do not poll the database themselves.
+@app.route('/video/<int:id>/events')
+def video_events(id):
+    if 'user_id' not in session:
+        return Response('Not logged in', status=401, mimetype='text/plain')
+
+    current_user = get_current_user()
+    if not current_user:
+        return Response('Session expired', status=401, mimetype='text/plain')
+
+    video = db.session.get(Video, id)
+    if not video or (not current_user.is_admin and video.user_id != current_user.id):
+        return Response('Video not found', status=404, mimetype='text/plain')
+
+    video_id = video.id
+    listener = progress_hub.subscribe(video_id)
+    if listener is None:
+        # Every stream slot of this process is taken: answer at once and let the page poll
+        response = Response(fallback_stream(video_id, load_progress([video_id])[video_id]), mimetype='text/event-stream')
+    else:
+        # The generator only waits on the hub, so it needs no request context. A
+        # stream closed before its first read never runs the generator's cleanup.
+        response = Response(progress_hub.event_stream(video_id, listener), mimetype='text/event-stream')
+        response.call_on_close(lambda: progress_hub.unsubscribe(video_id, listener))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx must pass events through as they come
+    return response
 
 @app.route('/delete/<int:id>', methods=['POST'])
 def delete_video(id):
@@ -548,27 +946,57 @@ def delete_video(id):
         logger.debug(f"Unauthorized delete attempt for video {id} by user {current_user.username}")
         return redirect(url_for('index'))
 
+    # Files shared with other copies of the same content are kept until the
+    # last copy is deleted
+    siblings = sibling_videos(video)
+    thumbnail_names = thumbnail_files(video)
+    for sibling in siblings:
+        thumbnail_names -= thumbnail_files(sibling)
+    checksum = video.checksum
+    # One transaction; a blob file released on the way is put back if it fails
+    video_path = None
+    try:
+        if siblings:
+            hand_over_jobs(video, siblings[0])
+        video_path = release_blob(video)
+        remove_video_from_index(video.id)
+        delete_segments(video.id)
+        delete_progress(video.id)
+        if not siblings:
+            delete_fingerprint(checksum)
+        db.session.delete(video)
+        delete_orphan_tags()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        if video_path:
+            restore_blob(video_path)
+        raise
+
     # Delete static files
-    video_path = os.path.join(app.config['UPLOAD_FOLDER'], video.filename)
-    thumbnail_path = os.path.join(app.config['THUMBNAIL_FOLDER'], video.thumbnail)
     try:
-        if os.path.exists(video_path):
+        if not video_path:
+            logger.debug(f"Video file of video {id} is still used by {len(siblings)} other videos")
+        elif os.path.exists(video_path):
             os.remove(video_path)
             logger.debug(f"Deleted video file: {video_path}")
         else:
             logger.debug(f"Video file not found for deletion: {video_path}")
 
-        if os.path.exists(thumbnail_path):
-            os.remove(thumbnail_path)
-            logger.debug(f"Deleted thumbnail file: {thumbnail_path}")
-        else:
-            logger.debug(f"Thumbnail file not found for deletion: {thumbnail_path}")
+        if not thumbnail_names:
+            logger.debug(f"No unshared thumbnails for video {id}")
+        for name in thumbnail_names:
+            thumbnail_path = os.path.join(app.config['THUMBNAIL_FOLDER'], name)
+            if os.path.exists(thumbnail_path):
+                os.remove(thumbnail_path)
+                logger.debug(f"Deleted thumbnail file: {thumbnail_path}")
+            else:
+                logger.debug(f"Thumbnail file not found for deletion: {thumbnail_path}")
+        if not siblings:
+            remove_hls_files(app.config['HLS_FOLDER'], checksum)
     except Exception as e:
         logger.error(f"Failed to delete static files for video {id}: {str(e)}", exc_info=True)
 
-    db.session.delete(video)
-    db.session.commit()
-    cleanup_unused_tags()  # Clean up tags after deletion
     flash('Video deleted successfully')
     logger.info(f"Video {id} deleted by user {current_user.username}")
     return redirect(url_for('index'))
@@ -578,10 +1006,11 @@ def change_password():
     if 'user_id' not in session:
         return redirect(url_for('login'))
 
-    user = get_current_user()
-    if not user:
+    current_user = get_current_user()
+    if not current_user:
         flash('Session expired. Please log in again.')
         return redirect(url_for('login'))
+    user = current_user.record()
 
     if request.method == 'POST':
         current_password = request.form['current_password']
@@ -599,7 +1028,9 @@ def change_password():
             logger.debug(f"Password change failed for {user.username}: password too short")
         else:
             user.password_hash = generate_password_hash(new_password)
+            expire_sessions(user)  # Log out every other session of this user
             db.session.commit()
+            refresh_session(user)
             flash('Password changed successfully')
             logger.info(f"Password changed successfully for user {user.username}")
             return redirect(url_for('index'))
@@ -612,7 +1043,7 @@ def manage_users():
     if 'user_id' not in session:
         return redirect(url_for('login'))
 
-    current_user = get_current_user()
+    current_user = get_current_user(recheck=True)
     if not current_user:
         flash('Session expired. Please log in again.')
         return redirect(url_for('login'))
@@ -655,6 +1086,7 @@ def manage_users():
                 flash('Cannot delete admin user')
                 logger.debug(f"Delete user failed: {user_to_delete.username} is admin")
             else:
+                expire_sessions(user_to_delete)
                 db.session.delete(user_to_delete)
                 db.session.commit()
                 flash(f'User {user_to_delete.username} deleted successfully')
@@ -672,6 +1104,7 @@ def manage_users():
                 logger.debug(f"Toggle admin failed: {user_to_toggle.username} is primary admin")
             else:
                 user_to_toggle.is_admin = not user_to_toggle.is_admin
+                expire_sessions(user_to_toggle)  # Their session still carries the old flag
                 db.session.commit()
                 flash(f'Admin status for {user_to_toggle.username} updated')
                 logger.info(f"Admin status toggled for {user_to_toggle.username} by {current_user.username}")
@@ -0,0 +1,60 @@
+# audio.py
+# Decode a video's soundtrack straight from an ffmpeg pipe into NumPy, as the
+# 16 kHz mono float32 samples Whisper expects. No audio is written to disk.
+import logging
+import subprocess
+import tempfile
+import numpy as np
+from config import FFMPEG_PATH
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+READ_SIZE = 1024 * 1024  # Bytes of s16le PCM read from the pipe at a time
+
+def _ffmpeg_pcm_command(path, sample_rate):
+    return [
+        FFMPEG_PATH, '-nostdin', '-v', 'error', '-threads', '0',
+        '-i', path,
+        '-vn', '-map', '0:a:0',
+        '-f', 's16le', '-acodec', 'pcm_s16le', '-ac', '1', '-ar', str(sample_rate),
+        '-'
+    ]
+
+def _read_exact(pipe, size):
+    data = pipe.read(size)
+    # Keep blocks sample aligned
+    if len(data) % 2:
+        data += pipe.read(1)
+    return data
+
+# Decode the whole soundtrack into a single float32 array. When the duration is
+# known the output is allocated once up front and filled block by block, so peak
+# memory is the float32 result plus one read block.
+def load_audio(path, sample_rate=SAMPLE_RATE, duration=None):
+    capacity = int((duration + 1) * sample_rate) if duration else sample_rate * 60
+    audio = np.empty(capacity, dtype=np.float32)
+    filled = 0
+
+    # ffmpeg's messages go to a file: a pipe nobody reads until stdout ends
+    # fills up on a damaged input, and ffmpeg and this loop then wait on each other
+    with tempfile.TemporaryFile() as errors:
+        process = subprocess.Popen(_ffmpeg_pcm_command(path, sample_rate), stdout=subprocess.PIPE, stderr=errors)
+        try:
+            while True:
+                data = _read_exact(process.stdout, READ_SIZE)
+                if not data:
+                    break
+                block = np.frombuffer(data, dtype=np.int16)
+                if filled + len(block) > len(audio):
+                    audio = np.resize(audio, max(len(audio) * 2, filled + len(block)))
+                np.multiply(block, 1 / 32768.0, out=audio[filled:filled + len(block)], casting='unsafe')
+                filled += len(block)
+        finally:
+            process.stdout.close()
+            process.wait()
+        if process.returncode != 0:
+            errors.seek(0)
+            raise RuntimeError(f"ffmpeg audio decode failed for {path}: {errors.read().decode(errors='replace').strip()}")
+    logger.debug(f"Decoded {filled / sample_rate:.1f}s of audio from {path}")
+    return audio[:filled]
@@ -0,0 +1,107 @@
+# auth.py
+# Resolve the logged-in user once per request.
+#
+# Login stores the user's id, name, admin flag, theme and session_version in
+# the signed session cookie, so pages can be rendered without loading the user.
+# The version is checked against User.session_version: read-only requests use a
+# per-process copy that is at most SESSION_VERSION_TTL seconds old, requests
+# that change state always re-read it. expire_sessions() bumps the version,
+# which logs out every session issued before.
+import logging
+import time
+from flask import g, request, session
+from config import SESSION_VERSION_TTL
+from models import db, User
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_versions = {}  # user_id -> (session_version, monotonic time it was read)
+
+# The logged-in user as carried in the session cookie
+class SessionUser:
+    def __init__(self, payload):
+        self.id = payload['id']
+        self.username = payload['username']
+        self.is_admin = payload['is_admin']
+        self.theme = payload['theme']
+        self.version = payload['version']
+
+    # Load the User row for routes that modify it (once per request)
+    def record(self):
+        if 'current_user_record' not in g:
+            g.current_user_record = db.session.get(User, self.id)
+        return g.current_user_record
+
+def login_user(user):
+    session['user_id'] = user.id
+    session['user'] = {
+        'id': user.id,
+        'username': user.username,
+        'is_admin': bool(user.is_admin),
+        'theme': user.theme or 'light',
+        'version': user.session_version
+    }
+    _versions[user.id] = (user.session_version, time.monotonic())
+    g.current_user = SessionUser(session['user'])
+    g.current_user_checked = True
+
+def logout_user():
+    session.pop('user_id', None)
+    session.pop('user', None)
+    g.current_user = None
+    g.current_user_checked = True
+
+# Rewrite the session payload after changing the logged-in user's own row
+def refresh_session(user):
+    if session.get('user_id') == user.id:
+        login_user(user)
+
+# Invalidate all existing sessions of a user; commit afterwards
+def expire_sessions(user):
+    user.session_version = (user.session_version or 1) + 1
+    _versions.pop(user.id, None)
+
+def _session_version(user_id, recheck):
+    cached = _versions.get(user_id)
+    if cached and not recheck and time.monotonic() - cached[1] < SESSION_VERSION_TTL:
+        return cached[0]
+    version = db.session.query(User.session_version).filter_by(id=user_id).scalar()
+    if version is None:
+        _versions.pop(user_id, None)
+    else:
+        _versions[user_id] = (version, time.monotonic())
+    return version
+
+def _resolve_user(recheck):
+    user_id = session.get('user_id')
+    if user_id is None:
+        return None
+
+    payload = session.get('user')
+    if not payload or payload.get('id') != user_id:
+        # Session issued before the payload existed; upgrade it
+        user = db.session.get(User, user_id)
+        if not user:
+            logger.debug(f"User not found for user_id: {user_id}")
+            logout_user()
+            return None
+        login_user(user)
+        return g.current_user
+
+    if _session_version(user_id, recheck) != payload['version']:
+        logger.info(f"Session of user {payload['username']} (ID: {user_id}) is no longer valid")
+        logout_user()
+        return None
+    return SessionUser(payload)
+
+# The current user, or None. Pass recheck=True where a stale admin flag must
+# not be trusted even for a read-only request.
+def get_current_user(recheck=False):
+    recheck = recheck or request.method not in SAFE_METHODS
+    if 'current_user' in g and (g.current_user_checked or not recheck):
+        return g.current_user
+    g.current_user = _resolve_user(recheck)
+    g.current_user_checked = recheck
+    return g.current_user
@@ -0,0 +1,83 @@
+# benchmarks/bench_ingest.py
+# Upload ingest throughput on large synthetic files.
+#
+# "legacy" replays the old upload path: hash the spooled upload in 4 KiB reads,
+# seek back, then FileStorage.save() copies it again. "single-pass" replays
+# IngestRequest: the multipart parser's 64 KiB writes go through HashingFile
+# into the upload folder and the result is os.replace'd into place.
+#
+#   python benchmarks/bench_ingest.py --dir /opt/videoarchive/static/uploads --size-gb 4
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import HashingFile, StagedFile, commit_staged
+
+PARSER_CHUNK = 64 * 1024  # werkzeug multipart parser read size
+BLOCK = 8 * 1024 * 1024
+
+def make_fixture(path, size):
+    block = bytearray(os.urandom(BLOCK))
+    with open(path, 'wb') as f:
+        written = 0
+        while written < size:
+            # Vary each block so the file is not trivially compressible/dedupable
+            block[:8] = written.to_bytes(8, 'little')
+            f.write(block[:min(BLOCK, size - written)])
+            written += BLOCK
+    return size
+
+def legacy(source, directory):
+    with open(source, 'rb') as spooled:
+        sha256 = hashlib.sha256()
+        for chunk in iter(lambda: spooled.read(4096), b""):
+            sha256.update(chunk)
+        spooled.seek(0)
+        target = os.path.join(directory, 'bench_legacy.bin')
+        with open(target, 'wb') as dst:
+            shutil.copyfileobj(spooled, dst, 16384)  # FileStorage.save buffer size
+    os.unlink(target)
+    return sha256.hexdigest()
+
+def single_pass(source, directory):
+    target = HashingFile(directory)
+    with open(source, 'rb') as body:
+        for chunk in iter(lambda: body.read(PARSER_CHUNK), b""):
+            target.write(chunk)
+    target.close()
+    staged = StagedFile(target.name, target.hexdigest(), target.size)
+    final = os.path.join(directory, 'bench_single_pass.bin')
+    commit_staged(staged, final)
+    os.unlink(final)
+    return staged.checksum
+
+def main():
+    parser = argparse.ArgumentParser(description='Upload ingest throughput benchmark')
+    parser.add_argument('--dir', required=True, help='Directory on the same filesystem as UPLOAD_FOLDER')
+    parser.add_argument('--size-gb', type=float, nargs='+', default=[1, 4])
+    args = parser.parse_args()
+
+    results = []
+    for size_gb in args.size_gb:
+        source = os.path.join(args.dir, 'bench_source.bin')
+        size = make_fixture(source, int(size_gb * 1024 ** 3))
+        try:
+            for name, func in (('legacy', legacy), ('single-pass', single_pass)):
+                start = time.perf_counter()
+                checksum = func(source, args.dir)
+                seconds = time.perf_counter() - start
+                results.append({'case': name, 'size_gb': size_gb, 'seconds': round(seconds, 2),
+                                'mb_per_s': round(size / 1024 ** 2 / seconds, 1), 'sha256': checksum})
+                print(f"{name:12s} {size_gb:5.1f} GB  {seconds:7.2f}s  {size / 1024 ** 2 / seconds:8.1f} MB/s")
+        finally:
+            os.unlink(source)
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
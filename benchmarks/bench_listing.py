@@ -0,0 +1,117 @@
+# benchmarks/bench_listing.py
+# Query count and latency of the index listing on a synthetic SQLite archive.
+#
+# "legacy" replays the old index(): load every video (transcription included),
+# look up the uploader per row and lazy-load each row's tags. "first page" and
+# "deep page" run listing.list_videos() at the top of the archive and from a
+# cursor half way down it.
+#
+#   python benchmarks/bench_listing.py --videos 10000 100000
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import event, insert
+from models import db, User, Video, Tag, video_tags
+from listing import list_videos, encode_cursor
+
+USERS = 20
+TAGS = 200
+TRANSCRIPT = 'lorem ipsum dolor sit amet ' * 400  # ~10 KB per video
+
+def make_app(path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{path}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+def populate(count):
+    db.create_all()
+    db.session.execute(insert(User), [
+        {'id': i, 'username': f"user{i}", 'password_hash': 'x', 'is_admin': i == 1} for i in range(1, USERS + 1)
+    ])
+    db.session.execute(insert(Tag), [{'id': i, 'name': f"tag{i}"} for i in range(1, TAGS + 1)])
+    start = datetime(2020, 1, 1)
+    for base in range(0, count, 5000):
+        ids = range(base + 1, min(base + 5000, count) + 1)
+        db.session.execute(insert(Video), [{
+            'id': i,
+            'title': f"Video {i}",
+            'filename': f"video_{i}.mp4",
+            'thumbnail': f"thumb_video_{i}.mp4.jpg",
+            # Minute resolution like the real default, so many rows share a timestamp
+            'upload_date': start + timedelta(minutes=i // 3),
+            'user_id': random.randint(1, USERS),
+            'checksum': f"{i:064x}",
+            'transcription': TRANSCRIPT,
+            'transcription_status': 'completed',
+        } for i in ids])
+        db.session.execute(insert(video_tags), [
+            {'video_id': i, 'tag_id': tag_id} for i in ids for tag_id in random.sample(range(1, TAGS + 1), 3)
+        ])
+    db.session.commit()
+
+def legacy(user):
+    query = Video.query.order_by(Video.upload_date.desc())
+    if not user.is_admin:
+        query = query.filter_by(user_id=user.id)
+    cards = []
+    for video in query.all():
+        uploader = db.session.get(User, video.user_id)
+        cards.append((video.title, uploader.username, [tag.name for tag in video.tags]))
+    return len(cards)
+
+def paged(user, cursor=None):
+    videos, _ = list_videos(user, cursor)
+    return len([(video.title, video.uploader.username, [tag.name for tag in video.tags]) for video in videos])
+
+def measure(counter, func, *args):
+    db.session.expunge_all()  # Cold identity map, as at the start of a request
+    counter[0] = 0
+    start = time.perf_counter()
+    rows = func(*args)
+    return {'ms': round((time.perf_counter() - start) * 1000, 1), 'queries': counter[0], 'rows': rows}
+
+def main():
+    parser = argparse.ArgumentParser(description='Index listing benchmark')
+    parser.add_argument('--videos', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--skip-legacy', action='store_true', help='Only run the paginated listing')
+    args = parser.parse_args()
+
+    results = []
+    for count in args.videos:
+        with tempfile.TemporaryDirectory() as directory:
+            app = make_app(os.path.join(directory, 'bench.db'))
+            with app.app_context():
+                populate(count)
+                counter = [0]
+                event.listen(db.engine, 'before_cursor_execute', lambda *a: counter.__setitem__(0, counter[0] + 1))
+                admin = db.session.get(User, 1)
+                user = db.session.get(User, 2)
+                middle = Video.query.order_by(Video.upload_date.desc(), Video.id.desc()).offset(count // 2).first()
+                cursor = encode_cursor(middle)
+
+                cases = [('first page', paged, ()), ('deep page', paged, (cursor,))]
+                if not args.skip_legacy:
+                    cases.insert(0, ('legacy', legacy, ()))
+                for role, account in (('admin', admin), ('user', user)):
+                    account_id = account.id
+                    for name, func, extra in cases:
+                        account = db.session.get(User, account_id)
+                        result = measure(counter, func, account, *extra)
+                        result.update({'videos': count, 'role': role, 'case': name})
+                        results.append(result)
+                        print(f"{count:7d} {role:5s} {name:10s} {result['ms']:9.1f} ms  {result['queries']:6d} queries  {result['rows']:6d} rows")
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
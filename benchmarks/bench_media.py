@@ -0,0 +1,154 @@
+# benchmarks/bench_media.py
+# Concurrent seek load test for the authorised media route (/media/<id>/original).
+#
+# Logs in to a running instance, checks the Range and conditional GET answers
+# once, then has --clients threads issue random Range requests of --chunk bytes
+# (what a player does when it seeks) on keep-alive connections. Every response
+# must be a 206 with the requested Content-Range and length; with --file the
+# bytes are also compared with a local copy of the upload. Reports requests/s,
+# throughput and latency percentiles. Run it against nginx to measure the
+# X-Accel-Redirect path and against "flask run --with-threads" for the
+# fallback.
+#
+#   python benchmarks/bench_media.py --url http://127.0.0.1 --username admin --password admin123 --video 1
+import argparse
+import http.client
+import json
+import random
+import statistics
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+def connect(url):
+    parts = urlsplit(url)
+    connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    return connection_class(parts.hostname, parts.port, timeout=60)
+
+def request(connection, path, cookie, headers=None, method='GET'):
+    connection.request(method, path, headers={'Cookie': cookie, **(headers or {})})
+    response = connection.getresponse()
+    return response, response.read()
+
+def login(url, username, password):
+    connection = connect(url)
+    body = urlencode({'username': username, 'password': password})
+    connection.request('POST', '/login', body=body, headers={'Content-Type': 'application/x-www-form-urlencoded'})
+    response = connection.getresponse()
+    response.read()
+    cookie = response.getheader('Set-Cookie')
+    if response.status != 302 or not cookie:
+        raise SystemExit(f"Login failed ({response.status})")
+    return cookie.split(';')[0]
+
+# One-off protocol checks; returns (file size, {check: passed})
+def check_protocol(url, path, cookie):
+    connection = connect(url)
+    response, _ = request(connection, path, cookie, method='HEAD')
+    if response.status != 200:
+        raise SystemExit(f"HEAD {path} returned {response.status}")
+    size = int(response.getheader('Content-Length'))
+    etag = response.getheader('ETag')
+    last_modified = response.getheader('Last-Modified')
+    checks = {'accept_ranges': response.getheader('Accept-Ranges') == 'bytes'}
+
+    response, body = request(connection, path, cookie, {'Range': 'bytes=-100'})
+    checks['suffix_range'] = response.status == 206 and len(body) == min(100, size)
+    response, body = request(connection, path, cookie, {'Range': f"bytes={size}-"})
+    checks['unsatisfiable_416'] = response.status == 416
+    response, body = request(connection, path, cookie, {'If-None-Match': etag or '"none"'})
+    checks['if_none_match_304'] = response.status == 304 and not body
+    response, body = request(connection, path, cookie, {'If-Modified-Since': last_modified or ''})
+    checks['if_modified_since_304'] = response.status == 304
+    # A stale If-Range must get the whole file; only the headers are read
+    stale = connect(url)
+    stale.request('GET', path, headers={'Cookie': cookie, 'Range': 'bytes=0-99', 'If-Range': '"stale"'})
+    response = stale.getresponse()
+    checks['stale_if_range_200'] = response.status == 200 and response.getheader('Content-Length') == str(size)
+    stale.close()
+
+    anonymous = connect(url)
+    anonymous.request('GET', path)
+    response = anonymous.getresponse()
+    response.read()
+    checks['anonymous_401'] = response.status == 401
+    return size, checks
+
+def client(url, path, cookie, size, chunk, count, reference, results, errors):
+    connection = connect(url)
+    for _ in range(count):
+        start = random.randrange(0, max(1, size - 1))
+        end = min(start + chunk, size) - 1
+        begin = time.perf_counter()
+        try:
+            response, body = request(connection, path, cookie, {'Range': f"bytes={start}-{end}"})
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(str(e))
+            connection = connect(url)
+            continue
+        elapsed = time.perf_counter() - begin
+        expected = f"bytes {start}-{end}/{size}"
+        if response.status != 206 or response.getheader('Content-Range') != expected or len(body) != end - start + 1:
+            errors.append(f"{response.status} {response.getheader('Content-Range')} for {expected}")
+        elif reference is not None and body != reference[start:end + 1]:
+            errors.append(f"Wrong bytes for {expected}")
+        else:
+            results.append((elapsed, len(body)))
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent seek load test for /media/')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--username', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--video', type=int, required=True, help='Video id')
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=50, help='Seeks per client')
+    parser.add_argument('--chunk', type=int, default=1024 * 1024, help='Bytes per Range request')
+    parser.add_argument('--file', help='Local copy of the upload to verify the returned bytes against')
+    args = parser.parse_args()
+
+    cookie = login(args.url, args.username, args.password)
+    path = f"/media/{args.video}/original"
+    size, checks = check_protocol(args.url, path, cookie)
+    reference = None
+    if args.file:
+        with open(args.file, 'rb') as f:
+            reference = f.read()
+
+    results, errors = [], []
+    threads = [threading.Thread(target=client, args=(args.url, path, cookie, size, args.chunk, args.requests,
+                                                     reference, results, errors))
+               for _ in range(args.clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    latencies = sorted(elapsed * 1000 for elapsed, _ in results)
+    report = {
+        'file_bytes': size,
+        'checks': checks,
+        'clients': args.clients,
+        'requests': len(results) + len(errors),
+        'errors': len(errors),
+        'error_samples': errors[:5],
+        'seconds': round(seconds, 2),
+        'requests_per_second': round(len(results) / seconds, 1),
+        'mb_per_second': round(sum(length for _, length in results) / seconds / 1024 / 1024, 1),
+    }
+    if latencies:
+        report.update({
+            'latency_ms_p50': round(statistics.median(latencies), 1),
+            'latency_ms_p95': round(percentile(latencies, 0.95), 1),
+            'latency_ms_p99': round(percentile(latencies, 0.99), 1),
+            'latency_ms_max': round(latencies[-1], 1),
+        })
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# benchmarks/bench_startup.py
+# Compare web worker start-up cost before and after the media worker split.
+#
+# "before" imports the web app together with the media stack (what every
+# gunicorn worker used to load), "after" imports only the web app. Each case
+# runs in a fresh interpreter; wall time and peak RSS are reported.
+#
+#   python benchmarks/bench_startup.py [--runs 5]
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = '''
+import resource, sys, time, json
+start = time.perf_counter()
+for name in sys.argv[1:]:
+    __import__(name)
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+'''
+
+CASES = {
+    'before (app + media)': ['app', 'media'],
+    'after (app only)': ['app'],
+}
+
+def run_case(modules, runs):
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', CHILD] + modules,
+            cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        'seconds_median': statistics.median(s['seconds'] for s in samples),
+        'max_rss_mb_median': statistics.median(s['max_rss_kb'] for s in samples) / 1024,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Web worker start-up benchmark')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    results = {name: run_case(modules, args.runs) for name, modules in CASES.items()}
+    for name, result in results.items():
+        print(f"{name:24s} import {result['seconds_median']:.2f}s  peak RSS {result['max_rss_mb_median']:.0f} MB")
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
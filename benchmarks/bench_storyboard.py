@@ -0,0 +1,117 @@
+# benchmarks/bench_storyboard.py
+# Throughput and peak memory of the storyboard pass (storyboard.py).
+#
+# A synthetic fixture is built from several ffmpeg test sources joined back to
+# back, so the expected scene cuts are known. The pass is timed and reported as
+# decoded source frames per second and analysed samples per second, together
+# with the peak RSS of the Python process and of ffmpeg. "--seek-baseline" also
+# times grabbing the same tiles with one fast-seeking ffmpeg run per tile.
+#
+#   python benchmarks/bench_storyboard.py --minutes 10 --resolution 1920x1080
+#   python benchmarks/bench_storyboard.py --video /opt/videoarchive/static/uploads/lecture.mp4
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from fractions import Fraction
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import FFMPEG_PATH
+from probe import probe_media, media_duration
+from storyboard import build_storyboard, tile_size, tile_interval
+
+SOURCES = ['testsrc2', 'smptebars', 'mandelbrot', 'rgbtestsrc', 'life', 'cellauto']
+FPS = 30
+
+def make_fixture(path, minutes, resolution):
+    segment = minutes * 60 / len(SOURCES)
+    command = [FFMPEG_PATH, '-v', 'error', '-y']
+    for source in SOURCES:
+        command += ['-f', 'lavfi', '-t', str(segment), '-i', f"{source}=size={resolution}:rate={FPS}"]
+    inputs = ''.join(f"[{i}:v]format=yuv420p,setsar=1[v{i}];" for i in range(len(SOURCES)))
+    graph = inputs + ''.join(f"[v{i}]" for i in range(len(SOURCES))) + f"concat=n={len(SOURCES)}:v=1:a=0[out]"
+    command += ['-filter_complex', graph, '-map', '[out]', '-c:v', 'libx264', '-preset', 'ultrafast', '-g', str(FPS * 4), path]
+    subprocess.run(command, check=True)
+    width, height = map(int, resolution.split('x'))
+    info = {
+        'format': {'duration': str(minutes * 60)},
+        'streams': [{'codec_type': 'video', 'width': width, 'height': height, 'avg_frame_rate': f"{FPS}/1"}]
+    }
+    cuts = [round(segment * i, 1) for i in range(1, len(SOURCES))]
+    return info, cuts
+
+def seek_baseline(video_path, info, work_dir):
+    width, height = tile_size(info)
+    interval = tile_interval(media_duration(info))
+    seconds = 0
+    while seconds < media_duration(info):
+        subprocess.run([
+            FFMPEG_PATH, '-v', 'error', '-y', '-ss', str(seconds), '-i', video_path,
+            '-frames:v', '1', '-vf', f"scale={width}:{height}", os.path.join(work_dir, 'seek.jpg')
+        ], check=True)
+        seconds += interval
+
+def frame_rate(info):
+    for stream in info['streams']:
+        if stream.get('codec_type') == 'video' and stream.get('avg_frame_rate', '0/0') != '0/0':
+            return float(Fraction(stream['avg_frame_rate']))
+    return FPS
+
+# Runs in a fresh process so the ffmpeg peak RSS is that of the pass alone
+def measure(video_path, info, seek):
+    with tempfile.TemporaryDirectory() as output_dir:
+        start = time.perf_counter()
+        result = build_storyboard(video_path, output_dir, info, prefix='bench')
+        seconds = time.perf_counter() - start
+        report = {
+            'video_seconds': round(result.seconds, 1),
+            'pass_seconds': round(seconds, 2),
+            'source_frames_per_second': round(result.seconds * frame_rate(info) / seconds, 1),
+            'samples_per_second': round(result.frames / seconds, 1),
+            'realtime_factor': round(result.seconds / seconds, 1),
+            'sheets': len(result.files['sheets']),
+            'chapters': [round(start, 1) for start, _ in result.chapters],
+            'poster_time': result.poster_time,
+            'python_peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'ffmpeg_peak_rss_mb': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        }
+        if seek:
+            start = time.perf_counter()
+            seek_baseline(video_path, info, output_dir)
+            report['seek_baseline_seconds'] = round(time.perf_counter() - start, 2)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Storyboard pass benchmark')
+    parser.add_argument('--video', help='Benchmark an existing file instead of a synthetic fixture')
+    parser.add_argument('--minutes', type=float, default=10)
+    parser.add_argument('--resolution', default='1280x720')
+    parser.add_argument('--seek-baseline', action='store_true', help='Also time one ffmpeg seek per storyboard tile')
+    parser.add_argument('--info', help=argparse.SUPPRESS)  # ffprobe-style JSON, used by the child process
+    args = parser.parse_args()
+
+    if args.info:
+        print(json.dumps(measure(args.video, json.loads(args.info), args.seek_baseline)))
+        return
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        if args.video:
+            video_path, info, expected_cuts = args.video, probe_media(args.video), None
+        else:
+            video_path = os.path.join(work_dir, 'fixture.mp4')
+            info, expected_cuts = make_fixture(video_path, args.minutes, args.resolution)
+        command = [sys.executable, os.path.abspath(__file__), '--video', video_path, '--info', json.dumps(info)]
+        if args.seek_baseline:
+            command.append('--seek-baseline')
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        report = json.loads(output.strip().splitlines()[-1])
+    report['expected_cuts'] = expected_cuts
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
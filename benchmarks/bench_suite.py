@@ -0,0 +1,348 @@
+# benchmarks/bench_suite.py
+# End-to-end benchmark of the whole pipeline on deterministic local fixtures,
+# with JSON results that can be compared between runs.
+#
+# Fixtures are clips that ffmpeg renders from its lavfi test sources (testsrc2
+# pictures and sine tones) with bit-exact, single-threaded encoders. The same
+# ffmpeg build therefore writes the same bytes every time; their checksums go
+# into the results. Fixtures are cached in --fixtures-dir.
+#
+# Each run gets a fresh SQLite database, media folders and derivative cache in
+# a temp directory, seeded with --users/--videos/--tags synthetic rows. Stages:
+#   upload     POST /upload of every fixture through the Flask test client
+#              (a second post of each is the duplicate path)
+#   worker     storyboard, thumbnail, hls_plan, hls and transcribe jobs, run
+#              in-process through the worker's handlers, timed per job
+#   web        index, tag filter, /api/videos first and deep page, search,
+#              tag facets and the video page, --repeat times each
+# Nothing touches the network or a GPU (CUDA is hidden). Transcription only
+# runs with --transcribe, and only with a Whisper model already in the local
+# cache; otherwise the stage is reported as skipped.
+#
+#   python benchmarks/bench_suite.py [--quick] [--output after.json] [--compare before.json]
+#   python benchmarks/bench_suite.py --compare before.json after.json
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+FIXTURES = [
+    # name, seconds, width, height, video encoder, audio encoder (None: silent), container
+    ('h264-360p-10s', 10, 640, 360, 'libx264', 'aac', 'mp4'),
+    ('h264-720p-30s', 30, 1280, 720, 'libx264', 'aac', 'mp4'),
+    ('h264-1080p-20s', 20, 1920, 1080, 'libx264', 'aac', 'mp4'),
+    ('hevc-720p-20s', 20, 1280, 720, 'libx265', 'aac', 'mkv'),
+    ('vp9-480p-20s', 20, 854, 480, 'libvpx-vp9', 'libopus', 'webm'),
+    ('mpeg4-480p-silent-15s', 15, 640, 480, 'mpeg4', None, 'avi'),
+    ('h264-360p-120s', 120, 640, 360, 'libx264', 'aac', 'mp4'),
+]
+QUICK_FIXTURES = ['h264-360p-10s', 'vp9-480p-20s', 'mpeg4-480p-silent-15s']
+
+ENCODER_OPTIONS = {
+    'libx264': ['-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p'],
+    'libx265': ['-preset', 'ultrafast', '-crf', '28', '-pix_fmt', 'yuv420p', '-x265-params', 'log-level=error:pools=none:frame-threads=1'],
+    'libvpx-vp9': ['-deadline', 'realtime', '-cpu-used', '8', '-b:v', '1M', '-pix_fmt', 'yuv420p'],
+    'mpeg4': ['-q:v', '5'],
+}
+WORKER_STAGES = ['fingerprint', 'storyboard', 'thumbnail', 'hls_plan', 'hls', 'transcribe']  # Storyboards first: thumbnails use their poster
+TAG_PREFIX = 'tag'
+
+def sha256_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def make_fixture(ffmpeg, directory, name, seconds, width, height, video_encoder, audio_encoder, container):
+    path = os.path.join(directory, f"{name}.{container}")
+    if os.path.exists(path):
+        return path
+    command = [ffmpeg, '-nostdin', '-y', '-v', 'error',
+               '-f', 'lavfi', '-i', f"testsrc2=size={width}x{height}:rate=30:duration={seconds}"]
+    if audio_encoder:
+        command += ['-f', 'lavfi', '-i', f"sine=frequency=440:beep_factor=4:sample_rate=48000:duration={seconds}"]
+    command += ['-threads', '1', '-map_metadata', '-1', '-fflags', '+bitexact', '-flags', '+bitexact',
+                '-c:v', video_encoder] + ENCODER_OPTIONS[video_encoder]
+    if audio_encoder:
+        command += ['-c:a', audio_encoder, '-b:a', '96k']
+    partial = path + '.partial'
+    subprocess.run(command + ['-f', {'mkv': 'matroska'}.get(container, container), partial], check=True)
+    os.replace(partial, path)
+    return path
+
+# Point the app at a throwaway database and folders. Must run before app is
+# imported: every module reads its settings from config at import time.
+def configure(work_dir, args):
+    os.environ['CUDA_VISIBLE_DEVICES'] = ''
+    import config
+    config.DB_PROVIDER = 'sqlite'
+    config.SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+    config.UPLOAD_FOLDER = os.path.join(work_dir, 'static', 'uploads')
+    config.THUMBNAIL_FOLDER = os.path.join(work_dir, 'static', 'thumbnails')
+    config.HLS_FOLDER = os.path.join(work_dir, 'static', 'hls')
+    config.DERIVATIVE_CACHE_FOLDER = os.path.join(work_dir, 'cache')
+    config.LOG_FILE = os.path.join(work_dir, 'bench.log')
+    config.LOG_LEVEL = 'WARNING'
+    config.FFMPEG_PATH = args.ffmpeg
+    config.FFPROBE_PATH = args.ffprobe
+    config.WHISPER_DEVICE = 'cpu'
+    config.WHISPER_MODEL = args.model
+    config.QUERY_COUNT_HEADER = True
+    for folder in (config.UPLOAD_FOLDER, config.THUMBNAIL_FOLDER, config.HLS_FOLDER, config.DERIVATIVE_CACHE_FOLDER):
+        os.makedirs(folder, exist_ok=True)
+
+def seed(db, users, videos, tags, seed_value):
+    from sqlalchemy import insert
+    from models import User, Video, Tag, video_tags
+    from search import reindex_all
+    rng = random.Random(seed_value)
+    db.session.execute(insert(User), [
+        {'username': f"bench{i}", 'password_hash': 'x', 'is_admin': False} for i in range(1, users + 1)
+    ])
+    user_ids = [row[0] for row in db.session.query(User.id).filter(User.username.like('bench%'))]
+    db.session.execute(insert(Tag), [{'name': f"{TAG_PREFIX}{i}"} for i in range(1, tags + 1)])
+    tag_ids = [row[0] for row in db.session.query(Tag.id).filter(Tag.name.like(f"{TAG_PREFIX}%"))]
+    start = datetime(2020, 1, 1)
+    words = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'archive', 'meeting', 'lecture', 'budget', 'review']
+    for base in range(0, videos, 5000):
+        ids = range(base + 1, min(base + 5000, videos) + 1)
+        rows = [{
+            'title': f"Seeded video {i}",
+            'filename': f"seeded_{i}.mp4",
+            'upload_date': start + timedelta(minutes=i // 3),
+            'user_id': rng.choice(user_ids),
+            'checksum': f"{i:064x}",
+            'transcription': ' '.join(rng.choice(words) for _ in range(200)),
+            'transcription_status': 'completed',
+            'duration': rng.uniform(10, 3600),
+            'width': 1280, 'height': 720,
+        } for i in ids]
+        db.session.execute(insert(Video), rows)
+    db.session.flush()
+    video_ids = [row[0] for row in db.session.query(Video.id).order_by(Video.id)]
+    db.session.execute(insert(video_tags), [
+        {'video_id': video_id, 'tag_id': tag_id}
+        for video_id in video_ids for tag_id in rng.sample(tag_ids, min(3, len(tag_ids)))
+    ])
+    db.session.commit()
+    reindex_all()
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        'runs': len(ordered),
+        'median_ms': round(statistics.median(ordered) * 1000, 2),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 2),
+        'min_ms': round(ordered[0] * 1000, 2),
+    }
+
+def whisper_model_cached(model):
+    root = os.path.join(os.getenv('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')), 'whisper')
+    return os.path.exists(os.path.join(root, f"{model}.pt"))
+
+def bench_uploads(client, fixtures):
+    results = []
+    for name, path in fixtures:
+        size = os.path.getsize(path)
+        for case in ('new', 'duplicate'):
+            with open(path, 'rb') as f:
+                start = time.perf_counter()
+                response = client.post('/upload', data={'videos': (f, os.path.basename(path))},
+                                       content_type='multipart/form-data')
+                seconds = time.perf_counter() - start
+            status = (response.get_json() or {}).get(os.path.basename(path))
+            results.append({'stage': 'upload', 'case': f"{name} {case}", **summarize([seconds]),
+                            'mb_per_s': round(size / seconds / 1024 / 1024, 1), 'status': status,
+                            'queries': int(response.headers.get('X-Query-Count', 0))})
+    return results
+
+def bench_worker(app, args):
+    from jobs import lease_job, complete_job, fail_job
+    from models import db, Video
+    from worker import JOB_HANDLERS
+    results = []
+    titles = {}
+    kinds = [kind for kind in WORKER_STAGES if kind != 'transcribe']
+    if args.transcribe:
+        if whisper_model_cached(args.model):
+            kinds.append('transcribe')
+        else:
+            results.append({'stage': 'worker', 'case': 'transcribe', 'skipped': f"Whisper '{args.model}' is not in the local model cache"})
+    with app.app_context():
+        for kind in kinds:
+            while True:
+                job = lease_job('bench', kinds=[kind])
+                if not job:
+                    break
+                job_id, video_id = job.id, job.video_id
+                if video_id not in titles:
+                    titles[video_id] = os.path.splitext(db.session.get(Video, video_id).title)[0]
+                start = time.perf_counter()
+                error = None
+                try:
+                    JOB_HANDLERS[kind](job)
+                    seconds = time.perf_counter() - start
+                    complete_job(db.session.get(type(job), job_id))
+                except Exception as e:
+                    seconds = time.perf_counter() - start
+                    db.session.rollback()
+                    error = str(e)
+                    job = db.session.get(type(job), job_id)
+                    job.max_attempts = job.attempts  # No retries in a benchmark
+                    fail_job(job, error)
+                case = f"{kind} {titles[video_id]}"
+                if kind == 'hls':
+                    case += f" {json.loads(job.payload or '{}').get('rendition')}"
+                result = {'stage': 'worker', 'case': case, **summarize([seconds])}
+                if error:
+                    result['error'] = error
+                results.append(result)
+    return results
+
+def bench_web(app, client, repeat):
+    from listing import encode_cursor
+    from models import db, Video
+    with app.app_context():
+        middle = db.session.query(Video).order_by(Video.upload_date.desc(), Video.id.desc()).offset(
+            db.session.query(Video).count() // 2).first()
+        cursor = encode_cursor(middle) if middle else ''
+        newest = db.session.query(Video.id).order_by(Video.id.desc()).first()[0]
+    cases = [
+        ('index', '/'),
+        ('index tag filter', f"/?tag={TAG_PREFIX}1"),
+        ('api videos first page', '/api/videos'),
+        ('api videos deep page', f"/api/videos?cursor={cursor}"),
+        ('api videos duration filter', '/api/videos?min_duration=600&max_duration=1200'),
+        ('api search', '/api/search?q=budget+review'),
+        ('api tags', '/api/tags'),
+        ('video page', f"/video/{newest}"),
+    ]
+    results = []
+    for name, url in cases:
+        for _ in range(2):  # Warm up caches and the connection pool
+            client.get(url)
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = client.get(url)
+            samples.append(time.perf_counter() - start)
+        result = {'stage': 'web', 'case': name, **summarize(samples), 'status': response.status_code,
+                  'queries': int(response.headers.get('X-Query-Count', 0))}
+        results.append(result)
+    return results
+
+def tool_version(path):
+    try:
+        return subprocess.run([path, '-version'], capture_output=True, text=True).stdout.splitlines()[0]
+    except (OSError, IndexError):
+        return None
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def run(args):
+    names = QUICK_FIXTURES if args.quick else [fixture[0] for fixture in FIXTURES]
+    os.makedirs(args.fixtures_dir, exist_ok=True)
+    fixtures = []
+    for spec in FIXTURES:
+        if spec[0] in names:
+            start = time.perf_counter()
+            path = make_fixture(args.ffmpeg, args.fixtures_dir, *spec)
+            fixtures.append((spec[0], path))
+            print(f"fixture {spec[0]:24s} {os.path.getsize(path) / 1024 / 1024:7.1f} MB  ({time.perf_counter() - start:.1f}s)", file=sys.stderr)
+
+    with tempfile.TemporaryDirectory(prefix='videoarchive-bench-') as work_dir:
+        configure(work_dir, args)
+        from app import app
+        from models import db
+        with app.app_context():
+            start = time.perf_counter()
+            seed(db, args.users, args.videos, args.tags, args.seed)
+            print(f"seeded {args.videos} videos in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+        client = app.test_client()
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+
+        results = bench_uploads(client, fixtures)
+        results += bench_worker(app, args)
+        results += bench_web(app, client, args.repeat)
+
+    return {
+        'meta': {
+            'created': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'ffmpeg': tool_version(args.ffmpeg),
+            'seed': args.seed, 'users': args.users, 'videos': args.videos, 'tags': args.tags, 'repeat': args.repeat,
+            'fixtures': {name: sha256_file(path) for name, path in fixtures},
+        },
+        'results': results,
+    }
+
+# Median change per stage/case between two result files
+def compare(before, after):
+    if before['meta'].get('fixtures') != after['meta'].get('fixtures'):
+        print('warning: the fixtures differ (another ffmpeg build?); worker stages are not comparable')
+    for key in ('videos', 'users', 'tags', 'repeat', 'seed'):
+        if before['meta'].get(key) != after['meta'].get(key):
+            print(f"warning: {key} differs ({before['meta'].get(key)} -> {after['meta'].get(key)})")
+    old = {(result['stage'], result['case']): result for result in before['results']}
+    print(f"{'stage':7s} {'case':46s} {'before':>10s} {'after':>10s} {'change':>8s}")
+    for result in after['results']:
+        previous = old.get((result['stage'], result['case']))
+        if not previous or 'median_ms' not in previous or 'median_ms' not in result:
+            continue
+        change = (result['median_ms'] - previous['median_ms']) / previous['median_ms'] * 100 if previous['median_ms'] else 0.0
+        print(f"{result['stage']:7s} {result['case'][:46]:46s} {previous['median_ms']:8.1f}ms {result['median_ms']:8.1f}ms {change:+7.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end Video Archive benchmark suite')
+    parser.add_argument('files', nargs='*', help='With --compare: a result file to compare instead of running')
+    parser.add_argument('--quick', action='store_true', help=f"Only the fixtures {', '.join(QUICK_FIXTURES)}")
+    parser.add_argument('--fixtures-dir', default=os.path.join(tempfile.gettempdir(), 'videoarchive-bench-fixtures'))
+    parser.add_argument('--ffmpeg', default='ffmpeg')
+    parser.add_argument('--ffprobe', default='ffprobe')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--videos', type=int, default=10000, help='Seeded videos besides the uploaded fixtures')
+    parser.add_argument('--tags', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=20, help='Timed runs per web case')
+    parser.add_argument('--transcribe', action='store_true', help='Also time transcription (needs a locally cached model)')
+    parser.add_argument('--model', default='tiny', help='Whisper model for --transcribe')
+    parser.add_argument('--output', help='Write the JSON results here instead of stdout')
+    parser.add_argument('--compare', metavar='BASELINE', help='Print the change against an earlier result file')
+    args = parser.parse_args()
+
+    if args.compare and args.files:
+        with open(args.compare) as before, open(args.files[0]) as after:
+            compare(json.load(before), json.load(after))
+        return
+
+    report = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+if __name__ == '__main__':
+    main()
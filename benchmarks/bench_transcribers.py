@@ -0,0 +1,139 @@
+# benchmarks/bench_transcribers.py
+# Transcriber backends (see transcribers.py) compared on the same recordings:
+# wall time, peak memory and word error rate.
+#
+# Each input is decoded once, up front. Every (backend, model, threads) case
+# then runs in a fresh spawned process, so its peak RSS covers that backend's
+# libraries and model only. The process's RSS before loading the backend is
+# reported as well. The model is loaded once per case, and each input is
+# transcribed after that: load time and inference time are reported
+# separately, and RTF = inference seconds / audio seconds.
+# WER is the word-level edit distance to a reference transcript divided by
+# its word count, after lower-casing and dropping punctuation. The reference
+# is the .txt file next to the input with the same name; inputs without one
+# get no WER. Models must already be downloaded.
+#
+#   python benchmarks/bench_transcribers.py --input talk.mp4 interview.wav [--backends whisper faster-whisper]
+#          [--model tiny] [--threads 4 8] [--output results.json]
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio import load_audio, SAMPLE_RATE
+from transcribers import TRANSCRIBERS
+
+def peak_rss_bytes():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Linux reports KiB
+
+def normalize_words(text):
+    return re.sub(r"[^\w\s']", ' ', text.lower()).split()
+
+# Word error rate: (substitutions + deletions + insertions) / reference words.
+# One Levenshtein row per reference word, in NumPy; the insertion step along
+# the row is a running minimum of row[j] - j.
+def word_error_rate(reference, hypothesis):
+    reference, hypothesis = normalize_words(reference), normalize_words(hypothesis)
+    if not reference:
+        return float(bool(hypothesis))
+    vocabulary = {word: number for number, word in enumerate(set(reference) | set(hypothesis))}
+    hyp = np.array([vocabulary[word] for word in hypothesis], dtype=np.int64)
+    columns = np.arange(len(hyp) + 1)
+    row = columns.copy()
+    for i, word in enumerate(reference, start=1):
+        new = np.empty_like(row)
+        new[0] = i
+        new[1:] = np.minimum(row[1:] + 1, row[:-1] + (hyp != vocabulary[word]))
+        new = np.minimum.accumulate(new - columns) + columns
+        row = new
+    return float(row[-1] / len(reference))
+
+# Runs in a fresh process per case
+def run_case(backend, model_name, threads, audio_paths):
+    from speech import model_registry
+    from transcribers import get_transcriber
+    baseline = peak_rss_bytes()
+    start = time.perf_counter()
+    model, _ = model_registry.get(model_name, 'cpu', backend=backend, threads=threads)
+    load_seconds = time.perf_counter() - start
+    loaded = peak_rss_bytes()
+    runs = []
+    for path in audio_paths:
+        audio = np.load(path)
+        start = time.perf_counter()
+        segments = get_transcriber(backend).transcribe(model, audio, threads=threads)
+        runs.append({'seconds': time.perf_counter() - start, 'segments': len(segments),
+                     'text': ' '.join(segment['text'].strip() for segment in segments)})
+    return {'load_seconds': load_seconds, 'baseline_rss': baseline, 'loaded_rss': loaded, 'peak_rss': peak_rss_bytes(), 'runs': runs}
+
+def main():
+    parser = argparse.ArgumentParser(description='Transcriber backend benchmark')
+    parser.add_argument('--input', nargs='+', required=True, help='Video or audio files with speech')
+    parser.add_argument('--backends', nargs='+', default=list(TRANSCRIBERS), choices=list(TRANSCRIBERS))
+    parser.add_argument('--model', default='tiny')
+    parser.add_argument('--threads', type=int, nargs='+', default=[os.cpu_count() or 1],
+                        help='CPU thread counts to try for every backend')
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    references = {}
+    with tempfile.TemporaryDirectory(prefix='bench-transcribers-') as work_dir:
+        audio_paths, durations = [], []
+        for number, path in enumerate(args.input):
+            audio = load_audio(path)
+            audio_paths.append(os.path.join(work_dir, f"{number}.npy"))
+            np.save(audio_paths[-1], audio)
+            durations.append(len(audio) / SAMPLE_RATE)
+            reference = os.path.splitext(path)[0] + '.txt'
+            if os.path.exists(reference):
+                with open(reference) as f:
+                    references[path] = f.read()
+
+        results = []
+        for backend in args.backends:
+            for threads in args.threads:
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                    try:
+                        case = executor.submit(run_case, backend, args.model, threads, audio_paths).result()
+                    except Exception as e:
+                        print(f"{backend:15s} threads={threads:2d}  failed: {str(e)}")
+                        results.append({'backend': backend, 'threads': threads, 'error': str(e)})
+                        continue
+                print(f"{backend:15s} threads={threads:2d}  load={case['load_seconds']:6.2f}s  "
+                      f"RSS {case['baseline_rss'] / 2**20:.0f} -> {case['peak_rss'] / 2**20:.0f} MB")
+                for path, duration, run in zip(args.input, durations, case['runs']):
+                    wer = word_error_rate(references[path], run['text']) if path in references else None
+                    results.append({
+                        'backend': backend,
+                        'threads': threads,
+                        'input': path,
+                        'audio_seconds': round(duration, 1),
+                        'load_seconds': round(case['load_seconds'], 2),
+                        'seconds': round(run['seconds'], 2),
+                        'rtf': round(run['seconds'] / duration, 4) if duration else None,
+                        'baseline_rss_mb': round(case['baseline_rss'] / 2**20, 1),
+                        'loaded_rss_mb': round(case['loaded_rss'] / 2**20, 1),
+                        'peak_rss_mb': round(case['peak_rss'] / 2**20, 1),
+                        'segments': run['segments'],
+                        'wer': round(wer, 4) if wer is not None else None,
+                    })
+                    print(f"    {os.path.basename(path):30s} wall={run['seconds']:8.2f}s  RTF={results[-1]['rtf']}"
+                          f"  WER={'-' if wer is None else f'{wer:.3f}'}")
+
+    report = {'model': args.model, 'cpu_count': os.cpu_count(), 'results': results}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
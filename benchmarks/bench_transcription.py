@@ -0,0 +1,68 @@
+# benchmarks/bench_transcription.py
+# Real-time factor of chunked transcription against the number of processes.
+#
+# RTF = wall seconds / audio seconds (lower is better). Models are loaded in
+# every pool process before timing starts, so only inference is measured.
+#
+#   python benchmarks/bench_transcription.py --input lecture.mp4 [--model tiny] [--workers 1 2 4 8] [--backend faster-whisper]
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio import load_audio, SAMPLE_RATE
+from speech import model_registry, transcribe_chunked, paragraph_text, chunk_threads
+from transcribers import TRANSCRIBERS, get_transcriber
+
+def _warm_up(model_name, backend, threads):
+    model_registry.get(model_name, 'cpu', backend=backend, threads=threads)
+    return os.getpid()
+
+def run(audio, model_name, workers, backend):
+    if workers == 1:
+        model, _ = model_registry.get(model_name, 'cpu', backend=backend)
+        start = time.perf_counter()
+        segments = get_transcriber(backend).transcribe(model, audio)
+        return time.perf_counter() - start, segments
+
+    threads = chunk_threads(0, workers)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        # Load the model in every process before timing
+        pids = set()
+        while len(pids) < workers:
+            pids.update(executor.map(_warm_up, [model_name] * workers, [backend] * workers, [threads] * workers))
+        start = time.perf_counter()
+        segments = transcribe_chunked(audio, model_name, 'cpu', executor=executor, backend=backend, threads=threads)
+        return time.perf_counter() - start, segments
+
+def main():
+    parser = argparse.ArgumentParser(description='Chunked transcription benchmark')
+    parser.add_argument('--input', required=True, help='Video or audio file with speech')
+    parser.add_argument('--model', default='tiny')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--backend', default='whisper', choices=list(TRANSCRIBERS))
+    args = parser.parse_args()
+
+    audio = load_audio(args.input)
+    duration = len(audio) / SAMPLE_RATE
+    results = []
+    for workers in args.workers:
+        seconds, segments = run(audio, args.model, workers, args.backend)
+        results.append({
+            'workers': workers,
+            'seconds': round(seconds, 2),
+            'rtf': round(seconds / duration, 4),
+            'segments': len(segments),
+            'paragraphs': len(paragraph_text(segments).split('\n\n')),
+        })
+        print(f"workers={workers:2d}  wall={seconds:8.2f}s  RTF={seconds / duration:.4f}")
+    print(json.dumps({'input': args.input, 'audio_seconds': round(duration, 1), 'model': args.model, 'backend': args.backend,
+                      'results': results}, indent=2))
+
+if __name__ == '__main__':
+    main()
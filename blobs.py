@@ -0,0 +1,247 @@
+# blobs.py
+# Content-addressed storage of uploads.
+#
+# Every distinct upload is stored once, under UPLOAD_FOLDER/blobs/ by its
+# SHA-256, and has a Blob row counting the Videos that reference it (through
+# Video.checksum). When several users upload the same recording they share the
+# bytes and everything derived from them: thumbnails, storyboard, chapters,
+# HLS renditions and the transcript are produced once and copied to every
+# Video with the same checksum. The bytes are removed with the last reference.
+#
+# Uploads stored before blobs keep their own file (UPLOAD_FOLDER/<filename>)
+# until `flask migrate-blobs` moves it. While that file exists it is the
+# video's storage, whatever Blob has the same checksum, and the video is not
+# counted in the Blob's refcount.
+import logging
+import os
+import uuid
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from config import UPLOAD_FOLDER
+from models import db, Blob, Video, Chapter, Rendition, Job
+from jobs import enqueue_job, job_payload
+from storage import commit_staged, discard_staged, compute_checksum
+from hls import adopt_legacy_renditions, write_master_playlist, remove_rendition_files
+
+logger = logging.getLogger(__name__)
+
+BLOB_DIRECTORY = 'blobs'
+
+def blob_relative_path(checksum):
+    return os.path.join(BLOB_DIRECTORY, checksum[:2], checksum)
+
+# Blob row locked for the rest of the transaction (PostgreSQL; SQLite
+# serialises writers anyway)
+def _locked_blob(checksum):
+    return db.session.query(Blob).filter_by(checksum=checksum).with_for_update().first()
+
+# True while a video uploaded before blobs still has its own file
+def has_legacy_file(video):
+    return os.path.isfile(os.path.join(UPLOAD_FOLDER, video.filename))
+
+# Path of a video's file relative to UPLOAD_FOLDER: the per-video file of
+# uploads stored before blobs until `flask migrate-blobs` has run, else its blob
+def video_storage_path(video):
+    if has_legacy_file(video):
+        return video.filename
+    blob = db.session.get(Blob, video.checksum)
+    return blob.path if blob else video.filename
+
+def video_file_path(video):
+    return os.path.join(UPLOAD_FOLDER, video_storage_path(video))
+
+# Other videos with the same content, oldest first
+def sibling_videos(video):
+    return db.session.query(Video).filter(Video.checksum == video.checksum, Video.id != video.id).order_by(Video.id).all()
+
+# Store a staged upload as a blob, or drop it if the content is already
+# stored, and take a reference. Content that only exists as an unmigrated
+# upload's own file is hard-linked into the blob store instead of being
+# stored twice. Returns (Blob, True if the bytes were new).
+def acquire_blob(staged):
+    blob = _locked_blob(staged.checksum)
+    if not blob:
+        blob = Blob(checksum=staged.checksum, path=blob_relative_path(staged.checksum), size=staged.size, refcount=0)
+        try:
+            with db.session.begin_nested():
+                db.session.add(blob)
+        except IntegrityError:
+            # Another request stored the same content first
+            blob = _locked_blob(staged.checksum)
+
+    # A blob whose last reference was released is renamed away before that
+    # transaction commits (see release_blob), so while the row is locked an
+    # existing file is this content
+    path = os.path.join(UPLOAD_FOLDER, blob.path)
+    stored = os.path.exists(path)
+    if stored:
+        discard_staged(staged)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        legacy_path = _legacy_file_path(staged.checksum)
+        if legacy_path:
+            os.link(legacy_path, path)  # Same folder, so same file system
+            discard_staged(staged)
+            stored = True
+            logger.info(f"Linked {legacy_path} into the blob store for content {staged.checksum[:12]}")
+        else:
+            commit_staged(staged, path)
+    blob.refcount = Blob.refcount + 1
+    return blob, not stored
+
+# Own file of an unmigrated upload with this content, if any
+def _legacy_file_path(checksum):
+    for video in db.session.query(Video).filter_by(checksum=checksum).order_by(Video.id):
+        if has_legacy_file(video):
+            return os.path.join(UPLOAD_FOLDER, video.filename)
+    return None
+
+# Drop a video's reference to its content. Returns the path of the file to
+# delete once the transaction has committed, or None if other videos still
+# use the content. An unmigrated upload only gives up its own file.
+#
+# The last reference deletes the Blob row and, still holding its lock, renames
+# the file to a unique name. An upload of the same content that waited for
+# the lock then finds neither row nor file and stores fresh bytes, which the
+# delete cannot remove. restore_blob() undoes the rename if the transaction
+# fails.
+def release_blob(video):
+    if has_legacy_file(video):
+        return os.path.join(UPLOAD_FOLDER, video.filename)
+    blob = _locked_blob(video.checksum)
+    if not blob:
+        return None
+    blob.refcount = Blob.refcount - 1
+    db.session.flush()
+    if blob.refcount > 0:
+        return None
+    db.session.delete(blob)
+    db.session.flush()
+    path = os.path.join(UPLOAD_FOLDER, blob.path)
+    if not os.path.exists(path):
+        return None
+    released = os.path.join(os.path.dirname(path), f".released-{uuid.uuid4().hex}-{os.path.basename(path)}")
+    os.rename(path, released)
+    return released
+
+# Put back a file release_blob() renamed when its transaction was rolled back
+def restore_blob(released):
+    name = os.path.basename(released)
+    if not name.startswith('.released-') or not os.path.exists(released):
+        return
+    path = os.path.join(os.path.dirname(released), name.split('-', 2)[2])
+    if os.path.exists(path):
+        os.remove(released)  # The content was stored again meanwhile
+    else:
+        os.rename(released, path)
+
+# Give a video the derived files of another video with the same content
+def copy_derived(source, video):
+    video.thumbnail = source.thumbnail
+    video.thumbnail_set = source.thumbnail_set
+    video.storyboard = source.storyboard
+    video.poster_time = source.poster_time
+    video.chapters = [Chapter(start=chapter.start, end=chapter.end, title=chapter.title) for chapter in source.chapters]
+    copy_renditions(source, video)
+
+def copy_renditions(source, video):
+    existing = {rendition.name: rendition for rendition in video.renditions}
+    for rendition in source.renditions:
+        target = existing.pop(rendition.name, None)
+        if not target:
+            target = Rendition(name=rendition.name)
+            video.renditions.append(target)
+        for field in ('width', 'height', 'bandwidth', 'status', 'playlist', 'error'):
+            setattr(target, field, getattr(rendition, field))
+    for rendition in existing.values():
+        video.renditions.remove(rendition)
+
+# Kinds of jobs waiting or running for any video with this content
+def pending_job_kinds(checksum):
+    rows = db.session.query(Job.kind).join(Video, Video.id == Job.video_id).filter(
+        Video.checksum == checksum,
+        Job.status.in_(['queued', 'running'])
+    ).distinct()
+    return {kind for kind, in rows}
+
+# Jobs of a video that is about to be deleted are queued again for a copy
+# with the same content, which would otherwise never get their results. Part
+# of the caller's transaction.
+def hand_over_jobs(video, sibling):
+    jobs = db.session.query(Job).filter(Job.video_id == video.id, Job.status.in_(['queued', 'running'])).all()
+    for job in jobs:
+        if job.kind == 'transcribe' and sibling.transcription_status != 'queued':
+            continue
+        enqueue_job(sibling.id, job.kind, payload=job_payload(job), commit=False)
+
+# Move the per-video files of uploads stored before blobs (and their v<id>/
+# HLS directories) into the content-addressed layout, then recount the
+# references. Safe to re-run. Returns the number of videos per outcome.
+def migrate_to_blobs(hls_folder, verify=False):
+    counts = {'moved': 0, 'deduplicated': 0, 'missing': 0, 'mismatched': 0, 'renditions': 0, 'orphaned': 0}
+    for video in db.session.query(Video).order_by(Video.id).all():
+        relative_path = blob_relative_path(video.checksum)
+        path = os.path.join(UPLOAD_FOLDER, relative_path)
+        legacy_path = os.path.join(UPLOAD_FOLDER, video.filename)
+        if os.path.isfile(legacy_path):
+            if verify:
+                with open(legacy_path, 'rb', buffering=0) as f:
+                    checksum = compute_checksum(f)
+                if checksum != video.checksum:
+                    logger.error(f"Checksum mismatch for video {video.id} ({legacy_path}); left in place")
+                    counts['mismatched'] += 1
+                    continue
+            if os.path.exists(path):
+                os.remove(legacy_path)
+                counts['deduplicated'] += 1
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(legacy_path, path)
+                counts['moved'] += 1
+        elif not os.path.exists(path):
+            logger.warning(f"No file found for video {video.id} ({video.filename})")
+            counts['missing'] += 1
+            continue
+
+        if not db.session.get(Blob, video.checksum):
+            db.session.add(Blob(checksum=video.checksum, path=relative_path, size=os.path.getsize(path), refcount=0))
+        adopted = adopt_legacy_renditions(hls_folder, video)
+        db.session.commit()
+        if adopted:
+            write_master_playlist(hls_folder, video)
+            counts['renditions'] += 1
+
+    # Copies uploaded separately before blobs existed now share one HLS ladder
+    duplicated = db.session.query(Video.checksum).group_by(Video.checksum).having(func.count(Video.id) > 1)
+    for checksum, in duplicated.all():
+        videos = db.session.query(Video).filter_by(checksum=checksum).order_by(Video.id).all()
+        source = next((video for video in videos if any(r.status == 'completed' for r in video.renditions)), None)
+        if not source:
+            continue
+        shared = {rendition.playlist for rendition in source.renditions}
+        for video in videos:
+            if video is source:
+                continue
+            for rendition in video.renditions:
+                if rendition.playlist not in shared:
+                    remove_rendition_files(hls_folder, rendition.playlist)
+            copy_renditions(source, video)
+        db.session.commit()
+        write_master_playlist(hls_folder, source)
+
+    # Recount references from the videos, which also repairs any drift.
+    # Videos whose own file was left in place (mismatched) do not count.
+    references = {}
+    for video in db.session.query(Video).all():
+        if not has_legacy_file(video):
+            references[video.checksum] = references.get(video.checksum, 0) + 1
+    for blob in db.session.query(Blob).all():
+        blob.refcount = references.get(blob.checksum, 0)
+        if not blob.refcount:
+            path = os.path.join(UPLOAD_FOLDER, blob.path)
+            if os.path.exists(path):
+                os.remove(path)
+            db.session.delete(blob)
+            counts['orphaned'] += 1
+    db.session.commit()
+    return counts
@@ -4,8 +4,11 @@ SECRET_KEY = 'x7k9p2m4q8r5t3v6w1z0'
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 UPLOAD_FOLDER = '/opt/videoarchive/static/uploads'  # Absolute path
 THUMBNAIL_FOLDER = '/opt/videoarchive/static/thumbnails'
+HLS_FOLDER = '/opt/videoarchive/static/hls'
 LOG_FILE = '/var/log/videoarchive.log'
 LOG_LEVEL = 'INFO'
+FFMPEG_PATH = '/usr/bin/ffmpeg'
+FFPROBE_PATH = '/usr/bin/ffprobe'
 
 # Database configuration (hardcoded)
 DB_PROVIDER = 'postgresql'
@@ -19,3 +22,102 @@ if DB_PROVIDER.lower() == 'sqlite':
     SQLALCHEMY_DATABASE_URI = 'sqlite:////opt/videoarchive/instance/videoarchive.db'
 else:
     SQLALCHEMY_DATABASE_URI = f'postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}'
+
+# Background job queue
+JOB_WORKERS = 2            # Concurrent jobs (e.g. Whisper runs) per process
+JOB_MAX_ATTEMPTS = 3       # Tries before a job is marked failed
+JOB_LEASE_SECONDS = 900    # A running job whose lease is not renewed in time is requeued
+JOB_RETRY_DELAY = 60       # Seconds, multiplied by the attempt number
+JOB_POLL_INTERVAL = 2      # Seconds between polls when the queue is empty
+JOB_REAP_INTERVAL = 60     # Seconds between stuck-job sweeps
+
+# Speech-to-text
+TRANSCRIBER_BACKEND = 'whisper'                       # 'whisper' (openai-whisper on PyTorch) or 'faster-whisper' (CTranslate2, see transcribers.py)
+FASTER_WHISPER_COMPUTE_TYPE = 'int8'                  # faster-whisper weight type: int8 on CPU; int8_float16 or float16 on a GPU
+WHISPER_MODEL = 'tiny'                                # Default model for new transcriptions
+WHISPER_MODELS = ['tiny', 'base', 'small', 'medium']  # Models users may pick per video
+WHISPER_DEVICE = None                                 # None picks cuda when available, else cpu
+WHISPER_CACHE_MAX_MODELS = 2                          # Loaded models kept per worker process
+WHISPER_CACHE_MAX_BYTES = 3 * 1024 * 1024 * 1024      # Evict least recently used models above this
+TRANSCRIBE_THREADS = 0               # CPU threads per transcription job (0: backend default); a job's payload may override it
+TRANSCRIBE_PROCESSES = 4             # CPU processes for chunked transcription (1 disables chunking)
+TRANSCRIBE_CHUNK_SECONDS = 300       # Target chunk length for long recordings
+TRANSCRIBE_CHUNK_MIN_DURATION = 600  # Recordings shorter than this are transcribed in one piece
+TRANSCRIBE_SPLIT_SEARCH_SECONDS = 15 # Look this far either side of a chunk boundary for silence
+
+# Thumbnails
+THUMBNAIL_SIZES = [160, 320, 640]     # Square thumbnail edge lengths in pixels
+THUMBNAIL_FORMATS = ['webp', 'jpeg']  # WebP is skipped if ffmpeg lacks libwebp
+THUMBNAIL_DEFAULT_SIZE = 320          # JPEG used as the plain <img src> fallback
+
+# Storyboards and chapters (one decode pass per video, see storyboard.py)
+STORYBOARD_ANALYSIS_FPS = 2      # Frames per second sampled for scene detection and poster choice
+STORYBOARD_TILE_WIDTH = 160      # Pixels; also the analysis resolution
+STORYBOARD_COLUMNS = 10          # Tiles per sprite sheet row
+STORYBOARD_ROWS = 10             # Tile rows per sprite sheet
+STORYBOARD_MIN_INTERVAL = 2      # Seconds between storyboard tiles for short videos
+STORYBOARD_MAX_TILES = 400       # Longer videos space tiles out to stay under this
+SCENE_CHANGE_THRESHOLD = 0.4     # Histogram distance (0-1) between samples that counts as a cut
+CHAPTER_MIN_SECONDS = 30         # Cuts closer than this to the previous chapter start are ignored
+
+# HLS streaming ladder (see hls.py). Renditions taller than the source are skipped.
+HLS_RENDITIONS = [
+    # name, height, video kbit/s, audio kbit/s
+    ('360p', 360, 800, 96),
+    ('720p', 720, 2800, 128),
+    ('1080p', 1080, 5000, 160),
+]
+HLS_SEGMENT_SECONDS = 6    # Target segment length; keyframes are forced on these boundaries
+HLS_X264_PRESET = 'veryfast'
+
+# Derivative cache: outputs derived from upload content, keyed by checksum,
+# stage and parameters (see derivatives.py)
+DERIVATIVE_CACHE_FOLDER = '/opt/videoarchive/cache'  # Not under static/; never served
+DERIVATIVE_CACHE_MAX_BYTES = 20 * 1024 * 1024 * 1024  # Least recently used entries are evicted above this
+DERIVATIVE_VERSIONS = {  # Bump a stage after changing how it is produced to stop using its cached outputs
+    'audio': 1,
+    'transcript': 1,
+    'thumbnails': 1,
+    'storyboard': 1,
+}
+
+# Near-duplicate detection (see fingerprints.py)
+FINGERPRINT_FPS = 1               # Frames per second hashed
+FINGERPRINT_INDEX_FRAMES = 16     # Hashes per content kept in the worker's in-memory index
+FINGERPRINT_QUERY_FRAMES = 64     # Hashes of a new upload looked up in the index
+FINGERPRINT_FRAME_DISTANCE = 7    # Differing bits (of 64) up to which two frames match
+FINGERPRINT_MATCH_RATIO = 0.6     # Share of the shorter video's frames that must match for a likely duplicate
+
+# Media delivery
+MEDIA_ACCEL_PREFIX = '/_media'  # nginx internal locations for X-Accel-Redirect (see setup/videoarchive.nginx)
+
+# Processing progress pushed to browsers (see progress.py)
+PROGRESS_POLL_INTERVAL = 1     # Seconds between progress reads per web process while any page listens
+PROGRESS_HEARTBEAT = 15        # Seconds between keep-alive comments on an idle event stream
+PROGRESS_STREAM_SECONDS = 300  # Streams are closed after this; EventSource reconnects by itself
+PROGRESS_MIN_INTERVAL = 1      # The worker writes a stage's percentage at most this often
+PROGRESS_MAX_STREAMS = 8       # Open streams per web process (of its gunicorn threads); past it pages poll
+PROGRESS_FALLBACK_RETRY = 10   # Seconds between polls of pages past PROGRESS_MAX_STREAMS
+
+# Tags
+TAG_FACET_TTL = 60  # Seconds tag counts for the index filter are cached per process
+
+# Upload ingest
+INGEST_BUFFER_SIZE = 8 * 1024 * 1024  # Write/hash buffer for incoming video files
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024   # Chunk size handed to browsers for resumable uploads
+UPLOAD_SESSION_TTL = 24 * 60 * 60     # Seconds before an idle resumable upload is discarded
+
+# Bulk import (import_videos.py)
+IMPORT_EXTENSIONS = ['.mp4', '.m4v', '.mov', '.mkv', '.webm', '.avi', '.wmv', '.flv', '.mpg', '.mpeg', '.ts', '.mts', '.3gp']
+IMPORT_HASH_THREADS = 4              # Files hashed and probed at once; hashlib releases the GIL on large reads
+IMPORT_READ_SIZE = 16 * 1024 * 1024  # Bytes per read while hashing
+IMPORT_BATCH_SIZE = 200              # Files committed per transaction
+
+# Metrics (/metrics, see metrics.py and gunicorn.conf.py)
+METRICS_ENABLED = True
+METRICS_FOLDER = '/opt/videoarchive/metrics'  # Per-process metric files of the web (web/) and worker (worker/) processes
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']   # Clients that may scrape /metrics; nginx refuses it from outside
+
+# Sessions
+SESSION_VERSION_TTL = 30    # Seconds a user's session_version is cached per process for read-only requests
+QUERY_COUNT_HEADER = False  # Add an X-Query-Count header with the number of SQL queries per request
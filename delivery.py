@@ -0,0 +1,50 @@
+# delivery.py
+# Responses for media files that are only served after an access check.
+#
+# Behind nginx the app answers with an empty response carrying X-Accel-Redirect
+# and nginx sends the file itself from an internal location: sendfile, Range
+# and conditional GETs are all handled there. nginx announces this by sending
+# "X-Sendfile-Type: X-Accel-Redirect" with proxied requests. Without it (flask
+# run, tests) the file is streamed by Werkzeug, which answers Range requests
+# with 206/416 and If-None-Match/If-Modified-Since/If-Range with 304 or 200.
+import logging
+import mimetypes
+import os
+from urllib.parse import quote
+from flask import Response, request, send_file
+from werkzeug.security import safe_join
+from config import MEDIA_ACCEL_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# Types the mimetypes module gets wrong or does not know
+MEDIA_TYPES = {
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.ts': 'video/mp2t',
+}
+
+def media_type(filename):
+    extension = os.path.splitext(filename)[1].lower()
+    return MEDIA_TYPES.get(extension) or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+def accel_redirect_enabled():
+    return request.headers.get('X-Sendfile-Type', '').lower() == 'x-accel-redirect'
+
+# Serve root/relative_path, or return None if it does not exist or would
+# escape root. location is the nginx internal location mapped to root, e.g.
+# 'uploads' for MEDIA_ACCEL_PREFIX/uploads/. The type is guessed from the path
+# unless given.
+def media_response(root, relative_path, location, cache_control, mimetype=None):
+    path = safe_join(root, relative_path)
+    if not path or not os.path.isfile(path):
+        return None
+    mimetype = mimetype or media_type(path)
+
+    if accel_redirect_enabled():
+        # nginx keeps Content-Type and Cache-Control from this response
+        response = Response(status=200, mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = f"{MEDIA_ACCEL_PREFIX}/{location}/{quote(relative_path)}"
+    else:
+        response = send_file(path, mimetype=mimetype, conditional=True, etag=True, max_age=None)
+    response.headers['Cache-Control'] = cache_control
+    return response
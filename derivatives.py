@@ -0,0 +1,145 @@
+# derivatives.py
+# Disk cache of outputs derived from upload content.
+#
+# Entries are keyed by (checksum, stage, parameters): the SHA-256 of the upload,
+# the pipeline stage (see DERIVATIVE_VERSIONS) and whatever options change the
+# result, such as the Whisper model. The stage's version number is part of the
+# key, so bumping it makes every older entry of that stage a miss. Each entry
+# is a directory under DERIVATIVE_CACHE_FOLDER/<stage>/ that is written to a
+# temp directory first and renamed into place, so readers never see a partial
+# entry. A hit updates the directory's mtime; once the cache is larger than
+# DERIVATIVE_CACHE_MAX_BYTES the entries used longest ago are removed.
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from config import DERIVATIVE_CACHE_FOLDER, DERIVATIVE_CACHE_MAX_BYTES, DERIVATIVE_VERSIONS, TRANSCRIBER_BACKEND
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'  # Written last; an entry without it is ignored
+
+def _link_or_copy(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+class DerivativeCache:
+    def __init__(self, folder=DERIVATIVE_CACHE_FOLDER, max_bytes=DERIVATIVE_CACHE_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+
+    def entry_path(self, stage, checksum, params):
+        key = json.dumps(dict(params, version=DERIVATIVE_VERSIONS[stage]), sort_keys=True)
+        digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+        return os.path.join(self.folder, stage, checksum[:2], f"{checksum}_{digest}")
+
+    # Entry directory and its manifest, or (None, None) on a miss
+    def lookup(self, stage, checksum, params):
+        path = self.entry_path(stage, checksum, params)
+        try:
+            with open(os.path.join(path, MANIFEST)) as f:
+                manifest = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None, None
+        logger.debug(f"Derivative cache hit: {stage} for {checksum[:12]}")
+        return path, manifest
+
+    # Create an entry. write(directory) puts the entry's files into a temp
+    # directory; the manifest is any JSON value describing them.
+    def store(self, stage, checksum, params, manifest, write=None):
+        path = self.entry_path(stage, checksum, params)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        work_dir = tempfile.mkdtemp(prefix='.entry-', dir=os.path.dirname(path))
+        try:
+            if write:
+                write(work_dir)
+            with open(os.path.join(work_dir, MANIFEST), 'w') as f:
+                json.dump(manifest, f)
+            shutil.rmtree(path, ignore_errors=True)  # A forced re-run replaces the old entry
+            os.rename(work_dir, path)
+        except OSError as e:
+            # The cache is an optimisation; losing a race or a full disk must not fail the job
+            logger.warning(f"Could not store {stage} for {checksum[:12]} in the derivative cache: {str(e)}")
+            shutil.rmtree(work_dir, ignore_errors=True)
+            return
+        self.evict()
+
+    def load_json(self, stage, checksum, params):
+        return self.lookup(stage, checksum, params)[1]
+
+    def store_json(self, stage, checksum, params, value):
+        self.store(stage, checksum, params, value)
+
+    # Files kept in directory under their own names (thumbnails, storyboard
+    # sheets): copied into an entry, and linked back out again on a hit
+    def store_files(self, stage, checksum, params, directory, names, manifest):
+        def write(work_dir):
+            for name in names:
+                _link_or_copy(os.path.join(directory, name), os.path.join(work_dir, name))
+        self.store(stage, checksum, params, {'files': sorted(names), 'value': manifest}, write)
+
+    def restore_files(self, stage, checksum, params, directory):
+        path, manifest = self.lookup(stage, checksum, params)
+        if not manifest:
+            return None
+        try:
+            for name in manifest['files']:
+                target = os.path.join(directory, name)
+                if not os.path.exists(target):
+                    _link_or_copy(os.path.join(path, name), target)
+        except OSError as e:
+            logger.warning(f"Could not restore {stage} for {checksum[:12]} from the derivative cache: {str(e)}")
+            return None
+        return manifest['value']
+
+    # Remove least recently used entries until the cache fits max_bytes
+    def evict(self):
+        entries = []
+        total = 0
+        for stage in DERIVATIVE_VERSIONS:
+            stage_dir = os.path.join(self.folder, stage)
+            if not os.path.isdir(stage_dir):
+                continue
+            for shard in os.scandir(stage_dir):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    if entry.name.startswith('.') or not entry.is_dir():
+                        continue
+                    try:
+                        size = sum(item.stat().st_size for item in os.scandir(entry.path))
+                        entries.append((entry.stat().st_mtime, size, entry.path))
+                    except FileNotFoundError:
+                        continue  # Removed by another process meanwhile
+                    total += size
+        if total <= self.max_bytes:
+            return 0
+        removed = 0
+        for _, size, path in sorted(entries):
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            removed += 1
+            if total <= self.max_bytes:
+                break
+        logger.info(f"Evicted {removed} derivative cache entries; {total // (1024 * 1024)} MB left")
+        return removed
+
+    def clear(self, stage=None):
+        for name in [stage] if stage else DERIVATIVE_VERSIONS:
+            shutil.rmtree(os.path.join(self.folder, name), ignore_errors=True)
+
+derivative_cache = DerivativeCache()
+
+# Cache parameters of a transcript. Chunked and single-pass runs of the same
+# model count as the same result; other backends than openai-whisper do not
+# (openai-whisper entries keep the keys they had before there were backends).
+def transcript_params(model_name, language='en', backend=TRANSCRIBER_BACKEND):
+    params = {'model': model_name, 'language': language}
+    if backend != 'whisper':
+        params['backend'] = backend
+    return params
@@ -0,0 +1,38 @@
+# duplicates.py
+# Likely near duplicates between stored contents, as found by the media
+# worker (see fingerprints.py), and their removal with the content. Database
+# only: the web app imports this without loading NumPy.
+from sqlalchemy import delete, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, Video, Fingerprint, NearDuplicate
+
+# Replace the recorded near duplicates of a content; the caller commits
+def record_near_duplicates(checksum, matches):
+    db.session.execute(delete(NearDuplicate).where(
+        or_(NearDuplicate.checksum == checksum, NearDuplicate.other_checksum == checksum)))
+    rows = [{'checksum': a, 'other_checksum': b, 'similarity': score}
+            for other, score in matches for a, b in ((checksum, other), (other, checksum))]
+    if rows:
+        dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+        db.session.execute(dialect.insert(NearDuplicate).values(rows).on_conflict_do_nothing())
+
+# Forget a content whose last copy was deleted; the caller commits
+def delete_fingerprint(checksum):
+    db.session.execute(delete(Fingerprint).where(Fingerprint.checksum == checksum))
+    db.session.execute(delete(NearDuplicate).where(
+        or_(NearDuplicate.checksum == checksum, NearDuplicate.other_checksum == checksum)))
+
+# Whether a user may open some video with this content
+def can_open_content(checksum, user):
+    return user.is_admin or db.session.query(Video.id).filter_by(checksum=checksum, user_id=user.id).first() is not None
+
+# Likely duplicates of a video that user may open, as [(Video, similarity)].
+# Matches in other users' archives are left out, not counted: their existence
+# is not the viewer's to know.
+def near_duplicates_for(video, user):
+    query = db.session.query(Video, NearDuplicate.similarity).join(
+        NearDuplicate, NearDuplicate.other_checksum == Video.checksum
+    ).filter(NearDuplicate.checksum == video.checksum)
+    if not user.is_admin:
+        query = query.filter(Video.user_id == user.id)
+    return query.order_by(NearDuplicate.similarity.desc(), Video.id).all()
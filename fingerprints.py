@@ -0,0 +1,258 @@
+# fingerprints.py
+# Perceptual near-duplicate detection.
+#
+# Exact duplicates share a checksum (see blobs.py). Re-encodes, trims and
+# re-muxes of the same recording do not, so every new content is also
+# fingerprinted. ffmpeg samples FINGERPRINT_FPS frames per second, already
+# scaled to 32x32 grey. Each frame gets a 64-bit DCT perceptual hash, computed
+# for a whole batch at once with two matrix products. Flat frames (black,
+# fades) say nothing about the content and are dropped.
+#
+# The worker keeps FINGERPRINT_INDEX_FRAMES hashes of every content in an
+# in-memory multi-index hash. Each hash is split into four 16-bit chunks, and
+# one sorted array per chunk position is kept. Two hashes at most 7 bits apart
+# differ in at most one bit in at least one chunk (pigeonhole). Looking up
+# every query chunk and its 16 one-bit variants with searchsorted therefore
+# finds every indexed frame within FINGERPRINT_FRAME_DISTANCE. Contents hit
+# by enough frames are verified against their full stored fingerprint.
+# Recorded matches and the clean-up on delete are in duplicates.py, which the
+# web app uses without loading NumPy.
+import logging
+import subprocess
+import tempfile
+import threading
+import numpy as np
+from sqlalchemy import delete, func
+from config import (FFMPEG_PATH, FINGERPRINT_FPS, FINGERPRINT_INDEX_FRAMES, FINGERPRINT_QUERY_FRAMES,
+                    FINGERPRINT_FRAME_DISTANCE, FINGERPRINT_MATCH_RATIO)
+from models import db, Fingerprint
+from probe import video_dimensions
+
+logger = logging.getLogger(__name__)
+
+HASH_SIZE = 32          # Frames are hashed at 32x32
+BATCH_FRAMES = 256
+FLAT_FRAME_STD = 8.0    # Grey level spread below which a frame is considered flat
+VERIFY_FRAMES = 600     # Longer fingerprints are thinned out to this for verification
+MAX_CANDIDATES = 20     # Contents verified per lookup, most frame hits first
+PENDING_LIMIT = 4096    # Hashes searched linearly before they are merged into the sorted index
+CHUNK_BITS = 16
+CHUNKS = 64 // CHUNK_BITS
+CHUNK_VARIANTS = np.array([0] + [1 << bit for bit in range(CHUNK_BITS)], dtype=np.uint64)
+
+# The 8 lowest-frequency rows of the orthonormal 32-point DCT-II
+_n = np.arange(HASH_SIZE)
+DCT_ROWS = (np.sqrt(2 / HASH_SIZE) * np.cos(np.pi * (2 * _n[None, :] + 1) * np.arange(8)[:, None] / (2 * HASH_SIZE))).astype(np.float32)
+DCT_ROWS[0] /= np.sqrt(2)
+BIT_WEIGHTS = (np.uint64(1) << np.arange(63, -1, -1, dtype=np.uint64))
+
+# Set bits of each uint64 (np.bitwise_count needs numpy 2.0)
+def popcount(values):
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    bytes_ = values[..., None].view(np.uint8)
+    return np.unpackbits(bytes_, axis=-1).sum(axis=-1)
+
+# 64-bit hashes of a batch of (n, 32, 32) uint8 frames, and which frames are flat
+def perceptual_hashes(frames):
+    pixels = frames.astype(np.float32)
+    low = DCT_ROWS @ pixels @ DCT_ROWS.T  # (n, 8, 8) lowest frequencies
+    coefficients = low.reshape(len(frames), 64)
+    medians = np.median(coefficients[:, 1:], axis=1)  # The DC term is only brightness
+    bits = (coefficients > medians[:, None]).astype(np.uint64)
+    hashes = (bits * BIT_WEIGHTS).sum(axis=1, dtype=np.uint64)
+    flat = pixels.reshape(len(frames), -1).std(axis=1) < FLAT_FRAME_STD
+    return hashes, flat
+
+# Hashes of the non-flat sampled frames of a video, in time order; empty for
+# audio-only files
+def extract_fingerprint(video_path, info):
+    if not video_dimensions(info):
+        return np.zeros(0, dtype=np.uint64)
+    command = [
+        FFMPEG_PATH, '-nostdin', '-v', 'error', '-skip_frame', 'noref', '-i', video_path,
+        '-map', '0:v:0', '-vf', f"fps={FINGERPRINT_FPS},scale={HASH_SIZE}:{HASH_SIZE}:flags=area,format=gray",
+        '-f', 'rawvideo', '-pix_fmt', 'gray', 'pipe:1'
+    ]
+    frame_bytes = HASH_SIZE * HASH_SIZE
+    parts = []
+    # Messages go to a file, not an unread pipe (see audio.load_audio)
+    with tempfile.TemporaryFile() as errors:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=errors)
+        try:
+            while True:
+                data = process.stdout.read(frame_bytes * BATCH_FRAMES)
+                count = len(data) // frame_bytes
+                if count:
+                    frames = np.frombuffer(data, dtype=np.uint8, count=count * frame_bytes).reshape(count, HASH_SIZE, HASH_SIZE)
+                    hashes, flat = perceptual_hashes(frames)
+                    parts.append(hashes[~flat])
+                if len(data) < frame_bytes * BATCH_FRAMES:
+                    break
+        finally:
+            process.stdout.close()
+            process.wait()
+        if process.returncode != 0:
+            errors.seek(0)
+            raise RuntimeError(f"ffmpeg failed for {video_path}: {errors.read().decode(errors='replace').strip()}")
+    return np.concatenate(parts) if parts else np.zeros(0, dtype=np.uint64)
+
+def encode_hashes(hashes):
+    return hashes.astype('<u8').tobytes()
+
+def decode_hashes(data):
+    return np.frombuffer(data, dtype='<u8').astype(np.uint64)
+
+# At most limit hashes, evenly spread over the sequence
+def spread(hashes, limit):
+    if len(hashes) <= limit:
+        return hashes
+    return hashes[np.linspace(0, len(hashes) - 1, limit).round().astype(np.int64)]
+
+# Share of the shorter fingerprint's frames that have a match in the other
+def similarity(a, b, distance=FINGERPRINT_FRAME_DISTANCE):
+    a, b = spread(a, VERIFY_FRAMES), spread(b, VERIFY_FRAMES)
+    shorter, longer = (a, b) if len(a) <= len(b) else (b, a)
+    if not len(shorter):
+        return 0.0
+    distances = popcount(shorter[:, None] ^ longer[None, :])
+    return float((distances.min(axis=1) <= distance).mean())
+
+# Multi-index hash over FINGERPRINT_INDEX_FRAMES hashes per content. Loaded
+# from the fingerprint table on first use, then topped up with newer rows.
+# Each fingerprint row is one owner. Rows are deleted with their content (by
+# the web app) and replaced when content is fingerprinted again, so owners
+# whose row is gone are marked dead and never vote; once dead owners hold
+# a quarter of the index it is loaded again from scratch.
+class FingerprintIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.last_id = 0
+        self.checksums = []      # Owner number -> checksum
+        self.row_ids = []        # Owner number -> Fingerprint.id
+        self.alive = np.zeros(0, dtype=bool)
+        self.dead_hashes = 0
+        self.hashes = np.zeros(0, dtype=np.uint64)
+        self.owners = np.zeros(0, dtype=np.int64)
+        self.sorted_chunks = []  # Per chunk position: (sorted chunk values, positions into hashes)
+        self.pending_hashes = []
+        self.pending_owners = []
+
+    def refresh(self):
+        with self.lock:
+            self._load_new_rows()
+            # Fewer rows than live owners: some were deleted or replaced
+            if db.session.query(func.count(Fingerprint.id)).scalar() != int(self.alive.sum()):
+                self._drop_deleted_rows()
+            if self.dead_hashes * 4 > len(self.hashes) + sum(len(hashes) for hashes in self.pending_hashes):
+                logger.info(f"Rebuilding the fingerprint index without {self.dead_hashes} hashes of deleted content")
+                self._reset()
+                self._load_new_rows()
+            if sum(len(hashes) for hashes in self.pending_hashes) > PENDING_LIMIT:
+                self._merge()
+
+    def _load_new_rows(self):
+        rows = db.session.query(Fingerprint.id, Fingerprint.checksum, Fingerprint.hashes).filter(
+            Fingerprint.id > self.last_id
+        ).order_by(Fingerprint.id).yield_per(1000)
+        added = 0
+        for row_id, checksum, data in rows:
+            hashes = spread(decode_hashes(data), FINGERPRINT_INDEX_FRAMES)
+            self.pending_hashes.append(hashes)
+            self.pending_owners.append(np.full(len(hashes), len(self.checksums), dtype=np.int64))
+            self.checksums.append(checksum)
+            self.row_ids.append(row_id)
+            self.last_id = row_id
+            added += 1
+        if added:
+            self.alive = np.concatenate([self.alive, np.ones(added, dtype=bool)])
+
+    def _drop_deleted_rows(self):
+        existing = np.fromiter((row_id for row_id, in db.session.query(Fingerprint.id)), dtype=np.int64)
+        gone = self.alive & ~np.isin(np.array(self.row_ids, dtype=np.int64), existing)
+        if gone.any():
+            counts = np.bincount(np.concatenate([self.owners] + self.pending_owners), minlength=len(self.alive))
+            self.dead_hashes += int(counts[gone].sum())
+            self.alive &= ~gone
+
+    def _merge(self):
+        self.hashes = np.concatenate([self.hashes] + self.pending_hashes)
+        self.owners = np.concatenate([self.owners] + self.pending_owners)
+        self.pending_hashes, self.pending_owners = [], []
+        self.sorted_chunks = []
+        for position in range(CHUNKS):
+            values = (self.hashes >> np.uint64(position * CHUNK_BITS)) & np.uint64(0xFFFF)
+            order = np.argsort(values, kind='stable')
+            self.sorted_chunks.append((values[order], order))
+
+    # Candidate positions in self.hashes: every indexed hash sharing a chunk,
+    # up to one bit, with a query hash. Returns (query numbers, positions).
+    def _lookup(self, queries):
+        query_numbers, positions = [], []
+        for position, (values, order) in enumerate(self.sorted_chunks):
+            chunks = (queries >> np.uint64(position * CHUNK_BITS)) & np.uint64(0xFFFF)
+            variants = (chunks[:, None] ^ CHUNK_VARIANTS[None, :]).ravel()
+            lefts = np.searchsorted(values, variants, side='left')
+            counts = np.searchsorted(values, variants, side='right') - lefts
+            total = int(counts.sum())
+            if not total:
+                continue
+            # Expand the [left, right) ranges into one index array
+            offsets = np.repeat(lefts - np.cumsum(counts) + counts, counts) + np.arange(total)
+            positions.append(order[offsets])
+            query_numbers.append(np.repeat(np.repeat(np.arange(len(queries)), len(CHUNK_VARIANTS)), counts))
+        if not positions:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(query_numbers), np.concatenate(positions)
+
+    # {checksum: number of query frames matching one of its indexed frames}
+    def search(self, queries, distance=FINGERPRINT_FRAME_DISTANCE):
+        with self.lock:
+            query_numbers, positions = self._lookup(queries)
+            close = popcount(queries[query_numbers] ^ self.hashes[positions]) <= distance
+            hit_queries = [query_numbers[close]]
+            hit_owners = [self.owners[positions[close]]]
+            if self.pending_hashes:
+                pending = np.concatenate(self.pending_hashes)
+                numbers, columns = np.nonzero(popcount(queries[:, None] ^ pending[None, :]) <= distance)
+                hit_queries.append(numbers)
+                hit_owners.append(np.concatenate(self.pending_owners)[columns])
+            numbers = np.concatenate(hit_queries)
+            owners = np.concatenate(hit_owners)
+            live = self.alive[owners]
+            numbers, owners = numbers[live], owners[live]
+            if not len(owners):
+                return {}
+            pairs = np.unique(np.stack([owners, numbers]), axis=1)  # Each query frame votes once per content
+            votes = np.bincount(pairs[0])
+            return {self.checksums[owner]: int(votes[owner]) for owner in np.flatnonzero(votes)}
+
+fingerprint_index = FingerprintIndex()
+
+# Store the fingerprint of a content (replacing an older one); the caller commits
+def store_fingerprint(checksum, hashes):
+    db.session.execute(delete(Fingerprint).where(Fingerprint.checksum == checksum))
+    db.session.add(Fingerprint(checksum=checksum, hashes=encode_hashes(hashes), frames=len(hashes)))
+
+def load_fingerprint(checksum):
+    row = db.session.query(Fingerprint).filter_by(checksum=checksum).first()
+    return decode_hashes(row.hashes) if row else None
+
+# Other contents that are likely the same recording: [(checksum, similarity)],
+# most similar first
+def find_near_duplicates(checksum, hashes):
+    if not len(hashes):
+        return []
+    fingerprint_index.refresh()
+    votes = fingerprint_index.search(spread(hashes, FINGERPRINT_QUERY_FRAMES))
+    votes.pop(checksum, None)
+    candidates = sorted(votes, key=votes.get, reverse=True)[:MAX_CANDIDATES]
+    matches = []
+    for row in db.session.query(Fingerprint).filter(Fingerprint.checksum.in_(candidates)):
+        score = similarity(hashes, decode_hashes(row.hashes))
+        if score >= FINGERPRINT_MATCH_RATIO:
+            matches.append((row.checksum, score))
+    return sorted(matches, key=lambda match: match[1], reverse=True)
@@ -0,0 +1,32 @@
+# gunicorn.conf.py
+# gunicorn settings for the web app; read from the working directory
+# (see setup/videoarchive.service).
+#
+# Threaded workers, so open progress streams (see progress.py) hold a thread
+# rather than a whole process. PROGRESS_MAX_STREAMS in config.py keeps them
+# to part of each worker's threads. prometheus_client runs in multiprocess mode:
+# each worker writes its metrics to METRICS_FOLDER/web, which is emptied when
+# gunicorn starts, and a worker's live gauges are dropped when it exits.
+import os
+import shutil
+from config import METRICS_ENABLED, METRICS_FOLDER
+
+bind = '0.0.0.0:5000'
+workers = 4
+worker_class = 'gthread'
+threads = 16
+timeout = 600
+
+METRICS_DIRECTORY = os.path.join(METRICS_FOLDER, 'web')
+if METRICS_ENABLED:
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = METRICS_DIRECTORY  # Must be set before the workers import app
+
+def on_starting(server):
+    if METRICS_ENABLED:
+        shutil.rmtree(METRICS_DIRECTORY, ignore_errors=True)
+        os.makedirs(METRICS_DIRECTORY)
+
+def child_exit(server, worker):
+    if METRICS_ENABLED:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid, METRICS_DIRECTORY)
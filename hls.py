@@ -0,0 +1,159 @@
+# hls.py
+# Adaptive-bitrate HLS ladder for playback.
+#
+# Each rung of HLS_RENDITIONS that is not taller than the source is encoded by
+# its own CPU ffmpeg (libx264 + AAC) run into a fresh directory under
+# HLS_FOLDER/<checksum>/, with keyframes forced every HLS_SEGMENT_SECONDS so
+# the segments of all renditions line up. master.m3u8 lists the renditions
+# that have finished and is rewritten as each one completes. The directory is
+# keyed by the upload's checksum so videos sharing a Blob share the ladder.
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import uuid
+from config import FFMPEG_PATH, HLS_RENDITIONS, HLS_SEGMENT_SECONDS, HLS_X264_PRESET
+from probe import has_audio_stream, video_dimensions
+
+logger = logging.getLogger(__name__)
+
+MASTER_PLAYLIST = 'master.m3u8'
+
+_master_lock = threading.Lock()  # Renditions of one video may finish on parallel job threads
+
+class RenditionSpec:
+    def __init__(self, name, width, height, video_kbps, audio_kbps):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.video_kbps = video_kbps
+        self.audio_kbps = audio_kbps
+
+def _even(value):
+    return max(2, int(round(value / 2)) * 2)
+
+# Encoding settings for a stored Rendition row, or None if its rung was removed from the ladder
+def rendition_spec(rendition):
+    for name, height, video_kbps, audio_kbps in HLS_RENDITIONS:
+        if name == rendition.name:
+            return RenditionSpec(name, rendition.width, rendition.height, video_kbps, audio_kbps)
+    return None
+
+# The rungs to encode for a source: every rung up to the source height. A
+# source smaller than the lowest rung still gets that rung at its own size.
+def plan_renditions(info):
+    dimensions = video_dimensions(info)
+    if not dimensions:
+        return []
+    source_width, source_height = dimensions
+    ladder = sorted(HLS_RENDITIONS, key=lambda rung: rung[1])
+    rungs = [rung for rung in ladder if rung[1] <= source_height] or ladder[:1]
+    specs = []
+    for name, height, video_kbps, audio_kbps in rungs:
+        height = min(height, _even(source_height))
+        specs.append(RenditionSpec(name, _even(source_width * height / source_height), height, video_kbps, audio_kbps))
+    return specs
+
+def video_directory(hls_folder, checksum):
+    return os.path.join(hls_folder, checksum)
+
+# Directory used for renditions encoded before the ladder was keyed by checksum
+def legacy_video_directory(hls_folder, video_id):
+    return os.path.join(hls_folder, f"v{video_id}")
+
+# Encode one rendition into a new directory; returns (playlist path relative
+# to hls_folder, peak bandwidth in bits/s)
+def transcode_rendition(video_path, hls_folder, checksum, spec, info):
+    relative_dir = os.path.join(checksum, f"{spec.name}_{uuid.uuid4().hex[:8]}")
+    output_dir = os.path.join(hls_folder, relative_dir)
+    os.makedirs(output_dir)
+    video_kbps = spec.video_kbps
+    command = [
+        FFMPEG_PATH, '-nostdin', '-y', '-v', 'error',
+        '-i', video_path,
+        '-map', '0:v:0',
+        '-vf', f"scale={spec.width}:{spec.height}:flags=bicubic,setsar=1",
+        '-c:v', 'libx264', '-preset', HLS_X264_PRESET, '-profile:v', 'main', '-pix_fmt', 'yuv420p',
+        '-b:v', f"{video_kbps}k", '-maxrate', f"{int(video_kbps * 1.07)}k", '-bufsize', f"{int(video_kbps * 1.5)}k",
+        '-force_key_frames', f"expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})", '-sc_threshold', '0',
+    ]
+    if has_audio_stream(info):
+        command += ['-map', '0:a:0', '-c:a', 'aac', '-b:a', f"{spec.audio_kbps}k", '-ac', '2']
+    command += [
+        '-f', 'hls', '-hls_time', str(HLS_SEGMENT_SECONDS), '-hls_playlist_type', 'vod',
+        '-hls_segment_filename', os.path.join(output_dir, 'segment_%05d.ts'),
+        os.path.join(output_dir, 'index.m3u8')
+    ]
+    logger.debug(f"Transcoding {video_path} to {spec.name} ({spec.width}x{spec.height})")
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        shutil.rmtree(output_dir, ignore_errors=True)
+        raise RuntimeError(f"ffmpeg failed for {video_path} ({spec.name}): {result.stderr.strip()}")
+    return os.path.join(relative_dir, 'index.m3u8'), _peak_bandwidth(output_dir)
+
+# Highest segment bitrate, as BANDWIDTH in the master playlist requires
+def _peak_bandwidth(output_dir):
+    peak = 0
+    duration = None
+    with open(os.path.join(output_dir, 'index.m3u8')) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('#EXTINF:'):
+                duration = float(line[len('#EXTINF:'):].split(',')[0])
+            elif line and not line.startswith('#') and duration:
+                size = os.path.getsize(os.path.join(output_dir, line))
+                peak = max(peak, int(size * 8 / duration))
+                duration = None
+    return peak
+
+# Rewrite master.m3u8 from the completed renditions of a video; removes it
+# when there are none. Returns the playlist path relative to hls_folder.
+def write_master_playlist(hls_folder, video):
+    with _master_lock:
+        renditions = [r for r in video.renditions if r.status == 'completed' and r.playlist]
+        return _write_master_playlist(hls_folder, video.checksum, renditions)
+
+def _write_master_playlist(hls_folder, checksum, renditions):
+    directory = video_directory(hls_folder, checksum)
+    path = os.path.join(directory, MASTER_PLAYLIST)
+    if not renditions:
+        if os.path.exists(path):
+            os.remove(path)
+        return None
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+    for rendition in sorted(renditions, key=lambda r: r.bandwidth or 0):
+        lines.append(f"#EXT-X-STREAM-INF:BANDWIDTH={rendition.bandwidth},RESOLUTION={rendition.width}x{rendition.height}")
+        lines.append(os.path.relpath(os.path.join(hls_folder, rendition.playlist), directory))
+    os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(temp_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(temp_path, path)
+    return os.path.join(checksum, MASTER_PLAYLIST)
+
+# Remove a rendition directory given its playlist path relative to hls_folder
+def remove_rendition_files(hls_folder, playlist):
+    if playlist:
+        shutil.rmtree(os.path.join(hls_folder, os.path.dirname(playlist)), ignore_errors=True)
+
+def remove_video_files(hls_folder, checksum):
+    shutil.rmtree(video_directory(hls_folder, checksum), ignore_errors=True)
+
+# Move a video's renditions from its legacy v<id>/ directory into the
+# checksum directory and point its playlists there. Returns False if there
+# was nothing to move.
+def adopt_legacy_renditions(hls_folder, video):
+    legacy = legacy_video_directory(hls_folder, video.id)
+    if not os.path.isdir(legacy):
+        return False
+    directory = video_directory(hls_folder, video.checksum)
+    os.makedirs(directory, exist_ok=True)
+    for rendition in video.renditions:
+        if not rendition.playlist or not rendition.playlist.startswith(f"v{video.id}/"):
+            continue
+        name = os.path.dirname(rendition.playlist)[len(f"v{video.id}/"):]
+        os.replace(os.path.join(legacy, name), os.path.join(directory, name))
+        rendition.playlist = os.path.join(video.checksum, name, os.path.basename(rendition.playlist))
+    shutil.rmtree(legacy, ignore_errors=True)
+    return True
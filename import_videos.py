@@ -0,0 +1,216 @@
+# import_videos.py
+# Bulk import of an existing directory tree of videos, for archives too large
+# to go through the upload form.
+#
+# Files are hashed and probed by a pool of threads with large reads. Content
+# already in the blob store is not copied again, and Videos are created
+# IMPORT_BATCH_SIZE at a time, each batch in one transaction together with its
+# ImportedFile ledger rows. A re-run skips every file the ledger has seen with
+# the same size and mtime, so an interrupted import carries on where it stopped.
+#
+# With --link a blob is a hard link to the source file: the same inode, so
+# the same bytes, owner and mode. The source's permissions are left as they
+# are (the app user must be able to read it), and the files must not be
+# modified in place afterwards; deleting or moving them is fine.
+#
+#   python import_videos.py /srv/legacy-archive [--user admin] [--tags a,b] [--link]
+#                           [--threads N] [--batch-size N] [--no-transcribe]
+import argparse
+import hashlib
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from app import app, register_upload
+from config import UPLOAD_FOLDER, IMPORT_EXTENSIONS, IMPORT_HASH_THREADS, IMPORT_READ_SIZE, IMPORT_BATCH_SIZE
+from models import db, User, Video, Blob, ImportedFile
+from probe import probe_media
+from storage import StagedFile, TEMP_PREFIX, discard_staged
+
+logger = logging.getLogger('import')
+
+# Video files under root in a stable order, as (path, os.stat_result)
+def find_videos(root, extensions=IMPORT_EXTENSIONS):
+    extensions = {extension.lower() for extension in extensions}
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in extensions:
+                path = os.path.join(directory, name)
+                try:
+                    yield path, os.stat(path)
+                except OSError as e:
+                    logger.warning(f"Cannot read {path}: {str(e)}")
+
+def hash_file(path, read_size=IMPORT_READ_SIZE):
+    sha256 = hashlib.sha256()
+    buffer = bytearray(read_size)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            count = f.readinto(buffer)
+            if not count:
+                break
+            sha256.update(view[:count])
+    return sha256.hexdigest()
+
+# Runs in the thread pool: (checksum, ffprobe info or None)
+def examine(path):
+    checksum = hash_file(path)
+    try:
+        info = probe_media(path)
+    except (OSError, RuntimeError, ValueError) as e:
+        logger.warning(f"Could not probe {path}: {str(e)}")  # The worker probes it again later
+        info = None
+    return checksum, info
+
+# Runs in the thread pool: put a copy (or a hard link) of the file into the
+# upload folder for acquire_blob() to move into place
+def stage_copy(path, checksum, size, link=False):
+    fd, temp_path = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=UPLOAD_FOLDER)
+    os.close(fd)
+    try:
+        if link:
+            try:
+                os.unlink(temp_path)
+                os.link(path, temp_path)
+                return StagedFile(temp_path, checksum, size, linked=True)
+            except OSError:
+                pass  # Another filesystem; copy instead
+        shutil.copyfile(path, temp_path)  # copy_file_range/sendfile where available
+    except Exception:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    return StagedFile(temp_path, checksum, size)
+
+# Checksums whose content is in the blob store already
+def stored_checksums(checksums):
+    blobs = db.session.query(Blob).filter(Blob.checksum.in_(checksums)).all()
+    return {blob.checksum for blob in blobs if os.path.exists(os.path.join(UPLOAD_FOLDER, blob.path))}
+
+class Importer:
+    def __init__(self, user, tags='', link=False, transcribe=True, threads=IMPORT_HASH_THREADS):
+        self.user = user
+        self.tags = tags
+        self.link = link
+        self.transcribe = transcribe
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+        self.counts = {'imported': 0, 'duplicate': 0, 'unchanged': 0, 'failed': 0}
+        self.bytes_read = 0
+        self.files_read = 0
+        self.started = time.perf_counter()
+
+    def run_batch(self, batch):
+        known = {
+            entry.path: entry
+            for entry in db.session.query(ImportedFile).filter(ImportedFile.path.in_([path for path, _ in batch]))
+        }
+        todo = []
+        for path, stat in batch:
+            entry = known.get(path)
+            if entry and entry.size == stat.st_size and entry.mtime_ns == stat.st_mtime_ns:
+                self.counts['unchanged'] += 1
+            else:
+                todo.append((path, stat))
+        if not todo:
+            return
+
+        examined = []
+        futures = [(path, stat, self.pool.submit(examine, path)) for path, stat in todo]
+        for path, stat, future in futures:
+            try:
+                checksum, info = future.result()
+            except OSError as e:
+                logger.error(f"Could not read {path}: {str(e)}")
+                self.counts['failed'] += 1
+                continue
+            self.files_read += 1
+            self.bytes_read += stat.st_size
+            examined.append((path, stat, checksum, info))
+
+        # Copy each new content once; duplicates go through register_upload
+        # without a file and only take a reference
+        stored = stored_checksums({checksum for _, _, checksum, _ in examined})
+        copies = {}
+        for path, stat, checksum, _ in examined:
+            if checksum not in stored and checksum not in copies:
+                copies[checksum] = self.pool.submit(stage_copy, path, checksum, stat.st_size, self.link)
+
+        staged_files = []
+        try:
+            for path, stat, checksum, info in examined:
+                try:
+                    copy = copies.pop(checksum, None)
+                    staged = copy.result() if copy else StagedFile(None, checksum, stat.st_size)
+                    staged_files.append(staged)
+                    with db.session.begin_nested():
+                        status, video = register_upload(staged, os.path.basename(path), self.user, self.tags, '',
+                                                        info=info, commit=False, transcribe=self.transcribe)
+                        if not video:
+                            video = db.session.query(Video).filter_by(checksum=checksum, user_id=self.user.id).first()
+                        outcome = 'imported' if status == 'Uploaded' else 'duplicate'
+                        entry = known.get(path) or ImportedFile(path=path)
+                        entry.size = stat.st_size
+                        entry.mtime_ns = stat.st_mtime_ns
+                        entry.checksum = checksum
+                        entry.video_id = video.id if video else None
+                        entry.status = outcome
+                        db.session.add(entry)
+                    self.counts[outcome] += 1
+                except Exception as e:
+                    logger.error(f"Import of {path} failed: {str(e)}", exc_info=True)
+                    self.counts['failed'] += 1
+            db.session.commit()
+        finally:
+            # Copies of failed files, and of files whose content turned out to be stored
+            for staged in staged_files:
+                discard_staged(staged)
+            for copy in copies.values():
+                if not copy.exception():
+                    discard_staged(copy.result())
+
+    def report(self, final=False):
+        elapsed = time.perf_counter() - self.started
+        total = sum(self.counts.values())
+        summary = ', '.join(f"{count} {outcome}" for outcome, count in self.counts.items())
+        print(f"{'Done: ' if final else ''}{total} files ({summary}) in {elapsed:.0f}s; "
+              f"read {self.files_read / elapsed:.1f} files/s, {self.bytes_read / elapsed / 1024 / 1024:.1f} MB/s",
+              flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Import a directory tree of videos into the Video Archive')
+    parser.add_argument('root', help='Directory to import recursively')
+    parser.add_argument('--user', default='admin', help='Owner of the imported videos')
+    parser.add_argument('--tags', default='', help='Comma-separated tags for every imported video')
+    parser.add_argument('--link', action='store_true', help='Hard-link files into the blob store instead of copying (same filesystem)')
+    parser.add_argument('--threads', type=int, default=IMPORT_HASH_THREADS, help='Files hashed and probed at once')
+    parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help='Files committed per transaction')
+    parser.add_argument('--no-transcribe', action='store_true', help='Do not queue transcriptions')
+    args = parser.parse_args()
+
+    with app.app_context():
+        user = db.session.query(User).filter_by(username=args.user).first()
+        if not user:
+            sys.exit(f"No user named {args.user}")
+        importer = Importer(user, tags=args.tags, link=args.link, transcribe=not args.no_transcribe, threads=args.threads)
+        root = os.path.abspath(args.root)
+        batch = []
+        try:
+            for item in find_videos(root):
+                batch.append(item)
+                if len(batch) >= args.batch_size:
+                    importer.run_batch(batch)
+                    importer.report()
+                    batch = []
+            if batch:
+                importer.run_batch(batch)
+        finally:
+            importer.pool.shutdown(cancel_futures=True)
+        importer.report(final=True)
+
+if __name__ == '__main__':
+    main()
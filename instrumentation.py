@@ -0,0 +1,32 @@
+# instrumentation.py
+# Per-request SQL query counter and time, logged at debug level after every
+# request and optionally returned in an X-Query-Count header (QUERY_COUNT_HEADER).
+# metrics.py turns both into per-route histograms.
+import logging
+import time
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+        conn.info['query_started'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _time_query(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('query_started', None)
+    if started is not None and has_request_context():
+        g.query_seconds = g.get('query_seconds', 0.0) + time.perf_counter() - started
+
+def install_query_counter(app, header=False):
+    @app.after_request
+    def report_query_count(response):
+        count = g.get('query_count', 0)
+        logger.debug(f"{request.method} {request.path}: {count} queries in {g.get('query_seconds', 0.0) * 1000:.1f}ms")
+        if header:
+            response.headers['X-Query-Count'] = str(count)
+        return response
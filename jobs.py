@@ -0,0 +1,237 @@
+# jobs.py
+# Persistent job queue drained by a bounded pool of worker threads.
+#
+# Jobs live in the `job` table so they survive worker restarts. On PostgreSQL a
+# job is leased with SELECT ... FOR UPDATE SKIP LOCKED; on SQLite (which has no
+# row locks) the lease is a conditional UPDATE that only one worker can win.
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from config import JOB_WORKERS, JOB_MAX_ATTEMPTS, JOB_LEASE_SECONDS, JOB_RETRY_DELAY, JOB_POLL_INTERVAL, JOB_REAP_INTERVAL
+from models import db, Job, Video
+from metrics import JOB_SECONDS, JOBS_ACTIVE
+
+logger = logging.getLogger(__name__)
+
+# Queue a job unless an identical one (same video, kind and payload) is
+# already waiting or running. With commit=False the job only becomes visible
+# to workers when the caller commits.
+def enqueue_job(video_id, kind, payload=None, max_attempts=JOB_MAX_ATTEMPTS, commit=True):
+    encoded = json.dumps(payload or {}, sort_keys=True)
+    existing = db.session.query(Job).filter(
+        Job.video_id == video_id,
+        Job.kind == kind,
+        Job.payload == encoded,
+        Job.status.in_(['queued', 'running'])
+    ).first()
+    if existing:
+        logger.debug(f"Job {existing.id} ({kind}) already pending for video {video_id}")
+        return existing
+
+    job = Job(
+        kind=kind,
+        video_id=video_id,
+        payload=encoded,
+        max_attempts=max_attempts
+    )
+    db.session.add(job)
+    if commit:
+        db.session.commit()
+    else:
+        db.session.flush()
+    logger.info(f"Queued {kind} job {job.id} for video {video_id}")
+    return job
+
+# Claim the oldest runnable job for this worker, or return None
+def lease_job(worker_id, kinds=None):
+    now = datetime.utcnow()
+    query = db.session.query(Job).filter(Job.status == 'queued', Job.run_after <= now)
+    if kinds:
+        query = query.filter(Job.kind.in_(kinds))
+    query = query.order_by(Job.run_after, Job.id)
+
+    if db.engine.dialect.name == 'postgresql':
+        job = query.with_for_update(skip_locked=True).first()
+        if not job:
+            db.session.rollback()
+            return None
+        job.status = 'running'
+        job.attempts += 1
+        job.leased_by = worker_id
+        job.leased_until = now + timedelta(seconds=JOB_LEASE_SECONDS)
+        db.session.commit()
+        return job
+
+    # SQLite: pick a candidate, then take it with a compare-and-set update
+    for candidate_id, in query.with_entities(Job.id).limit(5).all():
+        result = db.session.execute(
+            update(Job)
+            .where(Job.id == candidate_id, Job.status == 'queued')
+            .values(
+                status='running',
+                attempts=Job.attempts + 1,
+                leased_by=worker_id,
+                leased_until=now + timedelta(seconds=JOB_LEASE_SECONDS),
+                updated_at=now
+            )
+        )
+        db.session.commit()
+        if result.rowcount == 1:
+            return db.session.get(Job, candidate_id)
+    return None
+
+# Push the lease deadline out while a long job is still making progress
+def renew_lease(job_id, worker_id):
+    db.session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.leased_by == worker_id, Job.status == 'running')
+        .values(leased_until=datetime.utcnow() + timedelta(seconds=JOB_LEASE_SECONDS))
+    )
+    db.session.commit()
+
+def complete_job(job):
+    job.status = 'completed'
+    job.leased_by = None
+    job.leased_until = None
+    job.last_error = None
+    db.session.commit()
+
+# Record a failure; returns True when the job will be retried
+def fail_job(job, error):
+    job.last_error = error
+    job.leased_by = None
+    job.leased_until = None
+    if job.attempts < job.max_attempts:
+        job.status = 'queued'
+        job.run_after = datetime.utcnow() + timedelta(seconds=JOB_RETRY_DELAY * job.attempts)
+        db.session.commit()
+        return True
+    job.status = 'failed'
+    db.session.commit()
+    return False
+
+# Requeue jobs whose lease expired (the worker died) and fix up videos that
+# were left in transcription_status='running' with no live job behind them.
+# A copy of the same content may be waiting for another copy's transcription,
+# and new uploads wait for their fingerprint job (see worker.py).
+def reap_stuck_jobs():
+    now = datetime.utcnow()
+    expired = db.session.query(Job).filter(Job.status == 'running', Job.leased_until < now).all()
+    for job in expired:
+        logger.warning(f"Lease expired for job {job.id} ({job.kind}) held by {job.leased_by}")
+        fail_job(job, 'Lease expired')
+
+    active_checksums = db.session.query(Video.checksum).join(Job, Job.video_id == Video.id).filter(
+        Job.kind.in_(['transcribe', 'fingerprint']),
+        Job.status.in_(['queued', 'running'])
+    )
+    orphaned = db.session.query(Video).filter(
+        Video.transcription_status.in_(['queued', 'running']),
+        Video.checksum.notin_(active_checksums)
+    ).all()
+    for video in orphaned:
+        logger.warning(f"Video {video.id} stuck in transcription_status='{video.transcription_status}'; marking failed")
+        video.transcription_status = 'failed'
+        video.transcription = 'Failed: transcription was interrupted'
+    db.session.commit()
+    return len(expired) + len(orphaned)
+
+def job_payload(job):
+    return json.loads(job.payload) if job.payload else {}
+
+# Fixed-size pool of threads that lease jobs and dispatch them by kind
+class JobWorkerPool:
+    def __init__(self, app, handlers, size=JOB_WORKERS, maintenance=()):
+        self.app = app
+        self.handlers = handlers
+        self.size = size
+        self.maintenance = list(maintenance)  # Extra callables run on every reaper sweep
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def start(self):
+        for i in range(self.size):
+            worker_id = f"{socket.gethostname()}:{os.getpid()}:{i}"
+            thread = threading.Thread(target=self._run, args=(worker_id,), name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        reaper = threading.Thread(target=self._reap, name='job-reaper', daemon=True)
+        reaper.start()
+        self.threads.append(reaper)
+        logger.info(f"Started {self.size} job workers")
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def _run(self, worker_id):
+        while not self.stop_event.is_set():
+            try:
+                with self.app.app_context():
+                    job = lease_job(worker_id, kinds=list(self.handlers))
+                    if not job:
+                        self.stop_event.wait(JOB_POLL_INTERVAL)
+                        continue
+                    self._execute(job, worker_id)
+            except Exception as e:
+                logger.error(f"Job worker {worker_id} error: {str(e)}", exc_info=True)
+                self.stop_event.wait(JOB_POLL_INTERVAL)
+
+    def _execute(self, job, worker_id):
+        job_id = job.id
+        logger.info(f"Worker {worker_id} running {job.kind} job {job_id} for video {job.video_id} (attempt {job.attempts}/{job.max_attempts})")
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job_id, worker_id, done), daemon=True)
+        heartbeat.start()
+        kind = job.kind
+        active = JOBS_ACTIVE.labels(kind)
+        active.inc()
+        started = time.perf_counter()
+        outcome = 'completed'
+        try:
+            self.handlers[kind](job)
+        except Exception as e:
+            outcome = 'failed'
+            db.session.rollback()
+            job = db.session.get(Job, job_id)
+            retrying = fail_job(job, str(e))
+            logger.error(f"Job {job_id} failed{' (will retry)' if retrying else ''}: {str(e)}", exc_info=True)
+        else:
+            complete_job(db.session.get(Job, job_id))
+            logger.info(f"Job {job_id} completed")
+        finally:
+            active.dec()
+            JOB_SECONDS.labels(kind, outcome).observe(time.perf_counter() - started)
+            done.set()
+            heartbeat.join()
+
+    def _heartbeat(self, job_id, worker_id, done):
+        while not done.wait(JOB_LEASE_SECONDS / 3):
+            try:
+                with self.app.app_context():
+                    renew_lease(job_id, worker_id)
+            except Exception as e:
+                logger.error(f"Failed to renew lease for job {job_id}: {str(e)}", exc_info=True)
+
+    def _reap(self):
+        while not self.stop_event.wait(JOB_REAP_INTERVAL):
+            try:
+                with self.app.app_context():
+                    reaped = reap_stuck_jobs()
+                    if reaped:
+                        logger.info(f"Reaper recovered {reaped} stuck jobs/videos")
+            except Exception as e:
+                logger.error(f"Job reaper error: {str(e)}", exc_info=True)
+            for task in self.maintenance:
+                try:
+                    with self.app.app_context():
+                        task()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Maintenance task {task.__name__} failed: {str(e)}", exc_info=True)
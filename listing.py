@@ -0,0 +1,63 @@
+# listing.py
+# Keyset-paginated video listing for the index grid and /api/videos.
+#
+# Pages are ordered by (upload_date, id) newest first and continue from an
+# opaque cursor, so page N costs the same as page 1. Uploaders are joined and
+# tags selectin-loaded in one extra query; the large text columns are deferred.
+import base64
+from datetime import datetime
+from sqlalchemy import tuple_
+from sqlalchemy.orm import joinedload, selectinload, defer
+from models import db, Video, Tag, video_tags
+
+PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+def encode_cursor(video):
+    raw = f"{video.upload_date.isoformat()}|{video.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+# Raises ValueError for malformed cursors
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    upload_date, video_id = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+    return datetime.fromisoformat(upload_date), int(video_id)
+
+def listing_query(user):
+    query = db.session.query(Video).options(
+        joinedload(Video.uploader),
+        selectinload(Video.tags),
+        defer(Video.transcription),
+        defer(Video.notes)
+    )
+    if not user.is_admin:
+        query = query.filter(Video.user_id == user.id)  # Only user's videos
+    return query
+
+# Restrict a video query to videos with the named tag
+def filter_by_tag(query, tag):
+    tagged = db.session.query(video_tags.c.video_id).join(Tag, Tag.id == video_tags.c.tag_id).filter(
+        video_tags.c.video_id == Video.id, Tag.name == tag
+    )
+    return query.filter(tagged.exists())
+
+# Returns (videos, next_cursor); next_cursor is None on the last page
+# Optional filters: tag name, duration range in seconds and minimum height,
+# the last two on the columns filled in at ingest (see metadata.py)
+def list_videos(user, cursor=None, limit=PAGE_SIZE, tag=None, min_duration=None, max_duration=None, min_height=None):
+    query = listing_query(user)
+    if tag:
+        query = filter_by_tag(query, tag)
+    if min_duration is not None:
+        query = query.filter(Video.duration >= min_duration)
+    if max_duration is not None:
+        query = query.filter(Video.duration <= max_duration)
+    if min_height is not None:
+        query = query.filter(Video.height >= min_height)
+    if cursor:
+        upload_date, video_id = decode_cursor(cursor)
+        query = query.filter(tuple_(Video.upload_date, Video.id) < tuple_(upload_date, video_id))
+    videos = query.order_by(Video.upload_date.desc(), Video.id.desc()).limit(limit + 1).all()
+    if len(videos) > limit:
+        return videos[:limit], encode_cursor(videos[limit - 1])
+    return videos, None
@@ -0,0 +1,124 @@
+# media.py
+# CPU/GPU heavy media processing. Only the worker daemon (worker.py) imports
+# this module, so the web workers never load torch or whisper.
+import os
+import time
+import logging
+import numpy as np
+from config import WHISPER_MODEL
+from models import db, Video
+from probe import has_audio_stream, media_duration
+from metadata import video_info
+from audio import load_audio, SAMPLE_RATE
+from speech import transcribe_audio, paragraph_text
+from search import index_video
+from transcripts import replace_segments, delete_segments
+from derivatives import derivative_cache, transcript_params
+from progress import report_progress, ProgressReporter
+
+logger = logging.getLogger(__name__)
+
+# Decoded soundtrack of a video, from the derivative cache if this content
+# was decoded before. It is cached as the 16-bit PCM ffmpeg produced, which
+# converts back to exactly the same float32 samples at half the size.
+def extract_audio(video_path, checksum, info, force=False):
+    params = {'sample_rate': SAMPLE_RATE}
+    path, _ = derivative_cache.lookup('audio', checksum, params) if not force else (None, None)
+    if path:
+        pcm = np.load(os.path.join(path, 'audio.npy'))
+        return np.multiply(pcm, np.float32(1 / 32768.0), dtype=np.float32)
+
+    audio = load_audio(video_path, duration=media_duration(info))
+    derivative_cache.store('audio', checksum, params, {'samples': len(audio)},
+                           lambda directory: np.save(os.path.join(directory, 'audio.npy'), to_pcm16(audio)))
+    return audio
+
+# float32 samples in [-1, 1] to 16-bit PCM. Converted a block at a time into
+# the result, so a long soundtrack needs one block of scratch space rather than
+# a float copy of the whole of it. Samples are clipped first, so +1.0 becomes
+# 32767 instead of wrapping around to -32768.
+PCM_BLOCK_SAMPLES = 1 << 20
+
+def to_pcm16(audio, block_samples=PCM_BLOCK_SAMPLES):
+    pcm = np.empty(len(audio), dtype=np.int16)
+    scratch = np.empty(min(len(audio), block_samples), dtype=np.float32)
+    for start in range(0, len(audio), block_samples):
+        block = audio[start:start + block_samples]
+        scaled = scratch[:len(block)]
+        np.multiply(block, 32768, out=scaled)
+        np.clip(scaled, -32768, 32767, out=scaled)
+        pcm[start:start + len(block)] = scaled
+    return pcm
+
+# Helper to transcribe video audio using Whisper. A transcript of the same
+# content and model is taken from the derivative cache unless force is set.
+# threads overrides TRANSCRIBE_THREADS for this run.
+def transcribe_video(video_path, video_id, model_name=WHISPER_MODEL, force=False, threads=None):
+    video = db.session.get(Video, video_id)
+    if not video:
+        logger.error(f"Video {video_id} not found in database")
+        return
+    checksum = video.checksum
+    video.transcription_status = 'running'
+    db.session.commit()
+    logger.info(f"Transcription started for video {video_id}")
+
+    try:
+        params = transcript_params(model_name)
+        cached = derivative_cache.load_json('transcript', checksum, params) if not force else None
+        if cached:
+            segments = cached['segments']
+            transcription_text = cached['text']
+            logger.info(f"Transcript of video {video_id} with '{model_name}' found in the derivative cache")
+        else:
+            logger.debug(f"Checking video file existence: {video_path}")
+            if not os.path.exists(video_path):
+                raise FileNotFoundError(f"Video file not found at {video_path}")
+
+            info = video_info(db.session.get(Video, video_id))  # Stored at ingest; no need to reopen the file
+            if not has_audio_stream(info):
+                video = db.session.get(Video, video_id)
+                if video:
+                    video.transcription_status = 'completed'
+                    video.transcription = "No audio available in this video."
+                    delete_segments(video_id)
+                    index_video(video)
+                    db.session.commit()
+                    logger.info(f"Video {video_id} has no audio stream; marked as completed")
+                return
+
+            extract_start = time.perf_counter()
+            report_progress(video_id, 'audio')
+            try:
+                audio = extract_audio(video_path, checksum, info, force=force)
+            except Exception as e:
+                report_progress(video_id, 'audio', 'failed', message=str(e))
+                raise
+            report_progress(video_id, 'audio', 'done')
+            logger.info(f"Audio extracted for video {video_id}: duration={len(audio) / SAMPLE_RATE:.1f}s in {time.perf_counter() - extract_start:.2f}s")
+
+            logger.info(f"Transcribing video {video_id} using Whisper '{model_name}'")
+            segments = transcribe_audio(audio, model_name, progress=ProgressReporter(video_id, 'transcription'), threads=threads)
+            logger.debug(f"Transcription result: {len(segments)} segments")
+            transcription_text = paragraph_text(segments)
+            derivative_cache.store_json('transcript', checksum, params, {'segments': segments, 'text': transcription_text})
+
+        video = db.session.get(Video, video_id)
+        if video:
+            video.transcription = transcription_text
+            video.transcription_status = 'completed'
+            replace_segments(video_id, segments)
+            index_video(video)
+            db.session.commit()
+            logger.info(f"Transcription completed for video {video_id}: {transcription_text[:50]}...")
+
+    except Exception as e:
+        db.session.rollback()
+        video = db.session.get(Video, video_id)
+        if video:
+            video.transcription_status = 'failed'
+            video.transcription = f"Failed: {str(e)}"
+            delete_segments(video_id)
+            db.session.commit()
+        logger.error(f"Transcription failed for video {video_id}: {str(e)}", exc_info=True)
+        raise
@@ -0,0 +1,110 @@
+# metadata.py
+# Media properties stored on Video.
+#
+# Uploads are probed once at ingest and the summary (duration, container,
+# codecs, display size, frame rate, bitrate, audio presence) is kept in Video
+# columns. The worker stages take the same ffprobe-shaped dict they always
+# did, rebuilt from those columns by stored_info(), so no job has to reopen the
+# file just to learn its duration or whether it has sound.
+import logging
+from sqlalchemy import update
+from models import db, Video
+from probe import probe_media, has_audio_stream, media_duration, video_dimensions
+from blobs import video_file_path
+
+logger = logging.getLogger(__name__)
+
+MEDIA_FIELDS = ('duration', 'container', 'video_codec', 'audio_codec', 'width', 'height', 'frame_rate', 'bitrate', 'has_audio')
+
+def _first_stream(info, codec_type):
+    return next((stream for stream in info.get('streams', []) if stream.get('codec_type') == codec_type), None)
+
+def _frame_rate(stream):
+    try:
+        num, den = stream.get('avg_frame_rate', '0/0').split('/')
+        return float(num) / float(den)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+# Column values for an ffprobe description
+def media_summary(info):
+    video_stream = _first_stream(info, 'video')
+    audio_stream = _first_stream(info, 'audio')
+    dimensions = video_dimensions(info) or (None, None)
+    try:
+        bitrate = int(info.get('format', {}).get('bit_rate'))
+    except (TypeError, ValueError):
+        bitrate = None
+    return {
+        'duration': media_duration(info),
+        'container': (info.get('format', {}).get('format_name') or 'unknown')[:50],
+        'video_codec': video_stream.get('codec_name') if video_stream else None,
+        'audio_codec': audio_stream.get('codec_name') if audio_stream else None,
+        'width': dimensions[0],
+        'height': dimensions[1],
+        'frame_rate': _frame_rate(video_stream) if video_stream else None,
+        'bitrate': bitrate,
+        'has_audio': has_audio_stream(info),
+    }
+
+def apply_media_info(video, info):
+    for field, value in media_summary(info).items():
+        setattr(video, field, value)
+
+def copy_media_info(source, video):
+    for field in MEDIA_FIELDS:
+        setattr(video, field, getattr(source, field))
+
+def is_probed(video):
+    return video.container is not None
+
+# The stored summary in the shape of probe_media()'s output, for the stage
+# functions in thumbnails.py, storyboard.py, hls.py and media.py. Width and
+# height are already the display size, so no rotation is reported.
+def stored_info(video):
+    streams = []
+    if video.width:
+        streams.append({
+            'codec_type': 'video', 'codec_name': video.video_codec, 'width': video.width, 'height': video.height,
+            'avg_frame_rate': f"{video.frame_rate}/1" if video.frame_rate else '0/0',
+        })
+    if video.has_audio:
+        streams.append({'codec_type': 'audio', 'codec_name': video.audio_codec})
+    media_format = {'format_name': video.container}
+    if video.duration:
+        media_format['duration'] = str(video.duration)
+    if video.bitrate:
+        media_format['bit_rate'] = str(video.bitrate)
+    return {'format': media_format, 'streams': streams}
+
+# Stored summary of a video, probing it first if that has not happened yet
+# (rows from before metadata columns that the backfill has not reached).
+# The caller commits the filled-in columns.
+def video_info(video):
+    if not is_probed(video):
+        apply_media_info(video, probe_media(video_file_path(video)))
+    return stored_info(video)
+
+# Probe every unprobed upload once per distinct content and write the result
+# to all videos sharing it. Returns (probed, failed).
+def backfill_media_info(reprobe=False, batch_size=100):
+    query = db.session.query(Video.checksum).distinct()
+    if not reprobe:
+        query = query.filter(Video.container.is_(None))
+    checksums = [checksum for checksum, in query]
+    probed = failed = 0
+    for number, checksum in enumerate(checksums, start=1):
+        video = db.session.query(Video).filter_by(checksum=checksum).order_by(Video.id).first()
+        try:
+            summary = media_summary(probe_media(video_file_path(video)))
+        except (OSError, RuntimeError, ValueError) as e:
+            logger.warning(f"Could not probe video {video.id}: {str(e)}")
+            failed += 1
+            continue
+        db.session.execute(update(Video).where(Video.checksum == checksum).values(**summary),
+                           execution_options={'synchronize_session': False})
+        probed += 1
+        if number % batch_size == 0:
+            db.session.commit()
+    db.session.commit()
+    return probed, failed
@@ -0,0 +1,116 @@
+# metrics.py
+# Prometheus metrics, served by the /metrics route.
+#
+# gunicorn.conf.py points PROMETHEUS_MULTIPROC_DIR at METRICS_FOLDER/web, and
+# the worker service points it at METRICS_FOLDER/worker. prometheus_client then
+# keeps every process's values in a small mmapped file there. A scrape of any
+# web worker sums the files of all web and worker processes, so counters and
+# histograms cover the whole installation. Without PROMETHEUS_MULTIPROC_DIR
+# (flask run, CLI commands) the values stay in the process and /metrics shows
+# only that process.
+#
+# Recording a value is one mmap write under a lock. Per-request SQL counts come
+# from instrumentation.py. Queue depth is read from the job table at scrape time.
+import os
+import time
+from flask import g, request
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST,
+                               generate_latest, multiprocess)
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import func
+from config import METRICS_FOLDER
+from models import db, Job
+
+MULTIPROCESS = 'PROMETHEUS_MULTIPROC_DIR' in os.environ
+
+# Request handling
+REQUEST_SECONDS = Histogram('videoarchive_http_request_duration_seconds', 'Time to produce a response, by route',
+                            ['endpoint', 'method'],
+                            buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+REQUESTS = Counter('videoarchive_http_requests_total', 'Responses by route and status', ['endpoint', 'method', 'status'])
+REQUEST_QUERIES = Histogram('videoarchive_http_request_sql_queries', 'SQL queries per request, by route', ['endpoint'],
+                            buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 250))
+REQUEST_QUERY_SECONDS = Histogram('videoarchive_http_request_sql_seconds', 'Time spent in SQL per request, by route',
+                                  ['endpoint'], buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+
+# Ingest
+UPLOAD_BYTES = Counter('videoarchive_upload_bytes_total', 'Upload bytes received', ['source'])
+UPLOAD_RATE = Histogram('videoarchive_upload_bytes_per_second', 'Throughput of each upload request or chunk', ['source'],
+                        buckets=(1e5, 1e6, 5e6, 1e7, 2.5e7, 5e7, 1e8, 2.5e8, 5e8, 1e9))
+CHECKSUM_SECONDS = Histogram('videoarchive_checksum_seconds', 'compute_checksum() durations',
+                             buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120))
+
+# Media worker
+THUMBNAIL_SECONDS = Histogram('videoarchive_thumbnail_seconds', 'generate_thumbnails() durations',
+                              buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60))
+TRANSCRIPTION_RTF = Histogram('videoarchive_transcription_realtime_factor',
+                              'Transcription time divided by audio duration', ['backend', 'model', 'device'],
+                              buckets=(0.01, 0.025, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10))
+TRANSCRIBED_SECONDS = Counter('videoarchive_transcribed_audio_seconds_total', 'Audio transcribed', ['model'])
+JOB_SECONDS = Histogram('videoarchive_job_duration_seconds', 'Job run time by kind and outcome', ['kind', 'outcome'],
+                        buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800, 3600))
+JOBS_ACTIVE = Gauge('videoarchive_jobs_active', 'Jobs being run by worker threads', ['kind'],
+                    multiprocess_mode='livesum')
+
+def observe_upload(source, size, seconds):
+    UPLOAD_BYTES.labels(source).inc(size)
+    if seconds > 0:
+        UPLOAD_RATE.labels(source).observe(size / seconds)
+
+def observe_transcription(backend, model, device, audio_seconds, seconds):
+    TRANSCRIBED_SECONDS.labels(model).inc(audio_seconds)
+    if audio_seconds > 0:
+        TRANSCRIPTION_RTF.labels(backend, model, device).observe(seconds / audio_seconds)
+
+# Queue depth by kind and status, read from the database at scrape time
+class JobQueueCollector:
+    def describe(self):
+        return []  # Registering must not query the database
+
+    def collect(self):
+        depth = GaugeMetricFamily('videoarchive_job_queue_depth', 'Queued and running jobs by kind', labels=['kind', 'status'])
+        rows = db.session.query(Job.kind, Job.status, func.count(Job.id)).filter(
+            Job.status.in_(['queued', 'running'])
+        ).group_by(Job.kind, Job.status)
+        for kind, status, count in rows:
+            depth.add_metric([kind, status], count)
+        yield depth
+
+# Body and content type for /metrics. Called inside a request, so the queue
+# collector can use the session.
+def render_metrics():
+    if not MULTIPROCESS:
+        return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+    registry = CollectorRegistry()
+    for name in sorted(os.listdir(METRICS_FOLDER)):
+        path = os.path.join(METRICS_FOLDER, name)
+        if os.path.isdir(path):
+            multiprocess.MultiProcessCollector(registry, path=path)
+    registry.register(JobQueueCollector())
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+if not MULTIPROCESS:
+    REGISTRY.register(JobQueueCollector())
+
+# Request latency, status and per-request SQL use for every route
+def install_request_metrics(app):
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        started = g.pop('request_started', None)
+        if started is None:
+            return response
+        endpoint = request.endpoint or 'unmatched'
+        REQUEST_SECONDS.labels(endpoint, request.method).observe(time.perf_counter() - started)
+        REQUESTS.labels(endpoint, request.method, str(response.status_code)).inc()
+        REQUEST_QUERIES.labels(endpoint).observe(g.get('query_count', 0))
+        REQUEST_QUERY_SECONDS.labels(endpoint).observe(g.get('query_seconds', 0.0))
+        return response
+
+# Seconds since the current request started, for throughput of request bodies
+def request_elapsed():
+    started = g.get('request_started')
+    return time.perf_counter() - started if started is not None else 0.0
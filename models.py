@@ -0,0 +1,216 @@
+# models.py
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateColumn
+from datetime import datetime
+import logging
+
+db = SQLAlchemy()
+
+logger = logging.getLogger(__name__)
+
+# Association table for many-to-many relationship between Video and Tag
+video_tags = db.Table('video_tags',
+    db.Column('video_id', db.Integer, db.ForeignKey('video.id'), primary_key=True),
+    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True)
+)
+
+# Models
+class User(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(80), unique=True, nullable=False)
+    password_hash = db.Column(db.String(255), nullable=False)
+    is_admin = db.Column(db.Boolean, default=False)
+    theme = db.Column(db.String(20), default='light')
+    session_version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # Bumped to expire existing sessions
+
+class Video(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(200), nullable=False)
+    filename = db.Column(db.String(200), nullable=False)
+    thumbnail = db.Column(db.String(200))  # Default JPEG, see thumbnail_set
+    thumbnail_set = db.Column(db.Text)  # JSON {format: {size: filename}} written by the media worker
+    storyboard = db.Column(db.Text)  # JSON {'vtt': filename, 'sheets': [filenames]}, see storyboard.py
+    poster_time = db.Column(db.Float)  # Seconds; frame chosen by the storyboard pass for thumbnails
+    upload_date = db.Column(db.DateTime, default=lambda: datetime.utcnow().replace(second=0, microsecond=0))
+    notes = db.Column(db.Text)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    checksum = db.Column(db.String(64), nullable=False)  # SHA-256 of the upload; the Blob holding its bytes
+    transcription = db.Column(db.Text, nullable=True)  # Full text for search; timings are in TranscriptSegment
+    transcription_status = db.Column(db.String(20), default=None)  # queued, running, completed, failed, or None
+    # Media properties from one ffprobe pass at ingest (see metadata.py); NULL until probed
+    duration = db.Column(db.Float)        # Seconds
+    container = db.Column(db.String(50))  # ffprobe format_name, e.g. 'mov,mp4,m4a,3gp,3g2,mj2'
+    video_codec = db.Column(db.String(30))
+    audio_codec = db.Column(db.String(30))
+    width = db.Column(db.Integer)         # Display size, after rotation
+    height = db.Column(db.Integer)
+    frame_rate = db.Column(db.Float)
+    bitrate = db.Column(db.BigInteger)    # Bits/s over the whole file
+    has_audio = db.Column(db.Boolean)
+    tags = db.relationship('Tag', secondary=video_tags, backref=db.backref('videos', lazy='dynamic'))
+    uploader = db.relationship('User')
+    chapters = db.relationship('Chapter', order_by='Chapter.start', cascade='all, delete-orphan')
+    renditions = db.relationship('Rendition', order_by='Rendition.height', cascade='all, delete-orphan')
+
+    # Keyset pagination of the index grid walks (upload_date, id) newest first
+    __table_args__ = (
+        db.Index('ix_video_upload_date_id', 'upload_date', 'id'),
+        db.Index('ix_video_user_upload_date_id', 'user_id', 'upload_date', 'id'),
+        db.Index('ix_video_checksum', 'checksum'),  # Duplicate checks and copies sharing a Blob
+        db.Index('ix_video_duration', 'duration'),
+        db.Index('ix_video_height', 'height'),
+        db.Index('ix_video_codecs', 'video_codec', 'audio_codec'),
+    )
+
+# Stored upload content, shared by every Video with the same checksum (see blobs.py)
+class Blob(db.Model):
+    checksum = db.Column(db.String(64), primary_key=True)  # SHA-256
+    path = db.Column(db.String(255), nullable=False)  # Relative to UPLOAD_FOLDER
+    size = db.Column(db.BigInteger, nullable=False)
+    refcount = db.Column(db.Integer, nullable=False, default=0)  # Videos referencing the content
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class Tag(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), unique=True, nullable=False)
+
+# Scene-change chapter marker found by the storyboard pass
+class Chapter(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    video_id = db.Column(db.Integer, db.ForeignKey('video.id', ondelete='CASCADE'), nullable=False, index=True)
+    start = db.Column(db.Float, nullable=False)  # Seconds
+    end = db.Column(db.Float, nullable=False)
+    title = db.Column(db.String(200), nullable=False)
+
+# One timed line of a transcript (see transcripts.py). There is no
+# relationship on Video: segments are written and deleted in bulk by video_id.
+class TranscriptSegment(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    video_id = db.Column(db.Integer, db.ForeignKey('video.id', ondelete='CASCADE'), nullable=False)
+    start = db.Column(db.Float, nullable=False)  # Seconds
+    end = db.Column(db.Float, nullable=False)
+    minute = db.Column(db.Integer, nullable=False)  # int(start // 60), for grouping by interval in SQL
+    text = db.Column(db.Text, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_transcript_segment_video_start', 'video_id', 'start'),
+    )
+
+# Perceptual fingerprint of stored content: one 64-bit DCT hash per sampled
+# frame, in time order, flat frames left out (see fingerprints.py)
+class Fingerprint(db.Model):
+    id = db.Column(db.Integer, primary_key=True)  # Increasing; lets the in-memory index load only new rows
+    checksum = db.Column(db.String(64), unique=True, nullable=False)
+    hashes = db.Column(db.LargeBinary, nullable=False)  # Little-endian uint64 per frame
+    frames = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        {'sqlite_autoincrement': True},  # Never reuse the id of a deleted row
+    )
+
+# Two contents whose fingerprints match (re-encodes, trims, re-muxes). Stored
+# in both directions.
+class NearDuplicate(db.Model):
+    checksum = db.Column(db.String(64), primary_key=True)
+    other_checksum = db.Column(db.String(64), primary_key=True)
+    similarity = db.Column(db.Float, nullable=False)  # Share of the shorter video's frames found in the other
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+# Latest state of one processing stage of a video (see progress.py)
+class VideoProgress(db.Model):
+    video_id = db.Column(db.Integer, primary_key=True)  # No foreign key: written outside the job's transaction
+    stage = db.Column(db.String(30), primary_key=True)  # stored, thumbnails, storyboard, hls 720p, audio, transcription
+    status = db.Column(db.String(20), nullable=False)   # running, done, failed
+    percent = db.Column(db.Float)
+    message = db.Column(db.Text)
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+# One rung of a video's HLS ladder, transcoded by its own 'hls' job
+class Rendition(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    video_id = db.Column(db.Integer, db.ForeignKey('video.id', ondelete='CASCADE'), nullable=False, index=True)
+    name = db.Column(db.String(20), nullable=False)  # e.g. 720p
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+    bandwidth = db.Column(db.Integer)  # Peak bits/s over the segments, for the master playlist
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, completed, failed
+    playlist = db.Column(db.String(255))  # Relative to HLS_FOLDER
+    error = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('video_id', 'name', name='uq_rendition_video_name'),
+    )
+
+# Background work item; rows are leased by worker threads (see jobs.py)
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # fingerprint, thumbnail, storyboard, hls_plan, hls, transcribe
+    video_id = db.Column(db.Integer, db.ForeignKey('video.id', ondelete='CASCADE'), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, completed, failed
+    payload = db.Column(db.Text)  # JSON encoded job options
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    leased_by = db.Column(db.String(100))
+    leased_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_job_status_run_after', 'status', 'run_after'),
+    )
+
+# A file handled by import_videos.py. Files whose path, size and mtime are
+# unchanged since are skipped without being read again.
+class ImportedFile(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    path = db.Column(db.String(1024), unique=True, nullable=False)  # Absolute source path
+    size = db.Column(db.BigInteger, nullable=False)
+    mtime_ns = db.Column(db.BigInteger, nullable=False)
+    checksum = db.Column(db.String(64), nullable=False)
+    video_id = db.Column(db.Integer)  # Video created or already holding the content; kept if that video is deleted
+    status = db.Column(db.String(20), nullable=False)  # imported, duplicate
+    imported_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+# Resumable chunked upload in progress (see the /api/uploads routes)
+class UploadSession(db.Model):
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False, index=True)
+    filename = db.Column(db.String(200), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    chunk_size = db.Column(db.Integer, nullable=False)
+    temp_path = db.Column(db.String(255), nullable=False)
+    tags = db.Column(db.Text)
+    notes = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    chunks = db.relationship('UploadChunk', backref='session', cascade='all, delete-orphan', lazy='dynamic')
+
+class UploadChunk(db.Model):
+    session_id = db.Column(db.String(32), db.ForeignKey('upload_session.id', ondelete='CASCADE'), primary_key=True)
+    index = db.Column(db.Integer, primary_key=True)
+    size = db.Column(db.Integer, nullable=False)
+    checksum = db.Column(db.String(64))
+
+# db.create_all() only creates missing tables. Bring tables created by older
+# versions up to date by adding any columns and indexes defined since then.
+# New columns must be nullable or have a server_default for this to work.
+def ensure_schema():
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    ddl = CreateColumn(column).compile(dialect=conn.dialect)
+                    conn.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN {ddl}')
+                    logger.info(f"Added column {table.name}.{column.name}")
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
@@ -0,0 +1,51 @@
+# probe.py
+# Thin ffprobe wrapper. Reads container headers only, so it is cheap enough to
+# call from the web process as well as from the media worker.
+import json
+import logging
+import subprocess
+from config import FFPROBE_PATH
+
+logger = logging.getLogger(__name__)
+
+# Return ffprobe's format/stream description of a media file as a dict
+def probe_media(path):
+    command = [
+        FFPROBE_PATH, '-v', 'error',
+        '-print_format', 'json',
+        '-show_format', '-show_streams',
+        path
+    ]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed for {path}: {result.stderr.strip()}")
+    return json.loads(result.stdout)
+
+def has_audio_stream(info):
+    return any(stream.get('codec_type') == 'audio' for stream in info.get('streams', []))
+
+# Container duration in seconds, falling back to the longest stream
+def media_duration(info):
+    durations = [info.get('format', {}).get('duration')]
+    durations += [stream.get('duration') for stream in info.get('streams', [])]
+    for value in durations:
+        try:
+            if value is not None and float(value) > 0:
+                return float(value)
+        except ValueError:
+            continue
+    return None
+
+# Display size of the first video stream, honouring 90/270 degree rotation
+def video_dimensions(info):
+    for stream in info.get('streams', []):
+        if stream.get('codec_type') != 'video' or not stream.get('width'):
+            continue
+        width, height = stream['width'], stream['height']
+        rotation = stream.get('tags', {}).get('rotate')
+        for side_data in stream.get('side_data_list', []):
+            rotation = side_data.get('rotation', rotation)
+        if rotation is not None and abs(int(float(rotation))) % 180 == 90:
+            width, height = height, width
+        return width, height
+    return None
@@ -0,0 +1,175 @@
+# progress.py
+# Live processing progress.
+#
+# The media worker records each stage of a video (thumbnails, storyboard, HLS
+# renditions, audio extraction, transcription with a percentage) as a
+# VideoProgress row. Rows are written on their own connection, so browsers see
+# them while the job's transaction is still open. Every web process runs
+# one ProgressHub thread. While any page listens, the thread reads the rows of
+# the watched videos once per PROGRESS_POLL_INTERVAL and pushes changes to
+# the open Server-Sent Events streams. A hundred open tabs cost one query per
+# second, not a hundred.
+#
+# Each open stream holds a web thread, so a process serves at most
+# PROGRESS_MAX_STREAMS of them and keeps its other threads for requests. Past
+# the cap a page gets the current stages and a longer retry in a stream that
+# ends at once, and EventSource polls with that interval until a slot is free.
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import delete, select
+from sqlalchemy.dialects import postgresql, sqlite
+from config import PROGRESS_POLL_INTERVAL, PROGRESS_HEARTBEAT, PROGRESS_STREAM_SECONDS, PROGRESS_MIN_INTERVAL, \
+    PROGRESS_MAX_STREAMS, PROGRESS_FALLBACK_RETRY
+from models import db, Job, VideoProgress
+
+logger = logging.getLogger(__name__)
+
+# Upsert a stage's state. status='running' without a percentage (re)starts
+# the stage's clock. Failures are logged, never raised: progress is advisory.
+def report_progress(video_id, stage, status='running', percent=None, message=None):
+    now = datetime.utcnow()
+    values = {'status': status, 'percent': percent, 'message': message, 'updated_at': now}
+    if status == 'running' and percent is None:
+        values['started_at'] = now
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    statement = dialect.insert(VideoProgress).values(video_id=video_id, stage=stage, started_at=now, **{
+        key: value for key, value in values.items() if key != 'started_at'
+    }).on_conflict_do_update(index_elements=['video_id', 'stage'], set_=values)
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(statement)
+    except Exception as e:
+        logger.warning(f"Could not record {stage} progress of video {video_id}: {str(e)}")
+
+# Record a stage as finished within the caller's transaction (used at ingest)
+def record_stage(video_id, stage):
+    now = datetime.utcnow()
+    db.session.merge(VideoProgress(video_id=video_id, stage=stage, status='done', percent=100.0, started_at=now, updated_at=now))
+
+def delete_progress(video_id):
+    db.session.execute(delete(VideoProgress).where(VideoProgress.video_id == video_id))
+
+# Callable taking a fraction 0-1 that reports a running stage's percentage,
+# at most once per PROGRESS_MIN_INTERVAL
+class ProgressReporter:
+    def __init__(self, video_id, stage, min_interval=PROGRESS_MIN_INTERVAL):
+        self.video_id = video_id
+        self.stage = stage
+        self.min_interval = min_interval
+        self.last_report = 0.0
+
+    def __call__(self, fraction):
+        now = time.monotonic()
+        if fraction < 1 and now - self.last_report < self.min_interval:
+            return
+        self.last_report = now
+        report_progress(self.video_id, self.stage, percent=round(min(fraction, 1.0) * 100, 1))
+
+# {video_id: {'stages': [...], 'pending': bool}} for the given videos, stages
+# in the order they started; pending while the video has queued or running jobs
+def load_progress(video_ids):
+    rows = db.session.execute(
+        select(VideoProgress).where(VideoProgress.video_id.in_(video_ids)).order_by(VideoProgress.started_at)
+    ).scalars()
+    pending = set(db.session.execute(
+        select(Job.video_id).where(Job.video_id.in_(video_ids), Job.status.in_(['queued', 'running'])).distinct()
+    ).scalars())
+    progress = {video_id: {'stages': [], 'pending': video_id in pending} for video_id in video_ids}
+    for row in rows:
+        progress[row.video_id]['stages'].append({
+            'stage': row.stage,
+            'status': row.status,
+            'percent': row.percent,
+            'message': row.message,
+            # Worker clock on both ends; for a running stage, up to its last update
+            'elapsed': round((row.updated_at - row.started_at).total_seconds(), 1),
+        })
+    return progress
+
+# Per-process fan-out of progress to event streams
+class ProgressHub:
+    def __init__(self, app, interval=PROGRESS_POLL_INTERVAL, max_streams=PROGRESS_MAX_STREAMS):
+        self.app = app
+        self.interval = interval
+        self.max_streams = max_streams
+        self.lock = threading.Lock()
+        self.subscribers = {}  # video_id -> set of queue.Queue
+        self.snapshots = {}    # video_id -> last progress sent
+        self.streams = 0       # Listeners across all videos
+        self.thread = None
+
+    # A listener for the video's progress, or None when max_streams are open
+    def subscribe(self, video_id):
+        listener = queue.Queue(maxsize=16)
+        with self.lock:
+            if self.streams >= self.max_streams:
+                return None
+            self.streams += 1
+            self.subscribers.setdefault(video_id, set()).add(listener)
+            if video_id in self.snapshots:
+                listener.put_nowait(self.snapshots[video_id])
+            if not self.thread:
+                self.thread = threading.Thread(target=self._run, name='progress-hub', daemon=True)
+                self.thread.start()
+        return listener
+
+    # Safe to call more than once for the same listener
+    def unsubscribe(self, video_id, listener):
+        with self.lock:
+            listeners = self.subscribers.get(video_id, set())
+            if listener in listeners:
+                listeners.remove(listener)
+                self.streams -= 1
+            if not listeners:
+                self.subscribers.pop(video_id, None)
+                self.snapshots.pop(video_id, None)
+
+    def _run(self):
+        while True:
+            with self.lock:
+                video_ids = list(self.subscribers)
+                if not video_ids:
+                    self.thread = None  # Started again by the next subscriber
+                    return
+            try:
+                with self.app.app_context():
+                    progress = load_progress(video_ids)
+            except Exception as e:
+                logger.error(f"Reading progress failed: {str(e)}")
+                progress = {}
+            with self.lock:
+                for video_id, snapshot in progress.items():
+                    if video_id not in self.subscribers or self.snapshots.get(video_id) == snapshot:
+                        continue
+                    self.snapshots[video_id] = snapshot
+                    for listener in self.subscribers[video_id]:
+                        try:
+                            listener.put_nowait(snapshot)
+                        except queue.Full:
+                            pass  # The client stopped reading; its stream ends at its deadline
+            time.sleep(self.interval)
+
+    # Server-Sent Events for one subscribed listener: a 'progress' event with
+    # every stage whenever something changes, keep-alive comments in between
+    def event_stream(self, video_id, listener, heartbeat=PROGRESS_HEARTBEAT, lifetime=PROGRESS_STREAM_SECONDS):
+        deadline = time.monotonic() + lifetime
+        try:
+            yield 'retry: 3000\n\n'
+            while time.monotonic() < deadline:
+                try:
+                    snapshot = listener.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield f"event: progress\ndata: {json.dumps({'video_id': video_id, **snapshot})}\n\n"
+        finally:
+            self.unsubscribe(video_id, listener)
+
+# The stream for a page past the cap: the current stages, then EventSource
+# reconnects after retry seconds
+def fallback_stream(video_id, snapshot, retry=PROGRESS_FALLBACK_RETRY):
+    return [f"retry: {retry * 1000}\n\n", f"event: progress\ndata: {json.dumps({'video_id': video_id, **snapshot})}\n\n"]
@@ -0,0 +1,153 @@
+# search.py
+# Full-text search over video titles, tags, notes and transcriptions.
+#
+# PostgreSQL keeps a weighted tsvector per video in `video_search` with a GIN
+# index; SQLite uses an FTS5 virtual table `video_fts`. Either way the index is
+# updated by index_video() whenever a video's searchable fields change.
+import logging
+import re
+from markupsafe import escape
+from sqlalchemy import text
+from models import db, Video
+
+logger = logging.getLogger(__name__)
+
+MARK_START = '\x02'
+MARK_END = '\x03'
+SNIPPET_WORDS = 20
+
+def _is_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+# Create the index table if it does not exist yet
+def ensure_search_index():
+    with db.engine.begin() as conn:
+        if _is_postgres():
+            conn.execute(text(
+                "CREATE TABLE IF NOT EXISTS video_search ("
+                " video_id INTEGER PRIMARY KEY REFERENCES video(id) ON DELETE CASCADE,"
+                " document TSVECTOR NOT NULL)"
+            ))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_video_search_document ON video_search USING GIN (document)"))
+        else:
+            conn.execute(text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS video_fts USING fts5("
+                "title, tags, notes, transcription, tokenize='porter unicode61')"
+            ))
+
+def drop_search_index():
+    with db.engine.begin() as conn:
+        if _is_postgres():
+            conn.execute(text("DROP TABLE IF EXISTS video_search"))
+        else:
+            conn.execute(text("DROP TABLE IF EXISTS video_fts"))
+
+def _document(video):
+    return {
+        'id': video.id,
+        'title': video.title or '',
+        'tags': ' '.join(tag.name for tag in video.tags),
+        'notes': video.notes or '',
+        'transcription': video.transcription or '',
+    }
+
+# Insert or refresh a video's entry; call after its searchable fields change.
+# Runs in the caller's transaction, so commit afterwards.
+def index_video(video):
+    params = _document(video)
+    if _is_postgres():
+        db.session.execute(text(
+            "INSERT INTO video_search (video_id, document) VALUES (:id, "
+            " setweight(to_tsvector('english', :title), 'A') ||"
+            " setweight(to_tsvector('english', :tags), 'B') ||"
+            " setweight(to_tsvector('english', :notes), 'C') ||"
+            " setweight(to_tsvector('english', :transcription), 'D'))"
+            " ON CONFLICT (video_id) DO UPDATE SET document = EXCLUDED.document"
+        ), params)
+    else:
+        db.session.execute(text("DELETE FROM video_fts WHERE rowid = :id"), params)
+        db.session.execute(text(
+            "INSERT INTO video_fts (rowid, title, tags, notes, transcription)"
+            " VALUES (:id, :title, :tags, :notes, :transcription)"
+        ), params)
+
+def remove_video(video_id):
+    if _is_postgres():
+        db.session.execute(text("DELETE FROM video_search WHERE video_id = :id"), {'id': video_id})
+    else:
+        db.session.execute(text("DELETE FROM video_fts WHERE rowid = :id"), {'id': video_id})
+
+# Rebuild the whole index from the video table
+def reindex_all(batch_size=200):
+    count = 0
+    last_id = 0
+    while True:
+        videos = db.session.query(Video).filter(Video.id > last_id).order_by(Video.id).limit(batch_size).all()
+        if not videos:
+            break
+        for video in videos:
+            index_video(video)
+        db.session.commit()
+        count += len(videos)
+        last_id = videos[-1].id
+        db.session.expunge_all()
+    logger.info(f"Search index rebuilt for {count} videos")
+    return count
+
+def _terms(query):
+    return re.findall(r'[^\W_]+', query.lower())[:20]
+
+# Escape a snippet and turn the highlight markers into <mark> tags
+def snippet_html(snippet):
+    if not snippet:
+        return ''
+    return str(escape(snippet)).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+# Ranked, paginated search. Returns (total hits, [(video_id, snippet_html)]),
+# restricted to the user's own videos unless they are an admin, and to videos
+# with the given tag if any.
+def search_videos(query, user, page=1, per_page=24, tag=None):
+    terms = _terms(query)
+    if not terms:
+        return 0, []
+    offset = (page - 1) * per_page
+    owner_filter = '' if user.is_admin else ' AND video.user_id = :user_id'
+    if tag:
+        owner_filter += (
+            " AND EXISTS (SELECT 1 FROM video_tags JOIN tag ON tag.id = video_tags.tag_id"
+            " WHERE video_tags.video_id = video.id AND tag.name = :tag)"
+        )
+    params = {'user_id': user.id, 'limit': per_page, 'offset': offset, 'tag': tag}
+
+    if _is_postgres():
+        params['tsquery'] = ' & '.join(f"{term}:*" for term in terms)
+        params['headline_options'] = f"MaxWords={SNIPPET_WORDS}, MinWords=10, ShortWord=2, StartSel={MARK_START}, StopSel={MARK_END}"
+        matches = (
+            "FROM video_search JOIN video ON video.id = video_search.video_id"
+            " WHERE video_search.document @@ to_tsquery('english', :tsquery)" + owner_filter
+        )
+        total = db.session.execute(text(f"SELECT count(*) {matches}"), params).scalar()
+        # Headlines are only generated for the page being returned
+        rows = db.session.execute(text(
+            "SELECT page.id, ts_headline('english', page.body, to_tsquery('english', :tsquery), :headline_options)"
+            " FROM (SELECT video.id, coalesce(video.notes, '') || ' ' || coalesce(video.transcription, '') AS body,"
+            " ts_rank_cd(video_search.document, to_tsquery('english', :tsquery)) AS rank"
+            f" {matches} ORDER BY rank DESC, video.upload_date DESC LIMIT :limit OFFSET :offset) AS page"
+            " ORDER BY page.rank DESC"
+        ), params).all()
+    else:
+        params['match'] = ' '.join(f'"{term}"*' for term in terms)
+        params['mark_start'] = MARK_START
+        params['mark_end'] = MARK_END
+        matches = (
+            "FROM video_fts JOIN video ON video.id = video_fts.rowid"
+            " WHERE video_fts MATCH :match" + owner_filter
+        )
+        total = db.session.execute(text(f"SELECT count(*) {matches}"), params).scalar()
+        rows = db.session.execute(text(
+            f"SELECT video.id, snippet(video_fts, -1, :mark_start, :mark_end, '...', {SNIPPET_WORDS})"
+            f" {matches} ORDER BY bm25(video_fts, 10.0, 5.0, 2.0, 1.0), video.upload_date DESC"
+            " LIMIT :limit OFFSET :offset"
+        ), params).all()
+
+    return total, [(video_id, snippet_html(snippet)) for video_id, snippet in rows]
@@ -0,0 +1,192 @@
+# speech.py
+# Speech-to-text helpers for the media worker.
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from config import (WHISPER_CACHE_MAX_MODELS, WHISPER_CACHE_MAX_BYTES, TRANSCRIBE_PROCESSES, TRANSCRIBE_THREADS,
+                    TRANSCRIBE_CHUNK_SECONDS, TRANSCRIBE_CHUNK_MIN_DURATION, TRANSCRIBE_SPLIT_SEARCH_SECONDS)
+from audio import SAMPLE_RATE
+from metrics import observe_transcription
+from transcribers import get_transcriber
+
+logger = logging.getLogger(__name__)
+
+# Keeps loaded Whisper models in memory for the life of the worker process.
+# Models are keyed by (backend, name, device, threads) and evicted
+# least-recently-used first once either the model count or the byte budget is
+# exceeded. threads only counts for backends that fix it at load time. A
+# model evicted while a job is still using it is freed when that job drops
+# its reference.
+class ModelRegistry:
+    def __init__(self, max_models=WHISPER_CACHE_MAX_MODELS, max_bytes=WHISPER_CACHE_MAX_BYTES):
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self.models = OrderedDict()  # (backend, name, device, threads) -> (model, size_bytes)
+        self.lock = threading.Lock()
+
+    # Returns (model, load_seconds); load_seconds is 0.0 on a cache hit
+    def get(self, name, device=None, backend=None, threads=0):
+        transcriber = get_transcriber(backend)
+        device = device or transcriber.default_device()
+        key = (transcriber.name, name, device, threads if transcriber.threads_per_model else 0)
+        with self.lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                return self.models[key][0], 0.0
+
+            start = time.perf_counter()
+            model = transcriber.load(name, device, threads)
+            load_seconds = time.perf_counter() - start
+            size = transcriber.model_size(model, name)
+            self.models[key] = (model, size)
+            logger.info(f"Loaded {transcriber.name} '{name}' on {device} in {load_seconds:.2f}s ({size / 1024 / 1024:.0f} MB)")
+            self._evict(keep=key)
+            return model, load_seconds
+
+    def total_bytes(self):
+        return sum(size for _, size in self.models.values())
+
+    def _evict(self, keep):
+        evicted = set()
+        while len(self.models) > 1 and (len(self.models) > self.max_models or self.total_bytes() > self.max_bytes):
+            key = next(k for k in self.models if k != keep)
+            _, size = self.models.pop(key)
+            evicted.add(key[0])
+            logger.info(f"Evicted {key[0]} '{key[1]}' on {key[2]} from cache ({size / 1024 / 1024:.0f} MB)")
+        for backend in evicted:
+            get_transcriber(backend).release()
+
+    def clear(self):
+        with self.lock:
+            self.models.clear()
+
+# Per-process registry shared by all job worker threads
+model_registry = ModelRegistry()
+
+# Group segments into one paragraph per interval of start time, joined by blank
+# lines. This is the stored transcription layout that view_transcription splits.
+def paragraph_text(segments, interval_seconds=60):
+    transcription_text = ""
+    current_interval = 0
+    current_paragraph = []
+
+    for segment in segments:
+        start_time = segment["start"]
+        interval = int(start_time // interval_seconds)
+        if interval > current_interval:
+            if current_paragraph:
+                transcription_text += " ".join(current_paragraph) + "\n\n"
+            current_paragraph = []
+            current_interval = interval
+        current_paragraph.append(segment["text"].strip())
+
+    if current_paragraph:
+        transcription_text += " ".join(current_paragraph)
+    return transcription_text
+
+# Pick chunk boundaries near every chunk_seconds, moved to the quietest 20 ms
+# frame within search_seconds so words are not cut in half. Returns sample
+# offsets including 0 and len(audio).
+def find_split_points(audio, sample_rate=SAMPLE_RATE, chunk_seconds=TRANSCRIBE_CHUNK_SECONDS,
+                      search_seconds=TRANSCRIBE_SPLIT_SEARCH_SECONDS):
+    frame = sample_rate // 50
+    frame_count = len(audio) // frame
+    frames = audio[:frame_count * frame].reshape(frame_count, frame)
+    energy = np.einsum('ij,ij->i', frames, frames)
+
+    frames_per_chunk = int(chunk_seconds * sample_rate) // frame
+    search = int(search_seconds * sample_rate) // frame
+    points = [0]
+    target = frames_per_chunk
+    while target < frame_count - search:
+        low, high = max(target - search, points[-1] // frame + 1), min(target + search, frame_count)
+        quietest = low + int(np.argmin(energy[low:high]))
+        points.append(quietest * frame + frame // 2)
+        target = quietest + frames_per_chunk
+    points.append(len(audio))
+    return points
+
+_chunk_pool = None
+_chunk_pool_lock = threading.Lock()
+
+# Shared process pool for chunked transcription. Spawned (not forked) so the
+# children do not inherit the parent's inference threads and DB connections.
+def chunk_pool(processes=TRANSCRIBE_PROCESSES):
+    global _chunk_pool
+    with _chunk_pool_lock:
+        if _chunk_pool is None:
+            _chunk_pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+        return _chunk_pool
+
+# Threads for each process of a chunked run: the job's count (or all cores)
+# shared between the pool processes
+def chunk_threads(threads, processes=TRANSCRIBE_PROCESSES):
+    return max(1, (threads or os.cpu_count() or 1) // processes)
+
+# Runs in a pool process; the child keeps its own model registry
+def _transcribe_chunk(backend, model_name, device, audio, offset_seconds, language, threads):
+    model, _ = model_registry.get(model_name, device, backend=backend, threads=threads)
+    segments = get_transcriber(backend).transcribe(model, audio, language=language, threads=threads)
+    return [
+        {'start': segment['start'] + offset_seconds, 'end': segment['end'] + offset_seconds, 'text': segment['text']}
+        for segment in segments
+    ]
+
+# Split long audio at silences, transcribe the chunks in parallel and stitch
+# the segments back together with absolute timestamps. progress is called
+# with the fraction of the audio in finished chunks.
+def transcribe_chunked(audio, model_name, device='cpu', language='en', executor=None, progress=None, backend=None,
+                       threads=None):
+    executor = executor or chunk_pool()
+    backend = get_transcriber(backend).name  # Resolved here: the children may see another config
+    threads = threads or chunk_threads(TRANSCRIBE_THREADS)
+    points = find_split_points(audio)
+    futures = {
+        executor.submit(_transcribe_chunk, backend, model_name, device, audio[start:end], start / SAMPLE_RATE, language,
+                        threads): end - start
+        for start, end in zip(points, points[1:])
+    }
+    finished = 0
+    for future in as_completed(futures):
+        future.result()  # Raise a failed chunk's error straight away
+        finished += futures[future]
+        if progress:
+            progress(finished / len(audio))
+    segments = []
+    for future in futures:  # Submission order is time order
+        segments.extend(future.result())
+    return segments
+
+# Transcribe float32 16 kHz audio with the configured backend (see
+# transcribers.py), chunking long CPU jobs across processes. Returns segments
+# as dicts with absolute start/end seconds and text. threads overrides
+# TRANSCRIBE_THREADS for this job. progress, if given, is called with the
+# fraction (0-1) done so far.
+def transcribe_audio(audio, model_name, device=None, language='en', progress=None, backend=None, threads=None):
+    transcriber = get_transcriber(backend)
+    device = device or transcriber.default_device()
+    threads = threads or TRANSCRIBE_THREADS
+    duration = len(audio) / SAMPLE_RATE
+    start = time.perf_counter()
+    if device == 'cpu' and TRANSCRIBE_PROCESSES > 1 and duration > TRANSCRIBE_CHUNK_MIN_DURATION:
+        segments = transcribe_chunked(audio, model_name, device, language, progress=progress, backend=transcriber.name,
+                                      threads=chunk_threads(threads))
+        observe_transcription(transcriber.name, model_name, 'cpu-chunked', duration, time.perf_counter() - start)
+        logger.info(f"Chunked transcription with {transcriber.name} '{model_name}' across {TRANSCRIBE_PROCESSES} processes: "
+                    f"{duration:.0f}s audio in {time.perf_counter() - start:.2f}s")
+        return segments
+
+    model, load_seconds = model_registry.get(model_name, device, backend=transcriber.name, threads=threads)
+    inference_start = time.perf_counter()
+    segments = transcriber.transcribe(model, audio, language=language, threads=threads, progress=progress)
+    inference_seconds = time.perf_counter() - inference_start
+    observe_transcription(transcriber.name, model_name, device, duration, load_seconds + inference_seconds)
+    logger.info(f"Transcription with {transcriber.name} '{model_name}' on {device}"
+                f"{f' ({threads} threads)' if threads else ''}: model load {load_seconds:.2f}s"
+                f"{' (cached)' if load_seconds == 0.0 else ''}, inference {inference_seconds:.2f}s for {duration:.0f}s audio")
+    return segments
@@ -0,0 +1,164 @@
+# storage.py
+# Single-pass ingest of uploaded files. Multipart file parts are written
+# straight into a temp file inside the upload folder while being hashed, so
+# after the request body is parsed the checksum is already known and the file
+# only needs an atomic os.replace into place (or an unlink if it is a duplicate).
+import hashlib
+import logging
+import os
+import tempfile
+from datetime import datetime, timedelta
+from flask import Request
+from config import UPLOAD_FOLDER, INGEST_BUFFER_SIZE, UPLOAD_SESSION_TTL
+from models import db, UploadSession
+from metrics import CHECKSUM_SECONDS
+
+logger = logging.getLogger(__name__)
+
+TEMP_PREFIX = '.ingest_'
+
+# Writable temp file that keeps a running SHA-256 of everything written to it
+class HashingFile:
+    def __init__(self, directory=UPLOAD_FOLDER, buffer_size=INGEST_BUFFER_SIZE):
+        fd, self.name = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=directory)
+        self.file = os.fdopen(fd, 'w+b', buffering=buffer_size)
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+# Result of staging one upload: a temp file in the upload folder and its hash.
+# path is None when the content is known to be stored already and was not
+# copied (see import_videos.py). linked is True when path is a hard link to a
+# file outside the app, whose permissions are not ours to change.
+class StagedFile:
+    def __init__(self, path, checksum, size, linked=False):
+        self.path = path
+        self.checksum = checksum
+        self.size = size
+        self.linked = linked
+
+# Request class whose multipart file parts are ingested through HashingFile
+class IngestRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        stream = HashingFile()
+        self.ingest_temp_files.append(stream.name)
+        return stream
+
+    @property
+    def ingest_temp_files(self):
+        if 'ingest_temp_files' not in self.__dict__:
+            self.__dict__['ingest_temp_files'] = []
+        return self.__dict__['ingest_temp_files']
+
+# Helper to compute SHA-256 checksum of a file object
+@CHECKSUM_SECONDS.time()
+def compute_checksum(file, buffer_size=INGEST_BUFFER_SIZE):
+    sha256 = hashlib.sha256()
+    for chunk in iter(lambda: file.read(buffer_size), b""):
+        sha256.update(chunk)
+    file.seek(0)
+    return sha256.hexdigest()
+
+# Copy a readable stream into a temp file in the upload folder, hashing on the way
+def ingest_stream(stream, directory=UPLOAD_FOLDER, buffer_size=INGEST_BUFFER_SIZE):
+    target = HashingFile(directory, buffer_size)
+    try:
+        for chunk in iter(lambda: stream.read(buffer_size), b""):
+            target.write(chunk)
+        target.close()
+    except Exception:
+        target.close()
+        os.unlink(target.name)
+        raise
+    return StagedFile(target.name, target.hexdigest(), target.size)
+
+# Stage an uploaded werkzeug FileStorage. Parts parsed by IngestRequest are
+# already on disk and hashed; anything else is copied once with large buffers.
+def stage_upload(file_storage):
+    stream = file_storage.stream
+    if isinstance(stream, HashingFile):
+        stream.close()
+        return StagedFile(stream.name, stream.hexdigest(), stream.size)
+    return ingest_stream(stream)
+
+# Atomically move a staged file to its final path. A hard link shares its
+# inode, and so its mode, with the original, which keeps its permissions.
+def commit_staged(staged, path):
+    os.replace(staged.path, path)
+    if not staged.linked:
+        os.chmod(path, 0o775)
+
+def discard_staged(staged):
+    if staged.path and os.path.exists(staged.path):
+        os.unlink(staged.path)
+
+# Remove temp files of a request that were never committed (duplicates,
+# failures, aborted uploads)
+def cleanup_request_temp_files(request):
+    for path in getattr(request, 'ingest_temp_files', []):
+        if os.path.exists(path):
+            try:
+                os.unlink(path)
+                logger.debug(f"Removed leftover ingest file {path}")
+            except OSError as e:
+                logger.error(f"Failed to remove ingest file {path}: {str(e)}")
+
+# Resumable uploads: chunks are written with pwrite at their offsets into a
+# preallocated (sparse) file, so they can arrive in any order and in parallel
+CHUNKED_PREFIX = '.chunked_'
+WRITE_SIZE = 1024 * 1024
+
+def create_chunked_file(size, directory=UPLOAD_FOLDER):
+    fd, path = tempfile.mkstemp(prefix=CHUNKED_PREFIX, dir=directory)
+    try:
+        os.ftruncate(fd, size)
+    finally:
+        os.close(fd)
+    return path
+
+# Stream `length` bytes from `stream` into the file at `offset`. Returns the
+# number of bytes written and their SHA-256.
+def write_chunk(path, offset, length, stream):
+    sha256 = hashlib.sha256()
+    written = 0
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        while written < length:
+            data = stream.read(min(WRITE_SIZE, length - written))
+            if not data:
+                break
+            os.pwrite(fd, data, offset + written)
+            sha256.update(data)
+            written += len(data)
+    finally:
+        os.close(fd)
+    return written, sha256.hexdigest()
+
+# Hash a fully assembled chunked upload so it can go through the normal
+# duplicate check and commit_staged()
+def stage_chunked_file(path, size):
+    with open(path, 'rb', buffering=0) as f:
+        checksum = compute_checksum(f)
+    return StagedFile(path, checksum, size)
+
+# Discard resumable uploads that have not seen a chunk for UPLOAD_SESSION_TTL
+def expire_upload_sessions():
+    cutoff = datetime.utcnow() - timedelta(seconds=UPLOAD_SESSION_TTL)
+    expired = db.session.query(UploadSession).filter(UploadSession.updated_at < cutoff).all()
+    for upload in expired:
+        if os.path.exists(upload.temp_path):
+            os.unlink(upload.temp_path)
+        db.session.delete(upload)
+        logger.info(f"Expired resumable upload {upload.id} ({upload.filename})")
+    db.session.commit()
+    return len(expired)
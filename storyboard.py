@@ -0,0 +1,203 @@
+# storyboard.py
+# Storyboard sprites, scene-change chapters and poster frame choice from one
+# streaming decode of the video.
+#
+# A single ffmpeg run decodes the file once, samples it at
+# STORYBOARD_ANALYSIS_FPS and scales the samples down to tile size. One branch
+# of its filter graph tiles every n-th sample into JPEG sprite sheets; the other
+# streams the raw samples to us. The samples are processed in batches with
+# NumPy: colour histograms of neighbouring samples are compared to find cuts,
+# and luma statistics pick a well exposed, detailed poster frame.
+import hashlib
+import logging
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+import numpy as np
+from config import (FFMPEG_PATH, STORYBOARD_ANALYSIS_FPS, STORYBOARD_TILE_WIDTH, STORYBOARD_COLUMNS, STORYBOARD_ROWS,
+                    STORYBOARD_MIN_INTERVAL, STORYBOARD_MAX_TILES, SCENE_CHANGE_THRESHOLD, CHAPTER_MIN_SECONDS)
+from probe import media_duration, video_dimensions
+from webvtt import vtt_document
+
+logger = logging.getLogger(__name__)
+
+BATCH_FRAMES = 64
+HISTOGRAM_BINS = 512  # 3 bits per RGB channel
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+class StoryboardResult:
+    def __init__(self, files, chapters, poster_time, frames, seconds):
+        self.files = files              # {'vtt': filename, 'sheets': [filenames]}
+        self.chapters = chapters        # [(start, end)] in seconds; empty when there are no cuts
+        self.poster_time = poster_time  # Seconds, or None if no sample qualified
+        self.frames = frames            # Samples analysed
+        self.seconds = seconds          # Video time covered by the samples
+
+# Everything a storyboard depends on besides the content (see derivatives.py)
+def storyboard_cache_params():
+    return {
+        'fps': STORYBOARD_ANALYSIS_FPS, 'tile_width': STORYBOARD_TILE_WIDTH, 'grid': [STORYBOARD_COLUMNS, STORYBOARD_ROWS],
+        'min_interval': STORYBOARD_MIN_INTERVAL, 'max_tiles': STORYBOARD_MAX_TILES,
+        'scene_threshold': SCENE_CHANGE_THRESHOLD, 'chapter_min_seconds': CHAPTER_MIN_SECONDS,
+    }
+
+def tile_size(info):
+    size = video_dimensions(info) or (16, 9)
+    height = max(2, int(round(STORYBOARD_TILE_WIDTH * size[1] / size[0] / 2)) * 2)
+    return STORYBOARD_TILE_WIDTH, height
+
+# Seconds between storyboard tiles, a whole multiple of the sampling period
+def tile_interval(duration):
+    interval = max(STORYBOARD_MIN_INTERVAL, math.ceil((duration or 0) / STORYBOARD_MAX_TILES))
+    return max(interval, math.ceil(1 / STORYBOARD_ANALYSIS_FPS))
+
+# Scene cuts and poster choice over the stream of samples, one batch at a time
+class SceneAnalyser:
+    def __init__(self, duration=None):
+        self.duration = duration
+        self.frames = 0
+        self.previous = None
+        self.cuts = []
+        self.poster_time = None
+        self.poster_score = 0.0
+
+    def add(self, batch):
+        count = len(batch)
+        times = (self.frames + np.arange(count)) / STORYBOARD_ANALYSIS_FPS
+
+        # One bincount for the whole batch: offset each sample's bins by 512
+        quantised = (batch >> 5).astype(np.int32)
+        bins = (quantised[..., 0] << 6) | (quantised[..., 1] << 3) | quantised[..., 2]
+        bins = bins.reshape(count, -1) + (np.arange(count) * HISTOGRAM_BINS)[:, None]
+        histograms = np.bincount(bins.ravel(), minlength=count * HISTOGRAM_BINS).reshape(count, HISTOGRAM_BINS)
+        histograms = histograms / bins.shape[1]
+
+        if self.previous is not None:
+            distances = 0.5 * np.abs(np.diff(np.vstack([self.previous, histograms]), axis=0)).sum(axis=1)
+            cut_times = times
+        else:
+            distances = 0.5 * np.abs(np.diff(histograms, axis=0)).sum(axis=1)
+            cut_times = times[1:]
+        for index in np.flatnonzero(distances > SCENE_CHANGE_THRESHOLD):
+            self.cuts.append(float(cut_times[index]))
+        self.previous = histograms[-1:]
+
+        # Poster: the most detailed (highest luma spread) sample that is neither
+        # too dark nor washed out, away from the very start/end and from cuts
+        luma = batch.reshape(count, -1, 3) @ LUMA_WEIGHTS
+        means = luma.mean(axis=1)
+        scores = luma.std(axis=1)
+        scores[(means < 0.15 * 255) | (means > 0.85 * 255)] = 0
+        if self.duration:
+            scores[(times < 0.05 * self.duration) | (times > 0.95 * self.duration)] = 0
+        if self.cuts:
+            cuts = np.array(self.cuts[-count - 1:])
+            near_cut = np.abs(times[:, None] - cuts[None, :]).min(axis=1) < 1.0
+            scores[near_cut] = 0
+        best = int(np.argmax(scores))
+        if scores[best] > self.poster_score:
+            self.poster_score = float(scores[best])
+            self.poster_time = float(times[best])
+
+        self.frames += count
+
+    @property
+    def seconds(self):
+        return self.frames / STORYBOARD_ANALYSIS_FPS
+
+    # Chapter (start, end) spans, dropping cuts closer than CHAPTER_MIN_SECONDS
+    def chapters(self):
+        starts = [0.0]
+        for cut in self.cuts:
+            if cut - starts[-1] >= CHAPTER_MIN_SECONDS:
+                starts.append(cut)
+        end = self.duration or self.seconds
+        if len(starts) > 1 and end - starts[-1] < CHAPTER_MIN_SECONDS / 2:
+            starts.pop()  # Merge a very short tail into the previous chapter
+        if len(starts) < 2:
+            return []
+        return list(zip(starts, starts[1:] + [end]))
+
+def _ffmpeg_command(video_path, width, height, interval, sheet_pattern):
+    graph = (
+        f"[0:v:0]fps={STORYBOARD_ANALYSIS_FPS},scale={width}:{height}:flags=bilinear,setsar=1,split[samples][tiles];"
+        f"[tiles]fps=1/{interval},tile={STORYBOARD_COLUMNS}x{STORYBOARD_ROWS}[sheets]"
+    )
+    return [
+        FFMPEG_PATH, '-nostdin', '-y', '-v', 'error', '-threads', '0',
+        '-i', video_path,
+        '-filter_complex', graph,
+        '-map', '[sheets]', '-c:v', 'mjpeg', '-q:v', '5', sheet_pattern,
+        '-map', '[samples]', '-f', 'rawvideo', '-pix_fmt', 'rgb24', 'pipe:1'
+    ]
+
+def _storyboard_cues(sheets, seconds, interval, width, height):
+    per_sheet = STORYBOARD_COLUMNS * STORYBOARD_ROWS
+    for index in range(min(math.ceil(seconds / interval), len(sheets) * per_sheet)):
+        sheet, position = divmod(index, per_sheet)
+        row, column = divmod(position, STORYBOARD_COLUMNS)
+        start = index * interval
+        yield start, min(start + interval, seconds), f"{sheets[sheet]}#xywh={column * width},{row * height},{width},{height}"
+
+# Decode the video once; write sprite sheets and their WebVTT track into
+# output_dir under content-hashed names and return a StoryboardResult
+def build_storyboard(video_path, output_dir, info, prefix):
+    duration = media_duration(info)
+    width, height = tile_size(info)
+    interval = tile_interval(duration)
+    frame_bytes = width * height * 3
+    analyser = SceneAnalyser(duration)
+
+    work_dir = tempfile.mkdtemp(prefix='.storyboard-', dir=output_dir)
+    try:
+        command = _ffmpeg_command(video_path, width, height, interval, os.path.join(work_dir, 'sheet_%04d.jpg'))
+        # Messages go to a file, not an unread pipe (see audio.load_audio)
+        with tempfile.TemporaryFile() as errors:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=errors)
+            try:
+                while True:
+                    data = process.stdout.read(frame_bytes * BATCH_FRAMES)
+                    count = len(data) // frame_bytes
+                    if count:
+                        batch = np.frombuffer(data, dtype=np.uint8, count=count * frame_bytes)
+                        analyser.add(batch.reshape(count, height, width, 3))
+                    if len(data) < frame_bytes * BATCH_FRAMES:
+                        break
+            finally:
+                process.stdout.close()
+                process.wait()
+            if process.returncode != 0:
+                errors.seek(0)
+                raise RuntimeError(f"ffmpeg failed for {video_path}: {errors.read().decode(errors='replace').strip()}")
+
+        names = sorted(name for name in os.listdir(work_dir) if name.startswith('sheet_'))
+        if not analyser.frames or not names:
+            raise RuntimeError(f"No video frames decoded from {video_path}")
+
+        digest = hashlib.sha256()
+        for name in names:
+            with open(os.path.join(work_dir, name), 'rb') as f:
+                digest.update(f.read())
+        stem = f"{prefix}_sb_{digest.hexdigest()[:16]}"
+        sheets = []
+        for number, name in enumerate(names):
+            sheet = f"{stem}_{number:04d}.jpg"
+            os.replace(os.path.join(work_dir, name), os.path.join(output_dir, sheet))
+            os.chmod(os.path.join(output_dir, sheet), 0o775)
+            sheets.append(sheet)
+
+        seconds = duration or analyser.seconds
+        vtt = f"{stem}.vtt"
+        with open(os.path.join(output_dir, vtt), 'w') as f:
+            f.write(vtt_document(_storyboard_cues(sheets, seconds, interval, width, height)))
+        os.chmod(os.path.join(output_dir, vtt), 0o775)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    chapters = analyser.chapters()
+    logger.info(f"Storyboard for {video_path}: {analyser.frames} samples, {len(sheets)} sheets, "
+                f"{len(chapters)} chapters, poster at {analyser.poster_time}")
+    return StoryboardResult({'vtt': vtt, 'sheets': sheets}, chapters, analyser.poster_time,
+                            analyser.frames, analyser.seconds)
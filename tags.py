@@ -0,0 +1,65 @@
+# tags.py
+# Set-based tag writes and tag facet counts.
+#
+# Tag names from a form are upserted in one INSERT ... ON CONFLICT DO NOTHING
+# and read back in one SELECT, and tags no video uses any more are removed by
+# a single DELETE ... WHERE NOT EXISTS. Facet counts (videos per tag, for the
+# index page filter) are cached per process for TAG_FACET_TTL seconds and
+# dropped whenever this process writes tags; other processes catch up within
+# the TTL.
+import logging
+import time
+from sqlalchemy import delete, exists, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from config import TAG_FACET_TTL
+from models import db, Video, Tag, video_tags
+
+logger = logging.getLogger(__name__)
+
+_facets = {}  # scope (user id, or None for admins) -> (facets, monotonic time they were read)
+
+# Unique, non-empty names from a comma-separated form field, in input order
+def parse_tag_names(tags_input):
+    names = [name.strip() for name in (tags_input or '').split(',')]
+    return list(dict.fromkeys(name for name in names if name))
+
+# Tag rows for names, creating the missing ones. Runs in the caller's
+# transaction, so commit afterwards.
+def tags_for_names(names):
+    if not names:
+        return []
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    db.session.execute(
+        dialect.insert(Tag).values([{'name': name} for name in names]).on_conflict_do_nothing(index_elements=['name'])
+    )
+    tags = {tag.name: tag for tag in db.session.scalars(select(Tag).where(Tag.name.in_(names)))}
+    invalidate_tag_facets()
+    return [tags[name] for name in names]
+
+# Remove tags without videos. Returns the number removed; commit afterwards.
+def delete_orphan_tags():
+    used = exists().where(video_tags.c.tag_id == Tag.id)
+    result = db.session.execute(delete(Tag).where(~used), execution_options={'synchronize_session': False})
+    invalidate_tag_facets()
+    if result.rowcount:
+        logger.debug(f"Removed {result.rowcount} unused tags")
+    return result.rowcount
+
+def invalidate_tag_facets():
+    _facets.clear()
+
+# [{'name': ..., 'count': videos}] over the videos the user can see, most used first
+def tag_facets(user):
+    scope = None if user.is_admin else user.id
+    cached = _facets.get(scope)
+    if cached and time.monotonic() - cached[1] < TAG_FACET_TTL:
+        return cached[0]
+
+    count = func.count(video_tags.c.video_id).label('count')
+    query = select(Tag.name, count).join(video_tags, video_tags.c.tag_id == Tag.id)
+    if scope is not None:
+        query = query.join(Video, Video.id == video_tags.c.video_id).where(Video.user_id == scope)
+    rows = db.session.execute(query.group_by(Tag.id, Tag.name).order_by(count.desc(), Tag.name))
+    facets = [{'name': name, 'count': total} for name, total in rows]
+    _facets[scope] = (facets, time.monotonic())
+    return facets
@@ -0,0 +1,141 @@
+# thumbnails.py
+# Grid thumbnails in several sizes and formats from a single ffmpeg run.
+#
+# The frame is found with input seeking (-ss before -i): ffmpeg jumps to the
+# keyframe before the target time and decodes only from there, instead of
+# reading the file from the start. That one frame is cropped square, sharpened
+# and scaled to every THUMBNAIL_SIZES edge, and each size is written in every
+# THUMBNAIL_FORMATS format. File names include a hash of their content, so a
+# regenerated thumbnail gets a new URL and nginx can cache them forever.
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from config import FFMPEG_PATH, THUMBNAIL_SIZES, THUMBNAIL_FORMATS, THUMBNAIL_DEFAULT_SIZE
+from probe import media_duration
+from metrics import THUMBNAIL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Format name -> (file extension, encoder options)
+FORMATS = {
+    'jpeg': ('jpg', ['-c:v', 'mjpeg', '-q:v', '3']),
+    'webp': ('webp', ['-c:v', 'libwebp', '-quality', '80']),
+}
+
+def _frame_rate(info):
+    for stream in info.get('streams', []):
+        if stream.get('codec_type') == 'video':
+            try:
+                num, den = stream.get('avg_frame_rate', '0/0').split('/')
+                return float(num) / float(den)
+            except (ValueError, ZeroDivisionError):
+                return None
+    return None
+
+# The frame at 5 minutes for recordings over 40 minutes, otherwise the 10th frame
+def thumbnail_time(info):
+    duration = media_duration(info) or 0
+    if duration > 40 * 60:
+        return 5 * 60
+    return min(9 / (_frame_rate(info) or 25), duration / 2)
+
+def _ffmpeg_command(video_path, seconds, sizes, formats, directory):
+    outputs = [(size, fmt) for size in sizes for fmt in formats]
+    labels = ''.join(f"[o{i}]" for i in range(len(outputs)))
+    filters = [
+        f"[0:v:0]crop='min(iw,ih)':'min(iw,ih)',setsar=1,"
+        f"scale={max(sizes)}:{max(sizes)}:flags=lanczos,unsharp=5:5:0.5,split={len(outputs)}{labels}"
+    ]
+    output_args = []
+    paths = {}
+    for i, (size, fmt) in enumerate(outputs):
+        extension, options = FORMATS[fmt]
+        filters.append(f"[o{i}]scale={size}:{size}:flags=lanczos[t{i}]")
+        paths[(size, fmt)] = os.path.join(directory, f"{size}.{extension}")
+        output_args += ['-map', f"[t{i}]", '-frames:v', '1', '-update', '1'] + options + [paths[(size, fmt)]]
+    command = [
+        FFMPEG_PATH, '-nostdin', '-y', '-v', 'error',
+        '-ss', f"{seconds:.3f}", '-i', video_path,
+        '-filter_complex', ';'.join(filters)
+    ] + output_args
+    return command, paths
+
+def _run(video_path, seconds, formats, directory):
+    command, paths = _ffmpeg_command(video_path, seconds, THUMBNAIL_SIZES, formats, directory)
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed for {video_path}: {result.stderr.strip()}")
+    return paths
+
+def _written(path):
+    return os.path.exists(path) and os.path.getsize(path) > 0
+
+# Write every size/format for a video into output_dir. Returns the thumbnail
+# set {format: {size: filename}} to store in Video.thumbnail_set. `seconds`
+# overrides the default frame choice (e.g. the storyboard pass's poster_time).
+@THUMBNAIL_SECONDS.time()
+def generate_thumbnails(video_path, output_dir, info, prefix, seconds=None):
+    if seconds is None:
+        seconds = thumbnail_time(info)
+    formats = [fmt for fmt in THUMBNAIL_FORMATS if fmt in FORMATS]
+    logger.debug(f"Generating thumbnails for {video_path} at {seconds:.2f}s")
+
+    work_dir = tempfile.mkdtemp(prefix='.thumbs-', dir=output_dir)
+    try:
+        try:
+            paths = _run(video_path, seconds, formats, work_dir)
+        except RuntimeError:
+            if 'webp' not in formats:
+                raise
+            logger.warning(f"WebP thumbnails failed for {video_path}, retrying with JPEG only", exc_info=True)
+            formats = [fmt for fmt in formats if fmt != 'webp']
+            paths = _run(video_path, seconds, formats, work_dir)
+        # Seeking past the last frame yields no output; fall back to the start
+        if seconds and not all(_written(path) for path in paths.values()):
+            paths = _run(video_path, 0, formats, work_dir)
+        if not all(_written(path) for path in paths.values()):
+            raise RuntimeError(f"Could not read a frame from {video_path}")
+
+        thumbnail_set = {}
+        for (size, fmt), path in paths.items():
+            with open(path, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()[:16]
+            filename = f"{prefix}_{size}_{digest}.{FORMATS[fmt][0]}"
+            os.replace(path, os.path.join(output_dir, filename))
+            os.chmod(os.path.join(output_dir, filename), 0o775)
+            thumbnail_set.setdefault(fmt, {})[str(size)] = filename
+        return thumbnail_set
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+# Everything a thumbnail set depends on besides the content (see derivatives.py)
+def thumbnail_cache_params(seconds):
+    return {'seconds': seconds, 'sizes': THUMBNAIL_SIZES, 'formats': THUMBNAIL_FORMATS}
+
+def thumbnail_set_files(thumbnail_set):
+    return {name for files in thumbnail_set.values() for name in files.values()}
+
+def load_thumbnail_set(video):
+    return json.loads(video.thumbnail_set) if video.thumbnail_set else {}
+
+def load_storyboard(video):
+    return json.loads(video.storyboard) if video.storyboard else {}
+
+# JPEG shown where srcset is not supported
+def default_thumbnail(thumbnail_set):
+    jpeg = thumbnail_set.get('jpeg', {})
+    return jpeg.get(str(THUMBNAIL_DEFAULT_SIZE)) or next(iter(jpeg.values()), None)
+
+# Every file on disk that belongs to a video's thumbnails and storyboard
+def thumbnail_files(video):
+    names = {video.thumbnail} if video.thumbnail else set()
+    names.update(thumbnail_set_files(load_thumbnail_set(video)))
+    storyboard = load_storyboard(video)
+    if storyboard:
+        names.add(storyboard['vtt'])
+        names.update(storyboard['sheets'])
+    return names
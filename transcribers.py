@@ -0,0 +1,135 @@
+# transcribers.py
+# Speech-to-text backends, picked with TRANSCRIBER_BACKEND in config.py:
+#   whisper         openai-whisper on PyTorch; uses CUDA when available
+#   faster-whisper  the same Whisper models converted for CTranslate2, with
+#                   int8 weights on CPU (FASTER_WHISPER_COMPUTE_TYPE)
+# Every backend turns 16 kHz float32 audio into the same segment dicts
+# ({'start', 'end', 'text'}, seconds from the start of the audio), so stored
+# transcripts, the derivative cache and chunked transcription do not depend on
+# the backend. A backend's library is imported on first use; a worker only
+# needs the one it runs.
+import importlib
+import threading
+from config import TRANSCRIBER_BACKEND, WHISPER_DEVICE, FASTER_WHISPER_COMPUTE_TYPE
+
+# Whisper model parameters, for sizing CTranslate2 models in the model cache
+MODEL_PARAMETERS = {'tiny': 39e6, 'base': 74e6, 'small': 244e6, 'medium': 769e6, 'large': 1550e6}
+COMPUTE_TYPE_BYTES = {'int8': 1, 'int8_float32': 1, 'int8_float16': 1, 'int8_bfloat16': 1,
+                      'float16': 2, 'bfloat16': 2, 'float32': 4}
+
+# openai-whisper has no progress callback. Its only progress output is a tqdm
+# bar over the mel frames decoded so far, disabled unless verbose=False. The
+# tqdm module that whisper.transcribe sees is swapped for this shim, which
+# passes the bar's updates to the callback the calling thread registered.
+_progress = threading.local()
+_progress_installed = False
+
+class _ProgressBar:
+    def __init__(self, *args, total=None, **kwargs):
+        self.total = total or 0
+        self.frames = 0
+        self.callback = getattr(_progress, 'callback', None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def update(self, n=1):
+        self.frames += n
+        if self.callback and self.total:
+            self.callback(min(self.frames / self.total, 1.0))
+
+class _TqdmShim:
+    tqdm = _ProgressBar
+
+def _install_progress_bar():
+    global _progress_installed
+    if not _progress_installed:
+        importlib.import_module('whisper.transcribe').tqdm = _TqdmShim
+        _progress_installed = True
+
+# openai-whisper on PyTorch. PyTorch's thread count is process-wide, so a
+# per-job thread count applies to every transcription running in the process
+# at that moment.
+class WhisperBackend:
+    name = 'whisper'
+    threads_per_model = False  # Threads are set per call, not when loading
+
+    def default_device(self):
+        if WHISPER_DEVICE:
+            return WHISPER_DEVICE
+        import torch
+        return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+    def load(self, model_name, device, threads=0):
+        import whisper
+        return whisper.load_model(model_name, device=device)
+
+    # Approximate resident size of a loaded model from its parameters and buffers
+    def model_size(self, model, model_name):
+        tensors = list(model.parameters()) + list(model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+    def release(self):
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def transcribe(self, model, audio, language='en', threads=0, progress=None):
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        _install_progress_bar()
+        _progress.callback = progress
+        try:
+            result = model.transcribe(audio, language=language, word_timestamps=False)
+        finally:
+            _progress.callback = None
+        return [{'start': segment['start'], 'end': segment['end'], 'text': segment['text']} for segment in result['segments']]
+
+# faster-whisper (CTranslate2). Weights are quantised to
+# FASTER_WHISPER_COMPUTE_TYPE when the model is loaded, and the thread count
+# is fixed per loaded model, so models are cached per thread count.
+class FasterWhisperBackend:
+    name = 'faster-whisper'
+    threads_per_model = True
+
+    def default_device(self):
+        if WHISPER_DEVICE:
+            return WHISPER_DEVICE
+        import ctranslate2
+        return 'cuda' if ctranslate2.get_cuda_device_count() > 0 else 'cpu'
+
+    def load(self, model_name, device, threads=0):
+        from faster_whisper import WhisperModel
+        return WhisperModel(model_name, device=device, compute_type=FASTER_WHISPER_COMPUTE_TYPE, cpu_threads=threads or 0)
+
+    # CTranslate2 does not report its memory use; estimate it from the model
+    # size and the weight type
+    def model_size(self, model, model_name):
+        parameters = MODEL_PARAMETERS.get(model_name.split('.')[0].split('-')[0], MODEL_PARAMETERS['medium'])
+        return int(parameters * COMPUTE_TYPE_BYTES.get(FASTER_WHISPER_COMPUTE_TYPE, 4))
+
+    def release(self):
+        pass
+
+    # Greedy decoding with temperature fallback, like openai-whisper's defaults
+    # (faster-whisper defaults to a beam of 5)
+    def transcribe(self, model, audio, language='en', threads=0, progress=None):
+        segments, info = model.transcribe(audio, language=language, beam_size=1, best_of=5, word_timestamps=False)
+        results = []
+        for segment in segments:  # Decoded lazily while iterating
+            results.append({'start': segment.start, 'end': segment.end, 'text': segment.text})
+            if progress and info.duration:
+                progress(min(segment.end / info.duration, 1.0))
+        return results
+
+TRANSCRIBERS = {backend.name: backend for backend in [WhisperBackend(), FasterWhisperBackend()]}
+
+def get_transcriber(name=None):
+    name = name or TRANSCRIBER_BACKEND
+    if name not in TRANSCRIBERS:
+        raise ValueError(f"Unknown transcriber backend '{name}' (choose from {', '.join(TRANSCRIBERS)})")
+    return TRANSCRIBERS[name]
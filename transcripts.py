@@ -0,0 +1,122 @@
+# transcripts.py
+# Timed transcript segments.
+#
+# Whisper's segments are stored as TranscriptSegment rows, written in one bulk
+# INSERT per transcript, and Video.transcription keeps the paragraph text for
+# search. Each row carries the minute it starts in, so the transcription page
+# groups by interval in SQL, and SRT/WebVTT exports stream the rows in order.
+# Manual transcriptions have no timings and are shown from the text alone.
+import itertools
+import logging
+from sqlalchemy import delete, insert, literal, select
+from config import WHISPER_MODELS
+from models import db, Video, TranscriptSegment
+from derivatives import derivative_cache, transcript_params
+from webvtt import vtt_chunks, srt_chunks
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = {'vtt': ('text/vtt', vtt_chunks), 'srt': ('application/x-subrip', srt_chunks)}
+EXPORT_BATCH = 500  # Cues per chunk written to the client
+
+def delete_segments(video_id):
+    db.session.execute(delete(TranscriptSegment).where(TranscriptSegment.video_id == video_id))
+
+# Replace a video's segments with Whisper segments (dicts with start, end and
+# text). Runs in the caller's transaction, so commit afterwards.
+def replace_segments(video_id, segments):
+    delete_segments(video_id)
+    rows = [
+        {'video_id': video_id, 'start': segment['start'], 'end': segment['end'],
+         'minute': int(segment['start'] // 60), 'text': segment['text'].strip()}
+        for segment in segments if segment['text'].strip()
+    ]
+    if rows:
+        db.session.execute(insert(TranscriptSegment), rows)
+
+# Give a video the segments of another video with the same transcript
+def copy_segments(source_id, video_id):
+    delete_segments(video_id)
+    columns = [TranscriptSegment.start, TranscriptSegment.end, TranscriptSegment.minute, TranscriptSegment.text]
+    rows = select(literal(video_id), *columns).where(TranscriptSegment.video_id == source_id)
+    db.session.execute(insert(TranscriptSegment).from_select(['video_id', 'start', 'end', 'minute', 'text'], rows))
+
+def has_segments(video_id):
+    return db.session.query(TranscriptSegment.id).filter_by(video_id=video_id).first() is not None
+
+# Sections of interval minutes with their segments: [{'start': minute, 'end':
+# minute, 'segments': [(seconds, text)]}]. Intervals without speech are left out.
+def transcript_sections(video_id, interval):
+    bucket = (TranscriptSegment.minute // interval).label('bucket')
+    rows = db.session.execute(
+        select(bucket, TranscriptSegment.start, TranscriptSegment.text)
+        .where(TranscriptSegment.video_id == video_id)
+        .order_by(TranscriptSegment.start)
+    )
+    return [
+        {'start': number * interval, 'end': (number + 1) * interval, 'segments': [(start, text) for _, start, text in group]}
+        for number, group in itertools.groupby(rows, key=lambda row: row.bucket)
+    ]
+
+# Sections of a transcript without timings: paragraphs as stored, interval at
+# a time, numbered as if each paragraph were one minute
+def text_sections(text, interval):
+    paragraphs = text.split('\n\n')
+    return [
+        {'start': first, 'end': first + interval, 'segments': [(None, ' '.join(paragraphs[first:first + interval]))]}
+        for first in range(0, len(paragraphs), interval)
+    ]
+
+def iter_segments(video_id):
+    rows = db.session.execute(
+        select(TranscriptSegment.start, TranscriptSegment.end, TranscriptSegment.text)
+        .where(TranscriptSegment.video_id == video_id)
+        .order_by(TranscriptSegment.start)
+        .execution_options(yield_per=EXPORT_BATCH)
+    )
+    for row in rows:
+        yield row.start, row.end, row.text
+
+# A transcript as SRT or WebVTT text, EXPORT_BATCH cues at a time
+def export_chunks(video_id, fmt):
+    chunks = EXPORT_FORMATS[fmt][1](iter_segments(video_id))
+    while True:
+        batch = ''.join(itertools.islice(chunks, EXPORT_BATCH))
+        if not batch:
+            return
+        yield batch
+
+# Create segments for transcripts stored before TranscriptSegment existed.
+# The derivative cache still holds Whisper's timings for transcripts made
+# since it was added; the one whose text matches is used. With approximate,
+# other transcripts get one segment per paragraph at the minute the old
+# transcription page showed for it. Returns the number of videos per outcome.
+def migrate_transcripts(approximate=False):
+    counts = {'cached': 0, 'approximated': 0, 'unmatched': 0}
+    videos = db.session.query(Video).filter(
+        Video.transcription_status == 'completed',
+        Video.transcription.isnot(None),
+        ~db.session.query(TranscriptSegment.id).filter(TranscriptSegment.video_id == Video.id).exists()
+    ).order_by(Video.id).all()
+    for video in videos:
+        cached = None
+        for model_name in WHISPER_MODELS:
+            entry = derivative_cache.load_json('transcript', video.checksum, transcript_params(model_name))
+            if entry and entry['text'] == video.transcription:
+                cached = entry
+                break
+        if cached:
+            replace_segments(video.id, cached['segments'])
+            counts['cached'] += 1
+        elif approximate:
+            paragraphs = video.transcription.split('\n\n')
+            replace_segments(video.id, [
+                {'start': minute * 60.0, 'end': (minute + 1) * 60.0, 'text': paragraph}
+                for minute, paragraph in enumerate(paragraphs)
+            ])
+            counts['approximated'] += 1
+        else:
+            logger.info(f"No timings found for the transcript of video {video.id}")
+            counts['unmatched'] += 1
+        db.session.commit()
+    return counts
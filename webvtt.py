@@ -0,0 +1,33 @@
+# webvtt.py
+# Minimal WebVTT and SubRip writers for storyboard, chapter and transcript tracks.
+
+def _timestamp(seconds, separator):
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600 * 1000)
+    minutes, milliseconds = divmod(milliseconds, 60 * 1000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{separator}{milliseconds:03d}"
+
+def vtt_timestamp(seconds):
+    return _timestamp(seconds, '.')
+
+def srt_timestamp(seconds):
+    return _timestamp(seconds, ',')
+
+def _cue_text(text):
+    return text.strip().replace('\n\n', '\n')  # A blank line would end the cue
+
+# Yield a WebVTT document piece by piece from (start, end, text) cues, so long
+# transcripts can be streamed
+def vtt_chunks(cues):
+    yield 'WEBVTT\n\n'
+    for start, end, text in cues:
+        yield f"{vtt_timestamp(start)} --> {vtt_timestamp(end)}\n{_cue_text(text)}\n\n"
+
+def srt_chunks(cues):
+    for number, (start, end, text) in enumerate(cues, start=1):
+        yield f"{number}\n{srt_timestamp(start)} --> {srt_timestamp(end)}\n{_cue_text(text)}\n\n"
+
+# Render (start, end, text) cues as a WebVTT document
+def vtt_document(cues):
+    return ''.join(vtt_chunks(cues))
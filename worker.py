@@ -0,0 +1,324 @@
+# worker.py
+# Media worker daemon. Drains the job queue (thumbnails, storyboards, HLS
+# renditions, fingerprints, transcriptions) in its own process so the gunicorn
+# web workers stay free of torch/whisper.
+#
+#   python worker.py [--workers N]
+import argparse
+import functools
+import json
+import os
+import signal
+import threading
+import logging
+from app import app, queue_transcription
+from config import JOB_WORKERS, WHISPER_MODEL, WHISPER_MODELS
+from models import db, Video, Job, Chapter, Rendition
+from jobs import JobWorkerPool, enqueue_job, job_payload
+from blobs import video_file_path, sibling_videos, copy_derived, copy_renditions
+from media import transcribe_video
+from metadata import video_info
+from thumbnails import generate_thumbnails, default_thumbnail, thumbnail_files, thumbnail_cache_params, thumbnail_set_files
+from storyboard import StoryboardResult, build_storyboard, storyboard_cache_params
+from derivatives import derivative_cache
+from hls import plan_renditions, rendition_spec, transcode_rendition, write_master_playlist, remove_rendition_files
+from storage import expire_upload_sessions
+from search import index_video
+from transcripts import copy_segments
+from progress import report_progress
+from fingerprints import extract_fingerprint, load_fingerprint, store_fingerprint, find_near_duplicates
+from duplicates import record_near_duplicates, can_open_content
+
+logger = logging.getLogger('worker')
+
+# Record a job handler's stage as running, then done or failed, for the
+# progress panel (see progress.py). stage may be a function of the job.
+def tracked(stage):
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(job):
+            name = stage(job) if callable(stage) else stage
+            report_progress(job.video_id, name)
+            try:
+                handler(job)
+            except Exception as e:
+                report_progress(job.video_id, name, 'failed', message=str(e))
+                raise
+            report_progress(job.video_id, name, 'done')
+        return wrapper
+    return decorator
+
+# Job handler that fingerprints new content and looks for likely duplicates
+# (see fingerprints.py). Uploads wait here with transcription 'queued' but no
+# job: transcription is queued when nothing matches, and held for the user to
+# decide when the upload looks like a re-encode of something already archived
+# that the uploader can open.
+@tracked('fingerprint')
+def run_fingerprint_job(job):
+    video = db.session.get(Video, job.video_id)
+    if not video:
+        logger.error(f"Video {job.video_id} for job {job.id} no longer exists")
+        return
+    try:
+        hashes = None if job_payload(job).get('force') else load_fingerprint(video.checksum)
+        if hashes is None:
+            hashes = extract_fingerprint(video_file_path(video), video_info(video))
+            store_fingerprint(video.checksum, hashes)
+            db.session.commit()
+        matches = find_near_duplicates(video.checksum, hashes)
+        record_near_duplicates(video.checksum, matches)
+        db.session.commit()
+    except Exception as e:
+        # Never leave an upload waiting on a check that cannot run
+        db.session.rollback()
+        logger.error(f"Fingerprinting video {job.video_id} failed: {str(e)}", exc_info=True)
+        matches = []
+        video = db.session.get(Video, job.video_id)
+    if matches:
+        logger.info(f"Video {video.id} looks like a duplicate of content {', '.join(checksum[:12] for checksum, _ in matches)}")
+
+    waiting = [
+        copy for copy in [video] + sibling_videos(video)
+        if copy.transcription_status == 'queued' and not db.session.query(Job.id).filter(
+            Job.video_id == copy.id, Job.kind == 'transcribe', Job.status.in_(['queued', 'running'])
+        ).first()
+    ]
+    if not waiting:
+        return
+    # A copy is held only when its uploader is shown a match they can open;
+    # matches in other users' archives are never mentioned to them
+    held = [copy for copy in waiting if any(can_open_content(checksum, copy.uploader) for checksum, _ in matches)]
+    if held:
+        for copy in held:
+            copy.transcription_status = None
+        db.session.commit()
+        logger.info(f"Transcription of video{'s' if len(held) != 1 else ''} {', '.join(str(copy.id) for copy in held)} held until a user starts it")
+    rest = [copy for copy in waiting if copy not in held]
+    if rest:
+        queue_transcription(rest[0])  # The other queued copies get the result (see share_transcription)
+
+# Job handler for queued thumbnails. The set is taken from the derivative
+# cache when the same content was thumbnailed at the same time before, unless
+# the job asks to force a new run.
+@tracked('thumbnails')
+def run_thumbnail_job(job):
+    video = db.session.get(Video, job.video_id)
+    if not video:
+        logger.error(f"Video {job.video_id} for job {job.id} no longer exists")
+        return
+    video_path = video_file_path(video)
+    thumbnail_folder = app.config['THUMBNAIL_FOLDER']
+    old_files = thumbnail_files(video)
+    params = thumbnail_cache_params(video.poster_time)
+    thumbnail_set = None
+    if not job_payload(job).get('force'):
+        thumbnail_set = derivative_cache.restore_files('thumbnails', video.checksum, params, thumbnail_folder)
+    if thumbnail_set is None:
+        thumbnail_set = generate_thumbnails(video_path, thumbnail_folder, video_info(video),
+                                            prefix=f"v{video.id}", seconds=video.poster_time)
+        derivative_cache.store_files('thumbnails', video.checksum, params, thumbnail_folder,
+                                     thumbnail_set_files(thumbnail_set), thumbnail_set)
+    video.thumbnail_set = json.dumps(thumbnail_set)
+    video.thumbnail = default_thumbnail(thumbnail_set)
+    share_derived(video)
+    db.session.commit()
+    remove_unreferenced_files(video, old_files)
+
+# Job handler for queued storyboards: sprites, chapters and the poster frame,
+# from the derivative cache unless forced
+@tracked('storyboard')
+def run_storyboard_job(job):
+    video = db.session.get(Video, job.video_id)
+    if not video:
+        logger.error(f"Video {job.video_id} for job {job.id} no longer exists")
+        return
+    video_path = video_file_path(video)
+    thumbnail_folder = app.config['THUMBNAIL_FOLDER']
+    old_files = thumbnail_files(video)
+    params = storyboard_cache_params()
+    cached = None
+    if not job_payload(job).get('force'):
+        cached = derivative_cache.restore_files('storyboard', video.checksum, params, thumbnail_folder)
+    if cached:
+        result = StoryboardResult(cached['files'], cached['chapters'], cached['poster_time'], cached['frames'], cached['seconds'])
+    else:
+        result = build_storyboard(video_path, thumbnail_folder, video_info(video), prefix=f"v{video.id}")
+        derivative_cache.store_files('storyboard', video.checksum, params, thumbnail_folder,
+                                     [result.files['vtt']] + result.files['sheets'], {
+                                         'files': result.files, 'chapters': result.chapters, 'poster_time': result.poster_time,
+                                         'frames': result.frames, 'seconds': result.seconds,
+                                     })
+    video.storyboard = json.dumps(result.files)
+    video.poster_time = result.poster_time
+    video.chapters = [
+        Chapter(start=start, end=end, title=f"Chapter {number}")
+        for number, (start, end) in enumerate(result.chapters, start=1)
+    ]
+    share_derived(video)
+    db.session.commit()
+    remove_unreferenced_files(video, old_files)
+
+    # Regenerate the grid thumbnails from the chosen poster frame
+    if result.poster_time is not None:
+        enqueue_job(video.id, 'thumbnail')
+
+# Job handler that plans a video's HLS ladder and queues one 'hls' job per rendition
+def run_hls_plan_job(job):
+    video = db.session.get(Video, job.video_id)
+    if not video:
+        logger.error(f"Video {job.video_id} for job {job.id} no longer exists")
+        return
+    hls_folder = app.config['HLS_FOLDER']
+    video_path = video_file_path(video)
+    specs = plan_renditions(video_info(video))
+    if not specs:
+        logger.info(f"Video {video.id} has no video stream; skipping HLS")
+
+    existing = {rendition.name: rendition for rendition in video.renditions}
+    for spec in specs:
+        rendition = existing.pop(spec.name, None)
+        if not rendition:
+            rendition = Rendition(name=spec.name)
+            video.renditions.append(rendition)
+        rendition.width = spec.width
+        rendition.height = spec.height
+        rendition.status = 'queued'
+        rendition.error = None
+    # Rungs no longer in the ladder
+    for rendition in existing.values():
+        remove_rendition_files(hls_folder, rendition.playlist)
+        video.renditions.remove(rendition)
+    share_renditions(video.id)
+    db.session.commit()
+    write_master_playlist(hls_folder, video)
+
+    for spec in specs:
+        enqueue_job(video.id, 'hls', payload={'rendition': spec.name})
+
+# Job handler that encodes one HLS rendition
+@tracked(lambda job: f"hls {job_payload(job).get('rendition')}")
+def run_hls_job(job):
+    name = job_payload(job).get('rendition')
+    rendition = db.session.query(Rendition).filter_by(video_id=job.video_id, name=name).first()
+    spec = rendition_spec(rendition) if rendition else None
+    if not spec:
+        logger.error(f"Rendition {name} of video {job.video_id} for job {job.id} no longer exists")
+        return
+    video = db.session.get(Video, job.video_id)
+    hls_folder = app.config['HLS_FOLDER']
+    video_path = video_file_path(video)
+    rendition.status = 'running'
+    db.session.commit()
+
+    try:
+        playlist, bandwidth = transcode_rendition(video_path, hls_folder, video.checksum, spec, video_info(video))
+    except Exception as e:
+        db.session.rollback()
+        rendition = db.session.get(Rendition, rendition.id)
+        rendition.status = 'failed'
+        rendition.error = str(e)
+        share_renditions(rendition.video_id)
+        db.session.commit()
+        raise
+
+    old_playlist = rendition.playlist
+    rendition.playlist = playlist
+    rendition.bandwidth = bandwidth
+    rendition.status = 'completed'
+    rendition.error = None
+    share_renditions(video.id)
+    db.session.commit()
+    write_master_playlist(hls_folder, video)
+    if old_playlist and old_playlist != playlist:
+        remove_rendition_files(hls_folder, old_playlist)
+    logger.info(f"Video {video.id}: {spec.name} rendition ready ({bandwidth // 1000} kbit/s peak)")
+
+# Copies of the same upload share its derived files (see blobs.py)
+def share_derived(video):
+    for sibling in sibling_videos(video):
+        copy_derived(video, sibling)
+
+def share_renditions(video_id):
+    video = db.session.get(Video, video_id)
+    for sibling in sibling_videos(video):
+        copy_renditions(video, sibling)
+
+# Delete thumbnail/storyboard files of a previous run that neither the video
+# nor a copy sharing its content references any more
+def remove_unreferenced_files(video, old_files):
+    referenced = thumbnail_files(video)
+    for sibling in sibling_videos(video):
+        referenced |= thumbnail_files(sibling)
+    for name in old_files - referenced:
+        try:
+            os.remove(os.path.join(app.config['THUMBNAIL_FOLDER'], name))
+        except FileNotFoundError:
+            pass
+
+# Job handler for queued transcriptions
+@tracked('transcription')
+def run_transcription_job(job):
+    video = db.session.get(Video, job.video_id)
+    if not video:
+        logger.error(f"Video {job.video_id} for job {job.id} no longer exists")
+        return
+    model_name = job_payload(job).get('model', WHISPER_MODEL)
+    if model_name not in WHISPER_MODELS:
+        logger.warning(f"Unknown Whisper model '{model_name}' for job {job.id}; using '{WHISPER_MODEL}'")
+        model_name = WHISPER_MODEL
+    video_path = video_file_path(video)
+    transcribe_video(video_path, video.id, model_name=model_name, force=job_payload(job).get('force', False),
+                     threads=job_payload(job).get('threads'))
+    share_transcription(video.id)
+
+# Copies of the same upload that were waiting for this transcription (rather
+# than for one of their own) get the result too
+def share_transcription(video_id):
+    video = db.session.get(Video, video_id)
+    if not video or video.transcription_status != 'completed':
+        return
+    for sibling in sibling_videos(video):
+        own_job = db.session.query(Job.id).filter(
+            Job.video_id == sibling.id,
+            Job.kind == 'transcribe',
+            Job.status.in_(['queued', 'running'])
+        ).first()
+        if sibling.transcription_status == 'queued' and not own_job:
+            sibling.transcription = video.transcription
+            sibling.transcription_status = 'completed'
+            copy_segments(video.id, sibling.id)
+            index_video(sibling)
+            logger.info(f"Video {sibling.id}: shared transcription of video {video.id}")
+    db.session.commit()
+
+JOB_HANDLERS = {
+    'fingerprint': run_fingerprint_job,
+    'thumbnail': run_thumbnail_job,
+    'storyboard': run_storyboard_job,
+    'hls_plan': run_hls_plan_job,
+    'hls': run_hls_job,
+    'transcribe': run_transcription_job,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description='Video Archive media worker')
+    parser.add_argument('--workers', type=int, default=JOB_WORKERS, help='Number of concurrent jobs')
+    args = parser.parse_args()
+
+    pool = JobWorkerPool(app, JOB_HANDLERS, size=args.workers, maintenance=[expire_upload_sessions])
+    stopping = threading.Event()
+
+    def handle_signal(signum, frame):
+        logger.info(f"Received signal {signum}, finishing running jobs")
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    pool.start()
+    stopping.wait()
+    pool.stop()
+    logger.info("Worker stopped")
+
+if __name__ == '__main__':
+    main()